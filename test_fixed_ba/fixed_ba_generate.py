@@ -3,6 +3,8 @@ import symforce
 
 symforce.set_epsilon_to_symbol()
 
+import os
+
 from symforce import path_util
 from symforce.examples.bundle_adjustment_fixed_size.generate_fixed_problem import (
     FixedBundleAdjustmentProblem,
@@ -39,5 +41,5 @@ if __name__ == "__main__":
     BundleAdjustmentExampleCodegenTest.main()
 """
 
-output_dir="/root/dev/python_ws/test_fixed_ba"
+output_dir = os.environ.get("SYMFORCE_OUTPUT_DIR", "/root/dev/python_ws/test_fixed_ba")
 FixedBundleAdjustmentProblem(2, 20).generate(output_dir=output_dir)
@@ -0,0 +1,102 @@
+import json
+
+import numpy as np
+
+from symforce import typing as T
+
+# 可以直接np.memmap的数组文件: MAGIC, uint64的header长度, json header, 然后是按ALIGNMENT对齐的原始数组.
+# header里的"arrays"记录每个数组的dtype/shape/offset(相对数据区的起点), 其他字段由调用方决定.
+
+ALIGNMENT = 64
+
+
+def aligned(nbytes: int) -> int:
+    return -(-nbytes // ALIGNMENT) * ALIGNMENT
+
+
+def array_layout(
+    specs: T.Mapping[str, T.Tuple[np.dtype, T.Sequence[int]]]
+) -> T.Tuple[T.Dict[str, T.Dict[str, T.Any]], int]:
+    """
+    Header entries of arrays with the given (dtype, shape), and the size of the data section.
+    """
+    entries = {}
+    offset = 0
+    for key, (dtype, shape) in specs.items():
+        dtype = np.dtype(dtype)
+        entries[key] = dict(dtype=dtype.str, shape=list(shape), offset=offset)
+        offset += aligned(int(np.prod(shape)) * dtype.itemsize)
+    return entries, offset
+
+
+def write_header(f: T.BinaryIO, magic: bytes, header: T.Dict[str, T.Any]) -> int:
+    """
+    Returns the offset of the data section.
+    """
+    encoded = json.dumps(header).encode()
+    f.write(magic)
+    f.write(np.uint64(len(encoded)).tobytes())
+    f.write(encoded)
+    return aligned(len(magic) + 8 + len(encoded))
+
+
+def write_array_file(
+    path: T.Openable, magic: bytes, header: T.Dict[str, T.Any], arrays: T.Mapping[str, np.ndarray]
+) -> int:
+    """
+    Write the arrays after the header (plus their "arrays" entries). Returns the file size in bytes.
+    """
+    arrays = {key: np.ascontiguousarray(value) for key, value in arrays.items()}
+    entries, data_size = array_layout({key: (value.dtype, value.shape) for key, value in arrays.items()})
+    with open(path, "wb") as f:
+        data_start = write_header(f, magic, dict(header, arrays=entries))
+        for key, value in arrays.items():
+            f.seek(data_start + entries[key]["offset"])
+            f.write(value.tobytes())
+        f.truncate(data_start + data_size)
+    return data_start + data_size
+
+
+def create_array_file(
+    path: T.Openable,
+    magic: bytes,
+    header: T.Dict[str, T.Any],
+    specs: T.Mapping[str, T.Tuple[np.dtype, T.Sequence[int]]],
+) -> T.Dict[str, np.memmap]:
+    """
+    Allocate the file for arrays with the given (dtype, shape) and return them as writable memmaps.
+    """
+    entries, data_size = array_layout(specs)
+    with open(path, "wb") as f:
+        data_start = write_header(f, magic, dict(header, arrays=entries))
+        f.truncate(data_start + data_size)
+    return {
+        key: np.memmap(
+            path, dtype=np.dtype(dtype), mode="r+", offset=data_start + entries[key]["offset"], shape=tuple(shape)
+        )
+        for key, (dtype, shape) in specs.items()
+    }
+
+
+def read_array_file(
+    path: T.Openable, magic: bytes, mmap: bool = True
+) -> T.Tuple[T.Dict[str, T.Any], T.Dict[str, np.ndarray]]:
+    """
+    Returns the header and the arrays, as read-only memmaps if mmap.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(f"{path} is not a {magic.decode()} file")
+        header_size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(header_size))
+    data_start = aligned(len(magic) + 8 + header_size)
+
+    arrays = {}
+    for key, entry in header["arrays"].items():
+        dtype, shape = np.dtype(entry["dtype"]), tuple(entry["shape"])
+        offset = data_start + entry["offset"]
+        if mmap and int(np.prod(shape)) > 0:
+            arrays[key] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+        else:
+            arrays[key] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+    return header, arrays
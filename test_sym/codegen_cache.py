@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import symforce
+from symforce import codegen
+from symforce import typing as T
+
+# 生成代码的缓存: 以符号输出表达式、codegen配置和which_args的哈希作为key,
+# 命中时直接把之前生成的文件拷贝回output_dir, 跳过求jacobian和CSE.
+# 每个条目是cache_dir/<key>/下的一个目录, 用manifest.json的修改时间做LRU.
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("VINS_CODEGEN_CACHE", Path.home() / ".cache" / "vins_codegen"))
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+MANIFEST = "manifest.json"
+
+
+def codegen_key(
+    func_codegen: codegen.Codegen, which_args: T.Optional[T.Sequence[str]] = None
+) -> str:
+    """
+    Hash of everything the generated files depend on: the symbolic inputs and outputs, the
+    docstring, the codegen config and the linearized arguments.
+    """
+    digest = hashlib.sha256()
+    for part in (
+        symforce.__version__,
+        func_codegen.name,
+        func_codegen.docstring,
+        repr(func_codegen.config),
+        repr(list(which_args) if which_args is not None else None),
+        str(func_codegen.inputs),
+        str(func_codegen.outputs.to_storage()),
+    ):
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CodegenCache:
+    """
+    Content-addressed cache of generated files, bounded to max_bytes with LRU eviction.
+    """
+
+    def __init__(
+        self, cache_dir: T.Optional[T.Openable] = None, max_bytes: int = DEFAULT_MAX_BYTES
+    ) -> None:
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def restore(self, key: str, output_dir: T.Openable) -> T.Optional[T.List[Path]]:
+        entry = self.cache_dir / key
+        manifest = entry / MANIFEST
+        if not manifest.exists():
+            return None
+        restored = []
+        for relative_path in json.loads(manifest.read_text())["files"]:
+            destination = Path(output_dir) / relative_path
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(entry / "files" / relative_path, destination)
+            restored.append(destination)
+        # 更新修改时间, 标记为最近使用
+        os.utime(manifest)
+        return restored
+
+    def store(self, key: str, output_dir: T.Openable, generated_files: T.Sequence[Path]) -> None:
+        output_dir = Path(output_dir).resolve()
+        relative_paths = []
+        for generated_file in generated_files:
+            try:
+                relative_paths.append(Path(generated_file).resolve().relative_to(output_dir))
+            except ValueError:
+                # 生成到output_dir以外的文件无法恢复, 不缓存
+                return
+
+        # 先写到临时目录再重命名, 避免并行生成时读到写了一半的条目
+        staging = Path(tempfile.mkdtemp(prefix=f".{key}.", dir=self.cache_dir))
+        for relative_path in relative_paths:
+            destination = staging / "files" / relative_path
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(output_dir / relative_path, destination)
+        (staging / MANIFEST).write_text(
+            json.dumps(
+                {
+                    "files": [str(path) for path in relative_paths],
+                    "bytes": sum((output_dir / path).stat().st_size for path in relative_paths),
+                }
+            )
+        )
+        try:
+            staging.rename(self.cache_dir / key)
+        except OSError:
+            # 其他进程已经写入了同一个key
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for manifest in self.cache_dir.glob(f"*/{MANIFEST}"):
+            stat = manifest.stat()
+            entries.append((stat.st_mtime, json.loads(manifest.read_text())["bytes"], manifest.parent))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_bytes -= size
+
+    def generate(
+        self,
+        func_codegen: codegen.Codegen,
+        output_dir: T.Optional[T.Openable],
+        generate: T.Callable[[], T.Sequence[Path]],
+        which_args: T.Optional[T.Sequence[str]] = None,
+    ) -> T.List[Path]:
+        """
+        Restore the files generated for func_codegen from the cache, or call generate() and
+        cache the files it returns.
+
+        Args:
+            func_codegen: the Codegen object before linearization, only used for the key
+            generate: does the actual (linearization and) code generation into output_dir
+            which_args: the arguments generate() linearizes with respect to
+        """
+        if output_dir is None:
+            # 输出到临时目录时没有缓存的意义
+            return list(generate())
+
+        start = time.perf_counter()
+        key = codegen_key(func_codegen, which_args)
+        restored = self.restore(key, output_dir)
+        if restored is not None:
+            self.hits += 1
+            print(f"codegen cache hit: {func_codegen.name} ({time.perf_counter() - start:.2f} s)")
+            return restored
+
+        self.misses += 1
+        generated_files = list(generate())
+        self.store(key, output_dir, generated_files)
+        print(f"codegen cache miss: {func_codegen.name} ({time.perf_counter() - start:.2f} s)")
+        return generated_files
@@ -0,0 +1,113 @@
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+from symforce.values import Values
+
+# 把只依赖"每次迭代才变化"的参数(比如gnc_mu, gnc_scale, epsilon)的子表达式提取出来:
+# 生成一个precompute函数, 每次迭代调用一次, 结果作为precomputed参数传给每个因子.
+# 每个因子就不用重复计算这些值(比如BarronNoiseModel的alpha).
+
+PRECOMPUTED_KEY = "precomputed"
+
+
+def hoist_subexpressions(
+    exprs: T.Sequence[sf.Expr], per_iteration_symbols: T.Set[sf.Symbol]
+) -> T.Tuple[T.List[sf.Expr], T.List[sf.Expr], T.List[sf.Symbol]]:
+    """
+    Replace every maximal subexpression of exprs whose free symbols are all in
+    per_iteration_symbols (and that is not itself a symbol or a number) by a new symbol.
+
+    Returns:
+        the rewritten expressions, the hoisted subexpressions and the symbols replacing them
+    """
+    hoisted: T.Dict[sf.Expr, sf.Symbol] = {}
+    memo: T.Dict[sf.Expr, sf.Expr] = {}
+
+    def visit(expr: sf.Expr) -> sf.Expr:
+        if expr in memo:
+            return memo[expr]
+        args = getattr(expr, "args", ())
+        free_symbols = getattr(expr, "free_symbols", set())
+        if not args:
+            result = expr
+        elif free_symbols and free_symbols <= per_iteration_symbols:
+            if expr not in hoisted:
+                hoisted[expr] = sf.Symbol(f"{PRECOMPUTED_KEY}{len(hoisted)}")
+            result = hoisted[expr]
+        else:
+            if isinstance(expr, (sf.Add, sf.Mul)):
+                # Add/Mul的参数顺序是任意的, 把其中只依赖每次迭代参数的项合并成一个子表达式
+                constant_args = [
+                    arg
+                    for arg in args
+                    if getattr(arg, "free_symbols", set()) <= per_iteration_symbols
+                ]
+                if len(constant_args) > 1 and any(getattr(arg, "free_symbols", None) for arg in constant_args):
+                    other_args = [arg for arg in args if arg not in constant_args]
+                    args = (expr.func(*constant_args), *other_args)
+            new_args = [visit(arg) for arg in args]
+            # symengine里symforce自定义的函数(比如copysign_no_zero)没有func, 直接用类型构造
+            result = type(expr)(*new_args) if isinstance(expr, sf.sympy.Function) else expr.func(*new_args)
+        memo[expr] = result
+        return result
+
+    rewritten = [visit(sf.S(expr)) for expr in exprs]
+    return rewritten, list(hoisted.keys()), list(hoisted.values())
+
+
+def split_per_iteration_codegen(
+    func_codegen: codegen.Codegen,
+    per_iteration_args: T.Sequence[str],
+    name: T.Optional[str] = None,
+) -> T.Tuple[codegen.Codegen, codegen.Codegen]:
+    """
+    Split func_codegen (typically already linearized) into a precompute function of the
+    per_iteration_args and a per-factor function taking its result.
+
+    The per-factor function keeps the inputs of func_codegen, except the per_iteration_args that
+    only appear inside hoisted subexpressions, and takes an extra last input "precomputed".
+
+    Returns:
+        (precompute codegen, per-factor codegen)
+    """
+    name = name or func_codegen.name
+    per_iteration_symbols: T.Set[sf.Symbol] = set()
+    for key in per_iteration_args:
+        per_iteration_symbols.update(
+            sf.S(x) for x in Values(**{key: func_codegen.inputs[key]}).to_storage()
+        )
+
+    outputs_storage = func_codegen.outputs.to_storage()
+    rewritten, hoisted, placeholders = hoist_subexpressions(outputs_storage, per_iteration_symbols)
+
+    precompute_inputs = Values(**{key: func_codegen.inputs[key] for key in per_iteration_args})
+    precompute_codegen = codegen.Codegen(
+        inputs=precompute_inputs,
+        outputs=Values(**{PRECOMPUTED_KEY: sf.Matrix(hoisted)}),
+        config=func_codegen.config,
+        name=f"{name}_precompute",
+        return_key=PRECOMPUTED_KEY,
+    )
+
+    # 还在被直接使用的每次迭代参数(比如和状态相加的epsilon)保留为输入
+    used_symbols: T.Set[sf.Symbol] = set()
+    for expr in rewritten:
+        used_symbols.update(getattr(expr, "free_symbols", set()))
+    factor_inputs = Values()
+    for key, value in func_codegen.inputs.items():
+        if key in per_iteration_args and not (
+            set(sf.S(x) for x in Values(**{key: value}).to_storage()) & used_symbols
+        ):
+            continue
+        factor_inputs[key] = value
+    factor_inputs[PRECOMPUTED_KEY] = sf.Matrix(placeholders)
+
+    factor_codegen = codegen.Codegen(
+        inputs=factor_inputs,
+        outputs=func_codegen.outputs.from_storage(rewritten),
+        config=func_codegen.config,
+        name=f"{name}_hoisted",
+        return_key=func_codegen.return_key,
+        sparse_matrices=list(func_codegen.sparse_mat_data) or None,
+    )
+    return precompute_codegen, factor_codegen
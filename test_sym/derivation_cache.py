@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import symforce
+import symforce.symbolic as sf
+from symforce import typing as T
+from symforce.values import Values
+
+# 符号推导结果的缓存: 跳过耗时的推导(如test_sym4里theta的sp.expand/sp.factor), 直接读回推导出的矩阵.
+# 每个条目是cache_dir/<key>.json, 表达式按str保存, 读回时用sympify解析.
+# symforce的Symbol不能pickle, 所以只缓存str能原样解析回来的表达式(多项式/有理式), 其他的每次重新推导.
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("VINS_DERIVATION_CACHE", Path.home() / ".cache" / "vins_derivation"))
+
+
+def derivation_key(*parts: T.Any) -> str:
+    """
+    Hash of everything the derivation depends on, e.g. the State layout, the source of the
+    derivation function and its symbolic inputs.
+    """
+    digest = hashlib.sha256()
+    for part in (symforce.__version__,) + parts:
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def values_layout(values: Values) -> T.List[T.Tuple[str, str, int, int]]:
+    """
+    (key, type, storage_dim, tangent_dim) of every entry of values, in order.
+    """
+    return [
+        (key, type(value).__name__, value.storage_dim(), value.tangent_dim())
+        for key, value in values.items_recursive()
+    ]
+
+
+def serialize_matrix(matrix: sf.Matrix, placeholders: T.Dict[str, str]) -> T.Optional[T.Dict[str, T.Any]]:
+    """
+    Row-major strings of the elements, or None if an element does not survive the
+    str -> sympify round trip (e.g. it contains functions the parser does not know).
+
+    Symbol names like "state[0]" can not be parsed, so the symbols are printed as placeholders
+    x0, x1, ...; placeholders maps symbol names to them and is shared by all the matrices of an
+    entry.
+    """
+    symbols = {placeholder: sf.Symbol(name) for name, placeholder in placeholders.items()}
+    rows, cols = matrix.shape
+    elements = []
+    for i in range(rows):
+        for j in range(cols):
+            element = matrix[i, j]
+            renamed = {}
+            for symbol in element.free_symbols:
+                if symbol.name not in placeholders:
+                    placeholders[symbol.name] = f"x{len(placeholders)}"
+                    symbols[placeholders[symbol.name]] = symbol
+                renamed[symbol] = sf.Symbol(placeholders[symbol.name])
+            text = str(element.xreplace(renamed))
+            if parse_element(text, symbols) != element:
+                return None
+            elements.append(text)
+    return dict(shape=[rows, cols], elements=elements)
+
+
+def parse_element(text: str, symbols: T.Mapping[str, sf.Symbol]) -> sf.Scalar:
+    element = sf.sympy.sympify(text)
+    return element.xreplace({symbol: symbols[symbol.name] for symbol in element.free_symbols})
+
+
+def deserialize_matrix(data: T.Dict[str, T.Any], symbols: T.Mapping[str, sf.Symbol]) -> sf.Matrix:
+    rows, cols = data["shape"]
+    return sf.Matrix(rows, cols, [parse_element(text, symbols) for text in data["elements"]])
+
+
+class DerivationCache:
+    """
+    On-disk cache of named symbolic matrices produced by a derivation.
+    """
+
+    def __init__(self, cache_dir: T.Optional[T.Openable] = None) -> None:
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else DEFAULT_CACHE_DIR
+        self.hits = 0
+        self.misses = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def load(self, key: str) -> T.Optional[T.Dict[str, sf.Matrix]]:
+        entry = self.cache_dir / f"{key}.json"
+        if not entry.exists():
+            return None
+        data = json.loads(entry.read_text())
+        symbols = {placeholder: sf.Symbol(name) for name, placeholder in data["placeholders"].items()}
+        return {name: deserialize_matrix(matrix, symbols) for name, matrix in data["matrices"].items()}
+
+    def store(self, key: str, matrices: T.Mapping[str, sf.Matrix]) -> bool:
+        placeholders: T.Dict[str, str] = {}
+        serialized = {}
+        for name, matrix in matrices.items():
+            data = serialize_matrix(matrix, placeholders)
+            if data is None:
+                return False
+            serialized[name] = data
+
+        # 先写到临时文件再重命名, 避免并行生成时读到写了一半的条目
+        fd, staging = tempfile.mkstemp(prefix=f".{key}.", dir=self.cache_dir)
+        with os.fdopen(fd, "w") as f:
+            json.dump(dict(placeholders=placeholders, matrices=serialized), f)
+        os.replace(staging, self.cache_dir / f"{key}.json")
+        return True
+
+    def derive(
+        self, name: str, key: str, derive: T.Callable[[], T.Mapping[str, sf.Matrix]]
+    ) -> T.Dict[str, sf.Matrix]:
+        """
+        Load the matrices cached under key, or call derive() and cache what it returns.
+        """
+        start = time.perf_counter()
+        matrices = self.load(key)
+        if matrices is not None:
+            self.hits += 1
+            print(f"derivation cache hit: {name} ({time.perf_counter() - start:.2f} s)")
+            return matrices
+
+        self.misses += 1
+        matrices = dict(derive())
+        stored = self.store(key, matrices)
+        print(
+            f"derivation cache miss: {name} ({time.perf_counter() - start:.2f} s)"
+            + ("" if stored else ", not cacheable")
+        )
+        return matrices
@@ -0,0 +1,198 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from symforce import codegen
+from symforce import typing as T
+
+from gnss import EARTH_SEMI_MAJOR
+from gnss import GNSS_FIXED_ANCHOR_LINEARIZATION_ARGS
+from gnss import gnss_psr_dopp_fixed_anchor_residual
+from imu_residual_variants import IMU_LINEARIZATION_ARGS
+from landmark_schur import quat_from_tangent
+from landmark_schur import quat_multiply
+from landmark_schur import quat_to_matrix
+from numpy_codegen import NumpyBatchMetadata
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+from projection_batch import PROJECTION_LINEARIZATION_ARGS
+from vins import imu_residual
+from vins import projection_gnc_residual
+
+# float32和float64版本的因子在相同的随机输入上比较每个输出的最大相对误差.
+# 生成的C++代码是Scalar模板, float版本就是实例化成float; 这里用同样CSE之后的表达式生成的
+# numpy批量函数来测试, dtype分别是float32和float64, 所以误差反映的是表达式本身在float下的精度.
+# 同时打印的耗时只是numpy批量函数每个样本的时间(主要是数组运算的开销), 不代表C++ float版本的速度.
+
+FACTORS = {
+    "projection": (projection_gnc_residual, PROJECTION_LINEARIZATION_ARGS),
+    "imu": (imu_residual, IMU_LINEARIZATION_ARGS),
+    # gnss用anchor固定的版本: gnss_psr_dopp_residual在因子里对ref_ecef做ecef2geo, 展开后的常数
+    # (地球半径的高次幂, 比如a^6≈7e40)和(s1^2+s2^2)^-1.5在float32下上溢/下溢, 输出全是inf/NaN,
+    # 和输入的取值范围无关. float版本本来也应该在double里算好R_ecef_enu再传进来
+    "gnss": (gnss_psr_dopp_fixed_anchor_residual, GNSS_FIXED_ANCHOR_LINEARIZATION_ARGS),
+}
+
+
+def random_rotations(rng: np.random.Generator, n: int, scale: float = 0.3) -> np.ndarray:
+    return quat_from_tangent(rng.normal(scale=scale, size=(n, 3)))
+
+
+def projection_inputs(rng: np.random.Generator, n: int, scenario: str) -> T.Dict[str, T.Any]:
+    # 用真值投影得到观测, 残差是两个接近的数相减
+    inv_dep_range = (1e-4, 1e-2) if scenario == "inv_dep_near_zero" else (0.1, 1.0)
+    pts_i = np.column_stack([rng.uniform(-0.4, 0.4, size=(n, 2)), np.ones(n)])
+    inv_dep = rng.uniform(*inv_dep_range, size=n)
+    Pi, Qi = rng.normal(size=(n, 3)), random_rotations(rng, n)
+    Pj, Qj = Pi + rng.normal(scale=0.3, size=(n, 3)), quat_multiply(Qi, random_rotations(rng, n, 0.05))
+    tic, qic = np.array([0.05, 0.0, 0.0]), np.array([0.0, 0.0, 0.0, 1.0])
+    pts_w = np.einsum("nij,nj->ni", quat_to_matrix(Qi), pts_i / inv_dep[:, None] + tic) + Pi
+    pts_camera_j = np.einsum("nji,nj->ni", quat_to_matrix(Qj), pts_w - Pj) - tic
+    pts_j = pts_camera_j / pts_camera_j[:, 2:3]
+    pts_j[:, :2] += rng.normal(scale=1.0 / 460.0, size=(n, 2))
+    return dict(
+        pts_i=pts_i, pts_j=pts_j, Pi=Pi, Qi=Qi, Pj=Pj, Qj=Qj, tic=tic, qic=qic,
+        # mu=0.5时alpha≈0, Barron核里(1+t)^(alpha/2)-1在float64下也会抵消成0, 这里避开
+        inv_dep_i=inv_dep, weight=1.0, gnc_mu=0.3, gnc_scale=1.0,
+    )
+
+
+def imu_inputs(rng: np.random.Generator, n: int, scenario: str) -> T.Dict[str, T.Any]:
+    sum_dt = rng.uniform(5.0, 20.0, size=n) if scenario == "large_sum_dt" else rng.uniform(0.05, 0.2, size=n)
+    G = np.array([0.0, 0.0, 9.81])
+    Pi, Qi, Vi = rng.normal(scale=10.0, size=(n, 3)), random_rotations(rng, n), rng.normal(size=(n, 3))
+    Pj = Pi + Vi * sum_dt[:, None] + rng.normal(size=(n, 3))
+    Qj, Vj = quat_multiply(Qi, random_rotations(rng, n, 0.1)), Vi + rng.normal(size=(n, 3))
+    Ba, Bg = rng.normal(scale=0.01, size=(n, 3)), rng.normal(scale=0.001, size=(n, 3))
+    R_i_inv = np.swapaxes(quat_to_matrix(Qi), 1, 2)
+    dt = sum_dt[:, None]
+    # 预积分量取真值加上小噪声
+    delta_p = np.einsum("nij,nj->ni", R_i_inv, 0.5 * G * dt**2 + Pj - Pi - Vi * dt)
+    delta_v = np.einsum("nij,nj->ni", R_i_inv, G * dt + Vj - Vi)
+    delta_q = quat_multiply(Qi * np.array([-1.0, -1.0, -1.0, 1.0]), Qj)
+    jacobians = {name: rng.normal(scale=0.1, size=(n, 9)) for name in ("dp_dba", "dp_dbg", "dq_dbg", "dv_dba", "dv_dbg")}
+    sqrt_info = np.linalg.cholesky(np.linalg.inv(np.diag(np.full(15, 1e-4)))).T.ravel(order="F")
+    return dict(
+        Pi=Pi, Qi=Qi, Vi=Vi, Bai=Ba, Bgi=Bg, Pj=Pj, Qj=Qj, Vj=Vj, Baj=Ba, Bgj=Bg,
+        delta_p=delta_p + rng.normal(scale=1e-3, size=(n, 3)), delta_q=delta_q,
+        delta_v=delta_v + rng.normal(scale=1e-3, size=(n, 3)), G=G, sum_dt=sum_dt,
+        **jacobians, linearized_ba=Ba, linearized_bg=Bg, sqrt_info=sqrt_info,
+    )
+
+
+def gnss_inputs(rng: np.random.Generator, n: int, scenario: str) -> T.Dict[str, T.Any]:
+    # anchor在地球表面, 卫星在约26000 km的轨道上, 都是ECEF坐标
+    lat, lon = rng.uniform(-1.2, 1.2, size=n), rng.uniform(-np.pi, np.pi, size=n)
+    up = np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+    east = np.column_stack([-np.sin(lon), np.cos(lon), np.zeros(n)])
+    north = np.cross(up, east)
+    ref_ecef = EARTH_SEMI_MAJOR * up
+    # R_ecef_enu的列是east/north/up, 按列存储正好是三个向量依次排列
+    R_ecef_enu = np.hstack([east, north, up])
+    sv_direction = up + rng.normal(scale=0.3, size=(n, 3))
+    sv_pos = 2.6e7 * sv_direction / np.linalg.norm(sv_direction, axis=1, keepdims=True)
+    local_scale = 1e4 if scenario == "far_from_anchor" else 10.0
+    Pi, Pj = rng.normal(scale=local_scale, size=(n, 3)), rng.normal(scale=local_scale, size=(n, 3))
+    psr = np.linalg.norm(sv_pos - ref_ecef, axis=1) + rng.normal(scale=5.0, size=n)
+    return dict(
+        Pi=Pi, Vi=rng.normal(size=(n, 3)), Pj=Pj, Vj=rng.normal(size=(n, 3)),
+        rcv_dt=rng.normal(scale=100.0, size=n), rcv_ddt=rng.normal(size=n),
+        yaw_diff=rng.normal(scale=0.1, size=n), ref_ecef=ref_ecef, R_ecef_enu=R_ecef_enu,
+        ion_delay=rng.uniform(1.0, 10.0, size=n), tro_delay=rng.uniform(2.0, 20.0, size=n),
+        ratio=rng.uniform(size=n), tgd=rng.normal(scale=1e-8, size=n), sv_pos=sv_pos,
+        sv_vel=rng.normal(scale=3000.0, size=(n, 3)), svdt=rng.normal(scale=1e-4, size=n),
+        svddt=rng.normal(scale=1e-11, size=n), freq=1575.42e6, psr_measured=psr,
+        dopp_measured=rng.normal(scale=3000.0, size=n), pr_weight=1.0, dp_weight=1.0,
+    )
+
+
+SCENARIOS = {
+    "projection": (projection_inputs, ["nominal", "inv_dep_near_zero"]),
+    "imu": (imu_inputs, ["nominal", "large_sum_dt"]),
+    "gnss": (gnss_inputs, ["near_anchor", "far_from_anchor"]),
+}
+
+
+def generate_precision_variants(
+    output_dir: T.Openable, factor: str
+) -> T.Dict[str, T.Tuple[T.Callable, NumpyBatchMetadata]]:
+    func, which_args = FACTORS[factor]
+    factor_codegen = codegen.Codegen.function(func=func, config=codegen.PythonConfig()).with_linearization(
+        which_args=which_args
+    )
+    variants = {}
+    for dtype in ("float32", "float64"):
+        metadata = generate_numpy_batch_function(
+            factor_codegen, output_dir, name=f"{factor_codegen.name}_{dtype}", dtype=dtype
+        )
+        variants[dtype] = (load_numpy_batch_function(metadata), metadata)
+    return variants
+
+
+def relative_errors(actual: np.ndarray, expected: np.ndarray) -> np.ndarray:
+    """
+    Per sample max |actual - expected| relative to the largest entry of expected in that sample,
+    inf where actual is not finite.
+    """
+    actual = actual.reshape(actual.shape[0], -1).astype(np.float64)
+    expected = expected.reshape(expected.shape[0], -1)
+    scale = np.maximum(np.max(np.abs(expected), axis=1), np.finfo(np.float64).tiny)
+    with np.errstate(invalid="ignore"):
+        errors = np.max(np.abs(actual - expected), axis=1) / scale
+    return np.where(np.all(np.isfinite(actual), axis=1), errors, np.inf)
+
+
+def format_errors(name: str, errors: np.ndarray) -> str:
+    finite = errors[np.isfinite(errors)]
+    text = f"{name} {np.max(finite):.1e}/{np.median(finite):.1e}" if finite.size else f"{name} -/-"
+    if finite.size < errors.size:
+        # float32下溢出/NaN的样本单独计数, 不参与误差统计
+        text += f" ({errors.size - finite.size} non-finite)"
+    return text
+
+
+def benchmark_float_precision(factors: T.Sequence[str], num_samples: int, repeats: int = 3) -> None:
+    output_dir = tempfile.mkdtemp(prefix="float_precision_")
+    rng = np.random.default_rng(0)
+    for factor in factors:
+        variants = generate_precision_variants(output_dir, factor)
+        make_inputs, scenarios = SCENARIOS[factor]
+        for scenario in scenarios:
+            inputs = make_inputs(rng, num_samples, scenario)
+            outputs, timings = {}, {}
+            for dtype, (func, metadata) in variants.items():
+                arrays = {key: np.asarray(value, dtype=dtype) for key, value in inputs.items()}
+                if "epsilon" in metadata.input_dims:
+                    # epsilon和浮点精度匹配, 和symforce的numeric_epsilon一样取10倍的机器精度
+                    arrays["epsilon"] = np.asarray(10 * np.finfo(dtype).eps, dtype=dtype)
+                with np.errstate(all="ignore"):
+                    func(**arrays)
+                    start = time.perf_counter()
+                    for _ in range(repeats):
+                        outputs[dtype] = func(**arrays)
+                    timings[dtype] = (time.perf_counter() - start) / repeats / num_samples
+
+            # float64的结果本身必须是有限的, 否则是输入不合理而不是精度问题
+            assert all(np.all(np.isfinite(output)) for output in outputs["float64"]), (factor, scenario)
+
+            errors = "  ".join(
+                format_errors(name, relative_errors(a, b))
+                for name, a, b in zip(metadata.output_shapes, outputs["float32"], outputs["float64"])
+            )
+            print(
+                f"{factor:<11}{scenario:<19}numpy float64 {timings['float64'] * 1e9:7.1f} ns/sample  "
+                f"numpy float32 {timings['float32'] * 1e9:7.1f} ns/sample  max/median relative error: {errors}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--factors", nargs="+", choices=list(FACTORS), default=list(FACTORS), help="factors to compare")
+    parser.add_argument("--num_samples", type=int, default=20000, help="random inputs per scenario")
+    args = parser.parse_args()
+
+    benchmark_float_precision(args.factors, args.num_samples)
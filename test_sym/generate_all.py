@@ -0,0 +1,363 @@
+import argparse
+import ast
+import hashlib
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from dataclasses import dataclass
+from dataclasses import field
+from pathlib import Path
+
+from symforce import typing as T
+
+# 统一的代码生成入口: 并行运行所有注册的因子生成器, 只重新生成源文件有变化的目标
+#   python generate_all.py                 # 生成所有过期的目标
+#   python generate_all.py vins_imu gnss   # 只生成指定的目标
+#   python generate_all.py --force -j 8    # 全部重新生成
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_OUTPUT_ROOT = "/root/dev/python_ws"
+STAMP_FILE = ".generate_all.json"
+
+
+@dataclass
+class GeneratorTarget:
+    """
+    One factor generator. Either module + function, called as function(output_dir, ...) in a
+    worker process, or a script that generates at import time and is run as a subprocess with
+    SYMFORCE_OUTPUT_DIR set.
+    """
+
+    name: str
+    # 入口文件; 它们(递归地)import的同目录模块也算作源文件, 见local_imports
+    sources: T.List[str]
+    output_subdir: str = "test_sym"
+    module: T.Optional[str] = None
+    function: T.Optional[str] = None
+    script: T.Optional[str] = None
+    args: T.List[str] = field(default_factory=list)
+    # 生成函数接受cache参数(见codegen_cache.py)
+    cacheable: bool = False
+    # 不指定目标时是否生成
+    default: bool = True
+
+    def source_files(self) -> T.List[Path]:
+        files = set()
+        for source in self.sources:
+            files |= local_imports(REPO_ROOT / source)
+        return sorted(files)
+
+    def source_hash(self) -> str:
+        digest = hashlib.sha256()
+        for path in self.source_files():
+            digest.update(str(path.relative_to(REPO_ROOT)).encode())
+            digest.update(path.read_bytes())
+        digest.update(repr((self.module, self.function, self.script, self.args)).encode())
+        return digest.hexdigest()
+
+
+def local_imports(path: Path) -> T.Set[Path]:
+    """
+    path and the modules next to it that it imports, recursively, including imports inside
+    functions.
+    """
+    found: T.Set[Path] = set()
+    pending = [path]
+    while pending:
+        current = pending.pop()
+        if current in found:
+            continue
+        found.add(current)
+        for node in ast.walk(ast.parse(current.read_text(), filename=str(current))):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module = current.parent / f"{name.split('.')[0]}.py"
+                if module.exists():
+                    pending.append(module)
+    return found
+
+
+GENERATORS: T.Dict[str, GeneratorTarget] = {}
+
+
+def register(target: GeneratorTarget) -> None:
+    assert target.name not in GENERATORS, f"duplicate generator {target.name}"
+    GENERATORS[target.name] = target
+
+
+VINS_SOURCES = ["test_sym/vins.py", "test_sym/codegen_cache.py"]
+register(
+    GeneratorTarget(
+        name="vins_projection",
+        sources=VINS_SOURCES,
+        module="vins",
+        function="generate_projection_residual_code",
+        cacheable=True,
+    )
+)
+register(
+    GeneratorTarget(
+        name="vins_projection_hoisted",
+        sources=VINS_SOURCES,
+        module="vins",
+        function="generate_projection_hoisted_code",
+    )
+)
+register(
+    GeneratorTarget(
+        name="vins_projection_multi",
+        sources=VINS_SOURCES,
+        module="vins",
+        function="generate_projection_multi_residual_code",
+    )
+)
+register(
+    GeneratorTarget(
+        name="vins_imu",
+        sources=VINS_SOURCES,
+        module="vins",
+        function="generate_imu_residual_code",
+        cacheable=True,
+    )
+)
+register(
+    GeneratorTarget(
+        name="vins_imu_variants",
+        sources=["test_sym/imu_residual_variants.py"],
+        module="imu_residual_variants",
+        function="generate_imu_residual_variant_code",
+    )
+)
+register(
+    GeneratorTarget(
+        name="vins_marginalization_prior",
+        sources=VINS_SOURCES,
+        module="vins",
+        function="generate_marginalization_prior_code",
+    )
+)
+register(
+    GeneratorTarget(
+        name="gnss",
+        sources=["test_sym/gnss.py"],
+        module="gnss",
+        function="generate_gnss_residual_code",
+    )
+)
+register(
+    GeneratorTarget(
+        name="gnss_epoch",
+        sources=["test_sym/gnss.py"],
+        module="gnss",
+        function="generate_gnss_epoch_code",
+    )
+)
+register(
+    GeneratorTarget(
+        name="gnss_fixed_anchor",
+        sources=["test_sym/gnss.py"],
+        module="gnss",
+        function="generate_gnss_fixed_anchor_code",
+    )
+)
+register(
+    GeneratorTarget(
+        name="gnss_atmosphere",
+        sources=["test_sym/gnss.py"],
+        module="gnss",
+        function="generate_gnss_atmosphere_code",
+    )
+)
+register(
+    GeneratorTarget(
+        name="gnss_weighted",
+        sources=["test_sym/gnss.py"],
+        module="gnss",
+        function="generate_gnss_weighted_code",
+    )
+)
+register(
+    GeneratorTarget(
+        name="gnss_calc_p_ecef",
+        sources=["test_sym/gnss.py"],
+        module="gnss",
+        function="generate_calc_p_ecef_code",
+    )
+)
+register(
+    GeneratorTarget(
+        name="gnss_ephemeris",
+        sources=["test_sym/gnss_ephemeris.py"],
+        module="gnss_ephemeris",
+        function="generate_satellite_state_code",
+    )
+)
+register(
+    GeneratorTarget(
+        name="robust_loss",
+        sources=["test_sym/robust_loss.py"],
+        module="robust_loss",
+        function="generate_robust_loss_code",
+    )
+)
+EKF_SOURCES = ["test_sym/test_sym4.py"]
+register(GeneratorTarget(name="ekf_covariance", sources=EKF_SOURCES, script="test_sym/test_sym4.py"))
+# 每种状态配置生成到单独的目录, 符号推导结果由derivation_cache按State布局缓存
+for suffix, ekf_args in (
+    ("no_mag", ["--disable_mag"]),
+    ("no_wind", ["--disable_wind"]),
+    ("no_mag_no_wind", ["--disable_mag", "--disable_wind"]),
+):
+    register(
+        GeneratorTarget(
+            name=f"ekf_covariance_{suffix}",
+            sources=EKF_SOURCES,
+            output_subdir=f"test_sym/ekf_{suffix}",
+            script="test_sym/test_sym4.py",
+            args=ekf_args,
+        )
+    )
+# test_sym3里的max2演示了Python分支不能符号化, 生成时在`a if a > b`处失败, 所以默认不生成
+register(
+    GeneratorTarget(name="test_sym3", sources=["test_sym/test_sym3.py"], script="test_sym/test_sym3.py", default=False)
+)
+register(GeneratorTarget(name="test_matrix", sources=["test_sym/test_matrix.py"], script="test_sym/test_matrix.py"))
+register(
+    GeneratorTarget(
+        name="fixed_ba",
+        sources=["test_fixed_ba/fixed_ba_generate.py"],
+        output_subdir="test_fixed_ba",
+        script="test_fixed_ba/fixed_ba_generate.py",
+    )
+)
+
+
+def run_target(
+    target: GeneratorTarget, output_dir: str, cache_dir: T.Optional[str]
+) -> T.Tuple[str, float, bool, str]:
+    """
+    Runs in a worker process. Returns (name, seconds, success, log).
+    """
+    start = time.perf_counter()
+    os.environ["SYMFORCE_OUTPUT_DIR"] = output_dir
+    try:
+        if target.script is not None:
+            script = REPO_ROOT / target.script
+            completed = subprocess.run(
+                [sys.executable, str(script), *target.args],
+                cwd=script.parent,
+                env=os.environ.copy(),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+            )
+            return (
+                target.name,
+                time.perf_counter() - start,
+                completed.returncode == 0,
+                completed.stdout,
+            )
+
+        sys.path.insert(0, str(REPO_ROOT / "test_sym"))
+        generate = getattr(importlib.import_module(target.module), target.function)
+        if target.cacheable and cache_dir is not None:
+            from codegen_cache import CodegenCache
+
+            generate(output_dir, cache=CodegenCache(cache_dir))
+        else:
+            generate(output_dir)
+        return target.name, time.perf_counter() - start, True, ""
+    except Exception as e:  # pylint: disable=broad-except
+        return target.name, time.perf_counter() - start, False, repr(e)
+
+
+def load_stamps(output_dir: Path) -> T.Dict[str, str]:
+    stamp_file = output_dir / STAMP_FILE
+    if not stamp_file.exists():
+        return {}
+    return json.loads(stamp_file.read_text())
+
+
+def save_stamps(output_dir: Path, stamps: T.Dict[str, str]) -> None:
+    output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / STAMP_FILE).write_text(json.dumps(stamps, indent=2, sort_keys=True))
+
+
+def generate_all(
+    names: T.Sequence[str],
+    output_root: T.Openable,
+    jobs: T.Optional[int] = None,
+    force: bool = False,
+    cache_dir: T.Optional[str] = None,
+) -> bool:
+    output_root = Path(output_root)
+    stamps = {}
+    pending = []
+    for name in names:
+        target = GENERATORS[name]
+        output_dir = output_root / target.output_subdir
+        if output_dir not in stamps:
+            stamps[output_dir] = load_stamps(output_dir)
+        source_hash = target.source_hash()
+        if not force and stamps[output_dir].get(name) == source_hash:
+            print(f"{name:<32}{'up to date':>12}")
+            continue
+        pending.append((target, output_dir, source_hash))
+
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(run_target, target, str(output_dir), cache_dir): (target, output_dir, source_hash)
+            for target, output_dir, source_hash in pending
+        }
+        for future in as_completed(futures):
+            target, output_dir, source_hash = futures[future]
+            name, seconds, ok, log = future.result()
+            print(f"{name:<32}{'generated' if ok else 'FAILED':>12}{seconds:>10.1f} s")
+            if ok:
+                stamps[output_dir][name] = source_hash
+                save_stamps(output_dir, stamps[output_dir])
+            else:
+                failed += 1
+                print("\n".join(log.splitlines()[-20:]))
+
+    print(
+        f"{len(pending) - failed} of {len(names)} targets generated, {failed} failed, "
+        f"{len(names) - len(pending)} up to date in {time.perf_counter() - start:.1f} s"
+    )
+    return failed == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("targets", nargs="*", help="targets to generate, default all default targets")
+    parser.add_argument("--output_root", type=str, default=DEFAULT_OUTPUT_ROOT, help="root of the output directories")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--force", action="store_true", help="regenerate even if the sources did not change")
+    parser.add_argument("--cache_dir", type=str, default=None, help="use a codegen cache in this directory")
+    parser.add_argument("--list", action="store_true", help="list the registered targets")
+    args = parser.parse_args()
+
+    if args.list:
+        for target in GENERATORS.values():
+            print(f"{target.name:<32}{target.module or target.script}{'' if target.default else ' (not default)'}")
+        sys.exit(0)
+
+    unknown = set(args.targets) - set(GENERATORS)
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+
+    default_targets = [name for name, target in GENERATORS.items() if target.default]
+    ok = generate_all(args.targets or default_targets, args.output_root, args.jobs, args.force, args.cache_dir)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,261 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+
+from landmark_schur import assemble_schur_system_from_structure
+from landmark_schur import build_schur_structure
+from landmark_schur import quat_multiply
+from landmark_schur import random_tracks
+from landmark_schur import retract_window
+from landmark_schur import solve_schur
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+from projection_batch import generate_projection_batch_code
+from projection_batch import projection_gnc_factor_batch
+from vins import projection_gnc_residual
+
+# 滑窗状态: P (K, 3), Q (K, 4), tic, qic, inv_dep (num_features,)
+WindowState = T.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+@dataclass
+class GncParams:
+    """
+    mu goes from mu_initial (convex, pseudo-huber) to mu_max (robust) in steps of mu_step, see
+    BarronNoiseModel.compute_alpha_from_mu.
+    """
+
+    mu_initial: float = 0.0
+    mu_step: float = 0.2
+    mu_max: float = 0.8
+    gnc_scale: float = 1.0
+    # 每个阶段的LM迭代
+    max_iterations: int = 10
+    relative_tolerance: float = 1e-4
+    initial_damping: float = 1e-4
+
+    def schedule(self) -> np.ndarray:
+        return np.arange(self.mu_initial, self.mu_max + 0.5 * self.mu_step, self.mu_step)
+
+
+@dataclass
+class GncStageStats:
+    mu: float
+    iterations: int
+    initial_cost: float
+    final_cost: float
+    seconds: float
+
+
+class GncDriver:
+    """
+    Outer loop of graduated non-convexity for projection_gnc_factor on one window: each stage
+    optimizes with a fixed mu, warm-started from the previous stage. The observation -> state
+    index structure is built once and reused by every stage and iteration.
+    """
+
+    def __init__(
+        self,
+        output_dir: T.Openable,
+        pts_i: np.ndarray,
+        pts_j: np.ndarray,
+        idx_i: np.ndarray,
+        idx_j: np.ndarray,
+        feature_idx: np.ndarray,
+        num_poses: int,
+        num_features: int,
+        params: T.Optional[GncParams] = None,
+        fixed_poses: T.Sequence[int] = (0,),
+    ) -> None:
+        self.factor = load_numpy_batch_function(generate_projection_batch_code(output_dir))
+        self.residual = load_numpy_batch_function(
+            generate_numpy_batch_function(
+                codegen.Codegen.function(func=projection_gnc_residual, config=codegen.PythonConfig()),
+                output_dir,
+                name="projection_gnc_residual_batch",
+            )
+        )
+        self.pts_i, self.pts_j = pts_i, pts_j
+        self.idx_i, self.idx_j, self.feature_idx = idx_i, idx_j, feature_idx
+        self.params = params if params is not None else GncParams()
+        self.fixed_poses = fixed_poses
+        self.structure = build_schur_structure(idx_i, idx_j, feature_idx, num_poses, num_features)
+
+    def cost(self, state: WindowState, mu: float) -> float:
+        P, Q, tic, qic, inv_dep = state
+        res = self.residual(
+            self.pts_i,
+            self.pts_j,
+            P[self.idx_i],
+            Q[self.idx_i],
+            P[self.idx_j],
+            Q[self.idx_j],
+            tic,
+            qic,
+            inv_dep[self.feature_idx],
+            1.0,
+            mu,
+            self.params.gnc_scale,
+            sf.numeric_epsilon,
+        )
+        return 0.5 * float(np.sum(res**2))
+
+    def optimize_stage(self, state: WindowState, mu: float) -> T.Tuple[WindowState, GncStageStats]:
+        start = time.perf_counter()
+        damping = self.params.initial_damping
+        cost = initial_cost = self.cost(state, mu)
+        iterations = 0
+        while iterations < self.params.max_iterations:
+            iterations += 1
+            P, Q, tic, qic, inv_dep = state
+            _, _, hessian, rhs = projection_gnc_factor_batch(
+                self.factor,
+                self.pts_i,
+                self.pts_j,
+                inv_dep[self.feature_idx],
+                self.idx_i,
+                self.idx_j,
+                P,
+                Q,
+                tic,
+                qic,
+                weight=1.0,
+                gnc_mu=mu,
+                gnc_scale=self.params.gnc_scale,
+            )
+            system = assemble_schur_system_from_structure(self.structure, hessian, rhs)
+            delta_x, delta_l = solve_schur(system, damping, self.fixed_poses)
+            candidate = retract_window(P, Q, tic, qic, inv_dep, delta_x, delta_l)
+            new_cost = self.cost(candidate, mu)
+
+            if new_cost < cost:
+                converged = (cost - new_cost) < self.params.relative_tolerance * cost
+                state, cost = candidate, new_cost
+                damping = max(damping / 10, 1e-12)
+                if converged:
+                    break
+            else:
+                damping *= 10
+
+        return state, GncStageStats(
+            mu=float(mu),
+            iterations=iterations,
+            initial_cost=initial_cost,
+            final_cost=cost,
+            seconds=time.perf_counter() - start,
+        )
+
+    def optimize(
+        self, state: WindowState, warm_start: bool = True
+    ) -> T.Tuple[WindowState, T.List[GncStageStats]]:
+        """
+        Run every stage of the mu schedule. With warm_start=False each stage starts again from
+        the given state, which is what running a full solve per mu costs.
+        """
+        stats = []
+        current = state
+        for mu in self.params.schedule():
+            current, stage_stats = self.optimize_stage(current if warm_start else state, mu)
+            stats.append(stage_stats)
+        return current, stats
+
+
+def print_stats(stats: T.Sequence[GncStageStats]) -> None:
+    print(f"{'mu':>6}{'iterations':>12}{'initial cost':>15}{'final cost':>15}{'ms':>10}")
+    for stage in stats:
+        print(
+            f"{stage.mu:>6.2f}{stage.iterations:>12d}{stage.initial_cost:>15.4e}"
+            f"{stage.final_cost:>15.4e}{stage.seconds * 1e3:>10.1f}"
+        )
+    print(
+        f"{'total':>6}{sum(s.iterations for s in stats):>12d}{'':>30}"
+        f"{sum(s.seconds for s in stats) * 1e3:>10.1f}"
+    )
+
+
+def pose_errors(state: WindowState, P_true: np.ndarray, Q_true: np.ndarray) -> T.Tuple[float, float]:
+    P, Q = state[0], state[1]
+    dq = quat_multiply(Q_true * np.array([-1.0, -1.0, -1.0, 1.0]), Q)
+    angle = 2 * np.arccos(np.clip(np.abs(dq[:, 3]), 0.0, 1.0))
+    return float(np.max(np.linalg.norm(P - P_true, axis=1))), float(np.degrees(np.max(angle)))
+
+
+def benchmark_gnc(
+    num_features: int, num_poses: int, track_length: int, outlier_ratio: float, params: GncParams
+) -> None:
+    data = random_tracks(num_features, num_poses, track_length)
+    rng = np.random.default_rng(1)
+
+    # 一部分观测替换成随机的外点
+    pts_j = data["pts_j"].copy()
+    outliers = rng.random(pts_j.shape[0]) < outlier_ratio
+    pts_j[outliers, :2] = rng.uniform(-0.4, 0.4, size=(np.count_nonzero(outliers), 2))
+
+    P = data["P"] + rng.normal(scale=0.05, size=data["P"].shape)
+    P[0] = data["P"][0]
+    state = (
+        P,
+        data["Q"].copy(),
+        data["tic"],
+        data["qic"],
+        data["inv_dep"] * rng.uniform(0.8, 1.2, size=num_features),
+    )
+
+    driver = GncDriver(
+        tempfile.mkdtemp(prefix="gnc_driver_"),
+        data["pts_i"],
+        pts_j,
+        data["idx_i"],
+        data["idx_j"],
+        data["feature_idx"],
+        num_poses,
+        num_features,
+        params,
+    )
+    print(f"{np.count_nonzero(outliers)} of {pts_j.shape[0]} observations are outliers")
+    print("initial: max position error {:.4f} m, max rotation error {:.3f} deg".format(
+        *pose_errors(state, data["P"], data["Q"])
+    ))
+
+    for warm_start in (True, False):
+        result, stats = driver.optimize(state, warm_start=warm_start)
+        print(f"\n{'warm start' if warm_start else 'full solve per mu'}:")
+        print_stats(stats)
+        print("final: max position error {:.4f} m, max rotation error {:.3f} deg".format(
+            *pose_errors(result, data["P"], data["Q"])
+        ))
+
+    # 只用凸的代价函数做参考
+    convex, _ = driver.optimize_stage(state, params.mu_initial)
+    print("\nconvex only: max position error {:.4f} m, max rotation error {:.3f} deg".format(
+        *pose_errors(convex, data["P"], data["Q"])
+    ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_features", type=int, default=300, help="features in the window")
+    parser.add_argument("--num_poses", type=int, default=10, help="frames in the window")
+    parser.add_argument("--track_length", type=int, default=5, help="frames observing a feature")
+    parser.add_argument("--outlier_ratio", type=float, default=0.1, help="fraction of outlier observations")
+    parser.add_argument("--mu_step", type=float, default=0.2, help="mu increment per stage")
+    parser.add_argument("--mu_max", type=float, default=0.8, help="mu of the last stage")
+    parser.add_argument("--max_iterations", type=int, default=10, help="iterations per stage")
+    args = parser.parse_args()
+
+    benchmark_gnc(
+        args.num_features,
+        args.num_poses,
+        args.track_length,
+        args.outlier_ratio,
+        GncParams(mu_step=args.mu_step, mu_max=args.mu_max, max_iterations=args.max_iterations),
+    )
@@ -1,5 +1,4 @@
-import symforce
-symforce.set_epsilon_to_symbol()
+import symforce_setup  # noqa: F401
 
 from symforce import typing as T # 导入symforce包里面的typing模块到当前模块的命名空间，并重命名为T
 
@@ -7,7 +6,9 @@ from symforce import codegen
 
 import symforce.symbolic as sf
 from symforce.notebook_util import display
+from symforce.values import Values
 
+import os
 import shutil
 from pathlib import Path
 
@@ -20,6 +21,15 @@ D2R = M_PI / 180.0
 EARTH_OMG_GPS = 7.2921151467e-5
 relative_sqrt_info = 10.0
 PSR_TO_DOPP_RATIO = 5
+GPS_L1_FREQ = 1575.42e6
+# Saastamoinen模型的标准大气: 海平面温度(摄氏度)和相对湿度
+TROP_TEMP0 = 15.0
+TROP_HUMIDITY = 0.7
+# 导航电文里没有电离层参数时用的Klobuchar参数(alpha0..3, beta0..3)
+KLOBUCHAR_DEFAULT = [
+    0.1118e-07, -0.7451e-08, -0.5961e-07, 0.1192e-06,
+    0.1167e+06, -0.2294e+06, -0.1311e+06, 0.1049e+07,
+]
 
 
 # ecef2rotation：根据anchor point的坐标计算ENU系到ECEF系的旋转
@@ -117,6 +127,149 @@ def sat_azel(rev_pos: sf.V3, sat_pos: sf.V3, epsilon: sf.Scalar = 0) -> sf.V2:
     return sf.V2(azimuth, elevation)
 
 
+# 地平线以下的卫星延迟为0, 但表达式里的仰角至少取这个值, 让乘0的那一支也是有限值
+ATMOSPHERE_MIN_ELEVATION = 1e-3
+
+
+# 对流层延迟(m): Saastamoinen模型, 和RTKLIB的tropmodel(GVINS的calculate_trop_delay)一致.
+# RTKLIB在仰角<=0或高度不在[-100 m, 10 km]内时返回0, 这里把分支写成0/1的系数
+def saastamoinen_delay(rcv_lla: sf.V3, elevation: sf.Scalar) -> sf.Scalar:
+    valid = sf.is_positive(elevation) * sf.is_nonnegative(rcv_lla.z + 100.0) * sf.is_nonnegative(1e4 - rcv_lla.z)
+    lat = rcv_lla.x * D2R
+    hgt = sf.Max(rcv_lla.z, 0)
+    pres = 1013.25 * sf.Pow(1.0 - 2.2557e-5 * hgt, 5.2568)
+    temp = TROP_TEMP0 - 6.5e-3 * hgt + 273.16
+    e = 6.108 * TROP_HUMIDITY * sf.exp((17.15 * temp - 4684.0) / (temp - 38.45))
+    # 天顶角z = pi/2 - el, cos(z) = sin(el)
+    sin_el = sf.sin(sf.Max(elevation, ATMOSPHERE_MIN_ELEVATION))
+    trph = 0.0022768 * pres / (1.0 - 0.00266 * sf.cos(2.0 * lat) - 0.00028 * hgt / 1e3) / sin_el
+    trpw = 0.002277 * (1255.0 / temp + 0.05) * e / sin_el
+    return valid * (trph + trpw)
+
+
+# 电离层延迟(m): GPS Klobuchar模型, 和RTKLIB的ionmodel(GVINS的calculate_ion_delay)一致.
+# gps_tow是GPS周内秒, ion_params = [alpha0..3, beta0..3], 延迟按(L1/freq)^2换算到freq上.
+# 和RTKLIB一样, 仰角<=0或高度低于-1 km时为0
+def klobuchar_delay(
+    gps_tow: sf.Scalar, ion_params: sf.Matrix81, rcv_lla: sf.V3, azel: sf.V2, freq: sf.Scalar
+) -> sf.Scalar:
+    azimuth, elevation = azel
+    valid = sf.is_positive(elevation) * sf.is_nonnegative(rcv_lla.z + 1e3)
+    el_semi = sf.Max(elevation, ATMOSPHERE_MIN_ELEVATION) / M_PI
+    # 地心角(半周)
+    psi = 0.0137 / (el_semi + 0.11) - 0.022
+    # 电离层穿刺点的纬度/经度(半周)
+    phi = sf.clamp(rcv_lla.x / 180.0 + psi * sf.cos(azimuth), -0.416, 0.416)
+    lam = rcv_lla.y / 180.0 + psi * sf.sin(azimuth) / sf.cos(phi * M_PI)
+    # 地磁纬度(半周)
+    phi = phi + 0.064 * sf.cos((lam - 1.617) * M_PI)
+    # 地方时(s), 0 <= tt < 86400
+    tt = 43200.0 * lam + gps_tow
+    tt = tt - sf.floor(tt / 86400.0) * 86400.0
+    # 倾斜因子
+    f = 1.0 + 16.0 * sf.Pow(0.53 - el_semi, 3)
+    amp = ion_params[0] + phi * (ion_params[1] + phi * (ion_params[2] + phi * ion_params[3]))
+    per = ion_params[4] + phi * (ion_params[5] + phi * (ion_params[6] + phi * ion_params[7]))
+    amp = sf.Max(amp, 0.0)
+    per = sf.Max(per, 72000.0)
+    x = 2.0 * M_PI * (tt - 50400.0) / per
+    # |x| >= 1.57时只剩夜间的常数项
+    daytime = sf.less(sf.Abs(x), 1.57)
+    delay_l1 = LIGHT_SPEED * f * (5e-9 + daytime * amp * (1.0 + x * x * (-0.5 + x * x / 24.0)))
+    return valid * delay_l1 * (GPS_L1_FREQ / freq) ** 2
+
+
+# 一颗卫星的电离层/对流层延迟, 由接收机和卫星的ECEF位置计算
+def gnss_atmosphere_delays(
+    rcv_ecef: sf.V3,
+    sv_pos: sf.V3,
+    gps_tow: sf.Scalar,
+    ion_params: sf.Matrix81,
+    freq: sf.Scalar,
+    epsilon: sf.Scalar = 0
+) -> T.Tuple[sf.Scalar, sf.Scalar]:
+    azel = sat_azel(rcv_ecef, sv_pos, epsilon)
+    rcv_lla = ecef2geo(rcv_ecef)
+    return klobuchar_delay(gps_tow, ion_params, rcv_lla, azel, freq), saastamoinen_delay(rcv_lla, azel.y)
+
+
+# 接收机在ECEF系下的位置和速度, 同一个历元的所有卫星共享
+def gnss_receiver_ecef(
+    Pi: sf.V3,
+    Vi: sf.V3,
+    Pj: sf.V3,
+    Vj: sf.V3,
+    yaw_diff: sf.Scalar,
+    ref_ecef: sf.V3,
+    ratio: sf.Scalar,
+    epsilon: sf.Scalar = 0
+) -> T.Tuple[sf.V3, sf.V3]:
+    return gnss_receiver_ecef_from_rotation(
+        Pi, Vi, Pj, Vj, yaw_diff, ref_ecef, ecef2rotation(ref_ecef, epsilon), ratio
+    )
+
+# 和gnss_receiver_ecef一样, 但是ENU系到ECEF系的旋转已经算好了(anchor固定以后不再变化)
+def gnss_receiver_ecef_from_rotation(
+    Pi: sf.V3,
+    Vi: sf.V3,
+    Pj: sf.V3,
+    Vj: sf.V3,
+    yaw_diff: sf.Scalar,
+    ref_ecef: sf.V3,
+    R_ecef_enu: sf.Matrix33,
+    ratio: sf.Scalar,
+) -> T.Tuple[sf.V3, sf.V3]:
+    local_pos = ratio * Pi + (1.0 - ratio) * Pj
+    local_vel = ratio * Vi + (1.0 - ratio) * Vj
+    sin_yaw_diff = sf.sin(yaw_diff)
+    cos_yaw_diff = sf.cos(yaw_diff)
+    R_enu_local = sf.Matrix33(cos_yaw_diff, -sin_yaw_diff, 0, \
+                              sin_yaw_diff, cos_yaw_diff, 0, \
+                              0, 0, 1)
+    # 计算地心地固坐标系下的位置和速度
+    R_ecef_local = R_ecef_enu * R_enu_local
+    P_ecef = R_ecef_local * local_pos + ref_ecef
+    V_ecef = R_ecef_local * local_vel
+    return P_ecef, V_ecef
+
+# 一颗卫星的伪距/多普勒残差: 2维
+def gnss_satellite_residual(
+    P_ecef: sf.V3,
+    V_ecef: sf.V3,
+    rcv_dt: sf.Scalar,
+    rcv_ddt: sf.Scalar,
+    ion_delay: sf.Scalar,
+    tro_delay: sf.Scalar,
+    tgd: sf.Scalar,
+    sv_pos: sf.V3,
+    sv_vel: sf.V3,
+    svdt: sf.Scalar,
+    svddt: sf.Scalar,
+    freq: sf.Scalar,
+    psr_measured: sf.Scalar,
+    dopp_measured: sf.Scalar,
+    pr_weight: sf.Scalar,
+    dp_weight: sf.Scalar,
+) -> sf.V2:
+    rcv2sat_ecef = sv_pos - P_ecef
+    rcv2sat_unit = rcv2sat_ecef.normalized()
+
+    psr_sagnac = EARTH_OMG_GPS*(sv_pos.x*P_ecef.y-sv_pos.y*P_ecef.x)/LIGHT_SPEED
+
+    psr_estimated = rcv2sat_ecef.norm() + psr_sagnac + rcv_dt - svdt*LIGHT_SPEED + \
+                    ion_delay + tro_delay + tgd*LIGHT_SPEED
+    # psr_measured = obs->psr[freq_idx]
+    r_pseudorange = (psr_estimated - psr_measured) * pr_weight
+
+    dopp_sagnac = EARTH_OMG_GPS/LIGHT_SPEED*(sv_vel.x*P_ecef.y+ sv_pos.x*V_ecef.y - sv_vel.y*P_ecef.x - sv_pos.y*V_ecef.x)
+    dopp_estimated = (sv_vel - V_ecef).dot(rcv2sat_unit) + dopp_sagnac + rcv_ddt - svddt*LIGHT_SPEED
+    wavelength = LIGHT_SPEED / freq
+    # dopp_measured = obs->dopp[freq_idx]
+    r_doppler = (dopp_estimated + dopp_measured * wavelength) * dp_weight
+
+    return sf.V2(r_pseudorange, r_doppler)
+
+
 # gnss psr dopp residual: 2维
 def gnss_psr_dopp_residual(
     # states:
@@ -149,24 +302,13 @@ def gnss_psr_dopp_residual(
     epsilon: sf.Scalar = 0
 ) -> sf.V2:
     # construct residuals here.
-    local_pos = ratio * Pi + (1.0 - ratio) * Pj
-    local_vel = ratio * Vi + (1.0 - ratio) * Vj
-    sin_yaw_diff = sf.sin(yaw_diff)
-    cos_yaw_diff = sf.cos(yaw_diff)
-    R_enu_local = sf.Matrix33(cos_yaw_diff, -sin_yaw_diff, 0, \
-                              sin_yaw_diff, cos_yaw_diff, 0, \
-                              0, 0, 1)
-    # 计算地心地固坐标系下的位置和速度
-    R_ecef_enu = ecef2rotation(ref_ecef, epsilon)
-    R_ecef_local = R_ecef_enu * R_enu_local
-    P_ecef = R_ecef_local * local_pos + ref_ecef
-    V_ecef = R_ecef_local * local_vel
+    P_ecef, V_ecef = gnss_receiver_ecef(Pi, Vi, Pj, Vj, yaw_diff, ref_ecef, ratio, epsilon)
 
     # tmp comment
     # 计算卫星的方位角/仰角
     # azel = sat_azel(P_ecef, sv_pos, epsilon)
     # rcv_lla = ecef2geo(P_ecef)
-    # TODO: 
+    # 在因子里计算延迟的版本见gnss_psr_dopp_atmosphere_residual
     # tro_delay = calculate_trop_delay(obs->time, rcv_lla, azel)
     # ion_delay = calculate_ion_delay(obs->time, iono_paras, rcv_lla, azel)
 
@@ -176,26 +318,252 @@ def gnss_psr_dopp_residual(
     # dp_weight = sin_el_2 / dp_uura * relative_sqrt_info * PSR_TO_DOPP_RATIO
     # the end.
 
-    rcv2sat_ecef = sv_pos - P_ecef
-    rcv2sat_unit = rcv2sat_ecef.normalized()
+    return gnss_satellite_residual(
+        P_ecef, V_ecef, rcv_dt, rcv_ddt, ion_delay, tro_delay, tgd, sv_pos, sv_vel, svdt, svddt, freq,
+        psr_measured, dopp_measured, pr_weight, dp_weight,
+    )
 
-    psr_sagnac = EARTH_OMG_GPS*(sv_pos.x*P_ecef.y-sv_pos.y*P_ecef.x)/LIGHT_SPEED
 
-    psr_estimated = rcv2sat_ecef.norm() + psr_sagnac + rcv_dt - svdt*LIGHT_SPEED + \
-                    ion_delay + tro_delay + tgd*LIGHT_SPEED
-    # psr_measured = obs->psr[freq_idx]
-    r_pseudorange = (psr_estimated - psr_measured) * pr_weight
 
-    dopp_sagnac = EARTH_OMG_GPS/LIGHT_SPEED*(sv_vel.x*P_ecef.y+ sv_pos.x*V_ecef.y - sv_vel.y*P_ecef.x - sv_pos.y*V_ecef.x)
-    dopp_estimated = (sv_vel - V_ecef).dot(rcv2sat_unit) + dopp_sagnac + rcv_ddt - svddt*LIGHT_SPEED
-    wavelength = LIGHT_SPEED / freq
-    # dopp_measured = obs->dopp[freq_idx]
-    r_doppler = (dopp_estimated + dopp_measured * wavelength) * dp_weight
+# 按仰角的伪距/多普勒权重: sin(el)^2/uura
+def gnss_elevation_weights(
+    P_ecef: sf.V3, sv_pos: sf.V3, pr_uura: sf.Scalar, dp_uura: sf.Scalar, epsilon: sf.Scalar = 0
+) -> T.Tuple[sf.Scalar, sf.Scalar]:
+    # 计算卫星的方位角/仰角
+    azel = sat_azel(P_ecef, sv_pos, epsilon)
+    sin_el = sf.sin(azel.y)
+    sin_el_2 = sin_el*sin_el
+    pr_weight = sin_el_2 / pr_uura * relative_sqrt_info
+    dp_weight = sin_el_2 / dp_uura * relative_sqrt_info * PSR_TO_DOPP_RATIO
+    return pr_weight, dp_weight
 
 
-    return sf.V2(r_pseudorange, r_doppler)
+# 和gnss_psr_dopp_residual一样, 但是pr_weight/dp_weight在因子里由仰角计算(sin(el)^2/uura),
+# 和残差共用接收机位置、视线方向等子表达式
+def gnss_psr_dopp_weighted_residual(
+    # states:
+    Pi: sf.V3,
+    Vi: sf.V3,
+    Pj: sf.V3,
+    Vj: sf.V3,
+    rcv_dt: sf.Scalar,
+    rcv_ddt: sf.Scalar,
+    yaw_diff: sf.Scalar,
+    ref_ecef: sf.V3,
+    ion_delay: sf.Scalar,
+    tro_delay: sf.Scalar,
+
+    # precomputed:
+    ratio: sf.Scalar,
+    tgd: sf.Scalar,
+    sv_pos: sf.V3,
+    sv_vel: sf.V3,
+    svdt: sf.Scalar,
+    svddt: sf.Scalar,
+    freq: sf.Scalar,
+    psr_measured: sf.Scalar, # observation data pseudorange (m)
+    dopp_measured: sf.Scalar, # observation data doppler frequency (Hz)
+    pr_uura: sf.Scalar,
+    dp_uura: sf.Scalar,
+    epsilon: sf.Scalar = 0
+) -> sf.V2:
+    P_ecef, V_ecef = gnss_receiver_ecef(Pi, Vi, Pj, Vj, yaw_diff, ref_ecef, ratio, epsilon)
+
+    pr_weight, dp_weight = gnss_elevation_weights(P_ecef, sv_pos, pr_uura, dp_uura, epsilon)
+    return gnss_satellite_residual(
+        P_ecef, V_ecef, rcv_dt, rcv_ddt, ion_delay, tro_delay, tgd, sv_pos, sv_vel, svdt, svddt, freq,
+        psr_measured, dopp_measured, pr_weight, dp_weight,
+    )
+
+
+# anchor的预计算: 只在初始化(或者anchor改变)时调用一次
+def gnss_anchor_rotation(ref_ecef: sf.V3, epsilon: sf.Scalar = 0) -> sf.Matrix33:
+    return ecef2rotation(ref_ecef, epsilon)
+
+# gnss psr dopp residual, anchor固定的版本: R_ecef_enu由gnss_anchor_rotation预先算好,
+# 因子里不再有ecef2geo的atan/pow/sqrt, ref_ecef也不再线性化
+def gnss_psr_dopp_fixed_anchor_residual(
+    # states:
+    Pi: sf.V3,
+    Vi: sf.V3,
+    Pj: sf.V3,
+    Vj: sf.V3,
+    rcv_dt: sf.Scalar,
+    rcv_ddt: sf.Scalar,
+    yaw_diff: sf.Scalar,
+    # anchor:
+    ref_ecef: sf.V3,
+    R_ecef_enu: sf.Matrix33,
+    ion_delay: sf.Scalar,
+    tro_delay: sf.Scalar,
+
+    # precomputed:
+    ratio: sf.Scalar,
+    tgd: sf.Scalar,
+    sv_pos: sf.V3,
+    sv_vel: sf.V3,
+    svdt: sf.Scalar,
+    svddt: sf.Scalar,
+    freq: sf.Scalar,
+    psr_measured: sf.Scalar, # observation data pseudorange (m)
+    dopp_measured: sf.Scalar, # observation data doppler frequency (Hz)
+    pr_weight: sf.Scalar,
+    dp_weight: sf.Scalar,
+    epsilon: sf.Scalar = 0
+) -> sf.V2:
+    P_ecef, V_ecef = gnss_receiver_ecef_from_rotation(Pi, Vi, Pj, Vj, yaw_diff, ref_ecef, R_ecef_enu, ratio)
+    return gnss_satellite_residual(
+        P_ecef, V_ecef, rcv_dt, rcv_ddt, ion_delay, tro_delay, tgd, sv_pos, sv_vel, svdt, svddt, freq,
+        psr_measured, dopp_measured, pr_weight, dp_weight,
+    )
+
+# 和gnss_psr_dopp_residual一样, 但是电离层/对流层延迟在因子里由Klobuchar/Saastamoinen模型计算
+def gnss_psr_dopp_atmosphere_residual(
+    # states:
+    Pi: sf.V3,
+    Vi: sf.V3,
+    Pj: sf.V3,
+    Vj: sf.V3,
+    rcv_dt: sf.Scalar,
+    rcv_ddt: sf.Scalar,
+    yaw_diff: sf.Scalar,
+    ref_ecef: sf.V3,
+    # atmosphere:
+    gps_tow: sf.Scalar,
+    ion_params: sf.Matrix81,
+
+    # precomputed:
+    ratio: sf.Scalar,
+    tgd: sf.Scalar,
+    sv_pos: sf.V3,
+    sv_vel: sf.V3,
+    svdt: sf.Scalar,
+    svddt: sf.Scalar,
+    freq: sf.Scalar,
+    psr_measured: sf.Scalar, # observation data pseudorange (m)
+    dopp_measured: sf.Scalar, # observation data doppler frequency (Hz)
+    pr_weight: sf.Scalar,
+    dp_weight: sf.Scalar,
+    epsilon: sf.Scalar = 0
+) -> sf.V2:
+    P_ecef, V_ecef = gnss_receiver_ecef(Pi, Vi, Pj, Vj, yaw_diff, ref_ecef, ratio, epsilon)
+    ion_delay, tro_delay = gnss_atmosphere_delays(P_ecef, sv_pos, gps_tow, ion_params, freq, epsilon)
+    return gnss_satellite_residual(
+        P_ecef, V_ecef, rcv_dt, rcv_ddt, ion_delay, tro_delay, tgd, sv_pos, sv_vel, svdt, svddt, freq,
+        psr_measured, dopp_measured, pr_weight, dp_weight,
+    )
 
+# 线性化的状态, 切空间一共18维
+GNSS_LINEARIZATION_ARGS = ["Pi", "Vi", "Pj", "Vj", "rcv_dt", "rcv_ddt", "yaw_diff", "ref_ecef"]
+
+GNSS_FIXED_ANCHOR_LINEARIZATION_ARGS = ["Pi", "Vi", "Pj", "Vj", "rcv_dt", "rcv_ddt", "yaw_diff"]
+
+# 一个历元的所有卫星观测: 卫星数固定为num_sats, 每颗卫星的量按列(sv_pos, sv_vel)或按行堆叠,
+# valid为0的位置是空的(数据仍需是有限值, 比如全0). 同一历元的观测时间相同, 所以ratio只有一个
+GNSS_EPOCH_SATELLITE_SCALARS = [
+    "ion_delay", "tro_delay", "tgd", "svdt", "svddt", "freq", "psr_measured", "dopp_measured",
+    "pr_weight", "dp_weight", "valid",
+]
+
+def gnss_epoch_inputs(num_sats: int) -> Values:
+    inputs = Values()
+    for name in ("Pi", "Vi", "Pj", "Vj"):
+        inputs[name] = sf.V3.symbolic(name)
+    for name in ("rcv_dt", "rcv_ddt", "yaw_diff"):
+        inputs[name] = sf.Symbol(name)
+    inputs["ref_ecef"] = sf.V3.symbolic("ref_ecef")
+    inputs["ratio"] = sf.Symbol("ratio")
+    inputs["sv_pos"] = sf.Matrix(3, num_sats).symbolic("sv_pos")
+    inputs["sv_vel"] = sf.Matrix(3, num_sats).symbolic("sv_vel")
+    for name in GNSS_EPOCH_SATELLITE_SCALARS:
+        inputs[name] = sf.Matrix(num_sats, 1).symbolic(name)
+    inputs["epsilon"] = sf.Symbol("epsilon")
+    return inputs
+
+def gnss_epoch_satellite_residuals(inputs: Values, P_ecef: sf.V3, V_ecef: sf.V3) -> T.List[sf.V2]:
+    num_sats = inputs["valid"].rows
+    residuals = []
+    for k in range(num_sats):
+        scalars = {name: inputs[name][k] for name in GNSS_EPOCH_SATELLITE_SCALARS}
+        residual = gnss_satellite_residual(
+            P_ecef,
+            V_ecef,
+            inputs["rcv_dt"],
+            inputs["rcv_ddt"],
+            scalars["ion_delay"],
+            scalars["tro_delay"],
+            scalars["tgd"],
+            sf.V3(inputs["sv_pos"][:, k]),
+            sf.V3(inputs["sv_vel"][:, k]),
+            scalars["svdt"],
+            scalars["svddt"],
+            scalars["freq"],
+            scalars["psr_measured"],
+            scalars["dopp_measured"],
+            scalars["pr_weight"],
+            scalars["dp_weight"],
+        )
+        residuals.append(scalars["valid"] * residual)
+    return residuals
+
+# 输出: 2 * num_sats维的残差, 第k颗卫星是[伪距, 多普勒]
+def gnss_epoch_codegen(num_sats: int, config: codegen.CodegenConfig) -> codegen.Codegen:
+    inputs = gnss_epoch_inputs(num_sats)
+    P_ecef, V_ecef = gnss_receiver_ecef(
+        inputs["Pi"], inputs["Vi"], inputs["Pj"], inputs["Vj"], inputs["yaw_diff"], inputs["ref_ecef"],
+        inputs["ratio"], inputs["epsilon"],
+    )
+    residuals = gnss_epoch_satellite_residuals(inputs, P_ecef, V_ecef)
+    return codegen.Codegen(
+        inputs=inputs,
+        outputs=Values(res=sf.Matrix.block_matrix([[r] for r in residuals])),
+        config=config,
+        name=f"gnss_epoch{num_sats}_residual",
+        return_key="res",
+    )
 
+# 历元因子的线性化, 状态顺序和GNSS_LINEARIZATION_ARGS一致.
+# 和projection_gnc_multi_factor_codegen一样, 先对P_ecef/V_ecef符号求每颗卫星的导数,
+# 再乘以只算一次的 d(P_ecef, V_ecef)/d(Pi, Vi, Pj, Vj, yaw_diff, ref_ecef)
+def gnss_epoch_factor_codegen(
+    num_sats: int,
+    config: codegen.CodegenConfig,
+    linearization_mode: codegen.LinearizationMode = codegen.LinearizationMode.FULL_LINEARIZATION,
+) -> codegen.Codegen:
+    inputs = gnss_epoch_inputs(num_sats)
+    P_ecef, V_ecef = gnss_receiver_ecef(
+        inputs["Pi"], inputs["Vi"], inputs["Pj"], inputs["Vj"], inputs["yaw_diff"], inputs["ref_ecef"],
+        inputs["ratio"], inputs["epsilon"],
+    )
+    # 状态都是向量空间, 切空间的jacobian就是普通的jacobian
+    states = sf.Matrix(Values(**{name: inputs[name] for name in GNSS_LINEARIZATION_ARGS}).to_storage())
+    receiver = sf.Matrix.block_matrix([[P_ecef], [V_ecef]])
+    receiver_D_states = receiver.jacobian(states)
+
+    P_ecef_symbol = sf.V3.symbolic("P_ecef")
+    V_ecef_symbol = sf.V3.symbolic("V_ecef")
+    receiver_symbol = sf.Matrix.block_matrix([[P_ecef_symbol], [V_ecef_symbol]])
+    clock = sf.Matrix([inputs["rcv_dt"], inputs["rcv_ddt"]])
+    residuals = gnss_epoch_satellite_residuals(inputs, P_ecef_symbol, V_ecef_symbol)
+    jacobians = []
+    for residual in residuals:
+        jacobian = residual.jacobian(receiver_symbol) * receiver_D_states
+        # rcv_dt, rcv_ddt是第12, 13维, 只直接出现在残差里
+        jacobian[:, 12:14] = jacobian[:, 12:14] + residual.jacobian(clock)
+        jacobians.append(jacobian)
+
+    substitutions = {**dict(zip(P_ecef_symbol, P_ecef)), **dict(zip(V_ecef_symbol, V_ecef))}
+    res = sf.Matrix.block_matrix([[r] for r in residuals]).subs(substitutions)
+    jacobian = sf.Matrix.block_matrix([[J] for J in jacobians]).subs(substitutions)
+    outputs = Values(res=res, jacobian=jacobian)
+    if linearization_mode == codegen.LinearizationMode.FULL_LINEARIZATION:
+        outputs["hessian"] = jacobian.compute_AtA(lower_only=True)
+        outputs["rhs"] = jacobian.T * res
+        name = f"gnss_epoch{num_sats}_factor"
+    else:
+        name = f"gnss_epoch{num_sats}_residual_with_jacobian"
+
+    return codegen.Codegen(inputs=inputs, outputs=outputs, config=config, name=name)
 
  # for gnss
 def generate_gnss_residual_code(
@@ -208,7 +576,7 @@ def generate_gnss_residual_code(
 
     gnss_data = gnss_codegen.generate_function(output_dir)
 
-    gnss_codegen_with_linearization = gnss_codegen.with_linearization(which_args=["Pi", "Vi", "Pj", "Vj", "rcv_dt", "rcv_ddt", "yaw_diff", "ref_ecef"])
+    gnss_codegen_with_linearization = gnss_codegen.with_linearization(which_args=GNSS_LINEARIZATION_ARGS)
 
     # 生成构建因子图的函数
     # Generate the function and print the code
@@ -217,9 +585,98 @@ def generate_gnss_residual_code(
     )
 
 
-output_dir="/root/dev/python_ws/test_sym"
+def generate_gnss_epoch_code(
+    output_dir: T.Optional[Path] = None, print_code: bool = False, num_sats: int = 40
+) -> None:
+    gnss_epoch_codegen(num_sats, codegen.CppConfig()).generate_function(output_dir)
 
-generate_gnss_residual_code(output_dir)
+    gnss_epoch_factor_codegen(num_sats, codegen.CppConfig()).generate_function(
+        output_dir=output_dir, skip_directory_nesting=False
+    )
+
+
+def generate_gnss_fixed_anchor_code(
+    output_dir: T.Optional[Path] = None, print_code: bool = False
+) -> None:
+    anchor_codegen = codegen.Codegen.function(
+        func=gnss_anchor_rotation,
+        config=codegen.CppConfig(),
+        output_names=["R_ecef_enu"],
+        name="gnss_anchor_precompute",
+    )
+    anchor_codegen.generate_function(output_dir)
+
+    gnss_codegen_with_linearization = codegen.Codegen.function(
+        func=gnss_psr_dopp_fixed_anchor_residual,
+        config=codegen.CppConfig(),
+    ).with_linearization(which_args=GNSS_FIXED_ANCHOR_LINEARIZATION_ARGS, name="gnss_psr_dopp_fixed_anchor_factor")
+
+    gnss_codegen_with_linearization.generate_function(
+        output_dir=output_dir, skip_directory_nesting=False
+    )
+
+
+def generate_gnss_atmosphere_code(
+    output_dir: T.Optional[Path] = None, print_code: bool = False
+) -> None:
+    delays_codegen = codegen.Codegen.function(
+        func=gnss_atmosphere_delays,
+        config=codegen.CppConfig(),
+        output_names=["ion_delay", "tro_delay"],
+    )
+    delays_codegen.generate_function(output_dir)
+
+    gnss_codegen_with_linearization = codegen.Codegen.function(
+        func=gnss_psr_dopp_atmosphere_residual,
+        config=codegen.CppConfig(),
+    ).with_linearization(which_args=GNSS_LINEARIZATION_ARGS, name="gnss_psr_dopp_atmosphere_factor")
+
+    gnss_codegen_with_linearization.generate_function(
+        output_dir=output_dir, skip_directory_nesting=False
+    )
+
+
+# 因子里按仰角加权. weight_jacobian为False时和GVINS的解析jacobian一样把权重看作常数:
+# 先对带pr_weight/dp_weight符号的残差求导, 再把权重的表达式代回去
+def gnss_weighted_factor_codegen(config: codegen.CodegenConfig, weight_jacobian: bool = True) -> codegen.Codegen:
+    if weight_jacobian:
+        return codegen.Codegen.function(func=gnss_psr_dopp_weighted_residual, config=config).with_linearization(
+            which_args=GNSS_LINEARIZATION_ARGS, name="gnss_psr_dopp_weighted_factor"
+        )
+
+    factor_codegen = codegen.Codegen.function(func=gnss_psr_dopp_residual, config=config).with_linearization(
+        which_args=GNSS_LINEARIZATION_ARGS
+    )
+    inputs = Values(
+        **{key: value for key, value in factor_codegen.inputs.items() if key not in ("pr_weight", "dp_weight")}
+    )
+    P_ecef, _ = gnss_receiver_ecef(
+        inputs["Pi"], inputs["Vi"], inputs["Pj"], inputs["Vj"], inputs["yaw_diff"], inputs["ref_ecef"],
+        inputs["ratio"], inputs["epsilon"],
+    )
+    pr_weight, dp_weight = gnss_elevation_weights(
+        P_ecef, inputs["sv_pos"], inputs["pr_uura"], inputs["dp_uura"], inputs["epsilon"]
+    )
+    substitutions = {
+        factor_codegen.inputs["pr_weight"]: pr_weight,
+        factor_codegen.inputs["dp_weight"]: dp_weight,
+    }
+    outputs = Values(**{key: value.subs(substitutions) for key, value in factor_codegen.outputs.items()})
+    return codegen.Codegen(
+        inputs=inputs, outputs=outputs, config=config, name="gnss_psr_dopp_weighted_constant_factor"
+    )
+
+
+def generate_gnss_weighted_code(
+    output_dir: T.Optional[Path] = None, print_code: bool = False
+) -> None:
+    for weight_jacobian in (True, False):
+        gnss_weighted_factor_codegen(codegen.CppConfig(), weight_jacobian).generate_function(
+            output_dir=output_dir, skip_directory_nesting=False
+        )
+
+
+output_dir = os.environ.get("SYMFORCE_OUTPUT_DIR", "/root/dev/python_ws/test_sym")
 
 
 # for test
@@ -269,10 +726,16 @@ def calc_p_ecef(
     return P_ecef
 
 
-calc_p_ecef_codegen = codegen.Codegen.function(
-    func=calc_p_ecef,
-    config=codegen.CppConfig(),
-)
-# calc_p_ecef_data = calc_p_ecef_codegen.generate_function(output_dir)
+def generate_calc_p_ecef_code(
+    output_dir: T.Optional[Path] = None, print_code: bool = False
+) -> None:
+    calc_p_ecef_codegen = codegen.Codegen.function(
+        func=calc_p_ecef,
+        config=codegen.CppConfig(),
+    )
+    calc_p_ecef_codegen.generate_function(output_dir)
+
+if __name__ == "__main__":
+    generate_gnss_residual_code(output_dir)
 
-display(sf.numeric_epsilon)
\ No newline at end of file
+    display(sf.numeric_epsilon)
\ No newline at end of file
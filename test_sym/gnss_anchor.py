@@ -0,0 +1,111 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+
+from gnss import GNSS_FIXED_ANCHOR_LINEARIZATION_ARGS
+from gnss import gnss_anchor_rotation
+from gnss import gnss_psr_dopp_fixed_anchor_residual
+from gnss_epoch import gnss_single_factor_codegen
+from gnss_epoch import random_epochs
+from gnss_epoch import single_factor_inputs
+from imu_residual_variants import GeneratedSize
+from imu_residual_variants import generated_size
+from imu_residual_variants import print_sizes
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+
+# 状态的前15维(不含ref_ecef)在两个因子里的顺序相同
+FIXED_ANCHOR_DIM = 15
+
+
+def gnss_anchor_precompute_codegen(config: codegen.CodegenConfig) -> codegen.Codegen:
+    return codegen.Codegen.function(
+        func=gnss_anchor_rotation, config=config, output_names=["R_ecef_enu"], name="gnss_anchor_precompute"
+    )
+
+
+def gnss_fixed_anchor_factor_codegen(config: codegen.CodegenConfig) -> codegen.Codegen:
+    return codegen.Codegen.function(func=gnss_psr_dopp_fixed_anchor_residual, config=config).with_linearization(
+        which_args=GNSS_FIXED_ANCHOR_LINEARIZATION_ARGS, name="gnss_psr_dopp_fixed_anchor_factor"
+    )
+
+
+def generate_gnss_anchor_sizes(output_dir: T.Openable) -> T.List[GeneratedSize]:
+    sizes = []
+    for factor_codegen in (
+        gnss_single_factor_codegen(codegen.CppConfig()),
+        gnss_fixed_anchor_factor_codegen(codegen.CppConfig()),
+        gnss_anchor_precompute_codegen(codegen.CppConfig()),
+    ):
+        start = time.perf_counter()
+        metadata = factor_codegen.generate_function(output_dir=output_dir)
+        sizes.append(generated_size(factor_codegen.name, metadata.generated_files[0], time.perf_counter() - start))
+    return sizes
+
+
+def benchmark_gnss_anchor(num_obs: int, repeats: int = 5) -> None:
+    """
+    Linearize num_obs satellite observations with the current factor and with the fixed anchor
+    variant (anchor precompute included once), and compare the shared jacobian columns.
+    """
+    gen_dir = tempfile.mkdtemp(prefix="gnss_anchor_")
+
+    def load(factor_codegen: codegen.Codegen) -> T.Callable:
+        return load_numpy_batch_function(generate_numpy_batch_function(factor_codegen, gen_dir))
+
+    full_factor = load(gnss_single_factor_codegen(codegen.PythonConfig()))
+    fixed_factor = load(gnss_fixed_anchor_factor_codegen(codegen.PythonConfig()))
+    anchor_precompute = load(gnss_anchor_precompute_codegen(codegen.PythonConfig()))
+
+    # 整个窗口共用一个anchor
+    data = random_epochs(num_obs, 1, 1)
+    data["ref_ecef"] = np.broadcast_to(data["ref_ecef"][0], data["ref_ecef"].shape)
+    inputs = single_factor_inputs(data)
+    fixed_inputs = {key: value for key, value in inputs.items() if key not in ("pr_uura", "dp_uura")}
+
+    full_factor(**inputs, epsilon=sf.numeric_epsilon)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        full_res, full_jacobian, _, _ = full_factor(**inputs, epsilon=sf.numeric_epsilon)
+    full_time = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        R_ecef_enu = anchor_precompute(inputs["ref_ecef"][0], sf.numeric_epsilon)[0]
+        # R_ecef_enu按列存储
+        fixed_res, fixed_jacobian, _, _ = fixed_factor(
+            **fixed_inputs, R_ecef_enu=R_ecef_enu.T.ravel(), epsilon=sf.numeric_epsilon
+        )
+    fixed_time = (time.perf_counter() - start) / repeats
+
+    difference = max(
+        np.max(np.abs(fixed_res - full_res) / np.maximum(np.abs(full_res), 1.0)),
+        np.max(
+            np.abs(fixed_jacobian - full_jacobian[:, :, :FIXED_ANCHOR_DIM])
+            / np.maximum(np.abs(full_jacobian[:, :, :FIXED_ANCHOR_DIM]), 1.0)
+        ),
+    )
+    print(
+        f"{num_obs} observations: current factor {full_time / num_obs * 1e9:.0f} ns/obs, "
+        f"fixed anchor {fixed_time / num_obs * 1e9:.0f} ns/obs ({full_time / fixed_time:.2f}x), "
+        f"max relative difference {difference:.2e}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmark", action="store_true", help="time the numpy batch factors")
+    parser.add_argument("--num_obs", type=int, default=20000, help="satellite observations for the benchmark")
+    args = parser.parse_args()
+
+    print_sizes(generate_gnss_anchor_sizes(tempfile.mkdtemp(prefix="gnss_anchor_")))
+    if args.benchmark:
+        benchmark_gnss_anchor(args.num_obs)
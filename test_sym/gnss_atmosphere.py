@@ -0,0 +1,267 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import math
+import tempfile
+import time
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+
+from gnss import EARTH_ECCE_2
+from gnss import EARTH_SEMI_MAJOR
+from gnss import GNSS_LINEARIZATION_ARGS
+from gnss import GPS_L1_FREQ
+from gnss import KLOBUCHAR_DEFAULT
+from gnss import LIGHT_SPEED
+from gnss import TROP_HUMIDITY
+from gnss import TROP_TEMP0
+from gnss import gnss_atmosphere_delays
+from gnss import gnss_psr_dopp_atmosphere_residual
+from gnss_epoch import gnss_single_factor_codegen
+from gnss_epoch import random_epochs
+from gnss_epoch import single_factor_inputs
+from gnss_geodetic import GeodeticConverter
+from imu_residual_variants import GeneratedSize
+from imu_residual_variants import generated_size
+from imu_residual_variants import print_sizes
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+
+# Klobuchar/Saastamoinen延迟的批量NumPy版本: 一次调用算完一个(或多个)历元所有卫星的ion_delay/tro_delay,
+# 和因子里(gnss_psr_dopp_atmosphere_residual)用的是同一个符号表达式
+
+
+class AtmosphereDelays:
+    """
+    Batched ion_delay / tro_delay for the satellites of an epoch. The receiver position, time
+    and Klobuchar parameters may be given once for the epoch or per satellite.
+    """
+
+    def __init__(self, output_dir: T.Openable) -> None:
+        self.delays = load_numpy_batch_function(
+            generate_numpy_batch_function(
+                codegen.Codegen.function(
+                    func=gnss_atmosphere_delays,
+                    config=codegen.PythonConfig(),
+                    output_names=["ion_delay", "tro_delay"],
+                ),
+                output_dir,
+                name="gnss_atmosphere_delays_batch",
+            )
+        )
+
+    def __call__(
+        self,
+        rcv_ecef: np.ndarray,
+        sv_pos: np.ndarray,
+        gps_tow: T.Union[float, np.ndarray],
+        ion_params: T.Sequence[float] = KLOBUCHAR_DEFAULT,
+        freq: T.Union[float, np.ndarray] = GPS_L1_FREQ,
+    ) -> T.Tuple[np.ndarray, np.ndarray]:
+        """
+        Args:
+            rcv_ecef: (3,) or (N, 3) receiver positions
+            sv_pos: (N, 3) satellite positions
+            gps_tow: GPS time of week (s), scalar or (N,)
+            ion_params: (8,) or (N, 8) Klobuchar alpha0..3, beta0..3
+            freq: carrier frequency (Hz), scalar or (N,)
+
+        Returns:
+            ion_delay (N,), tro_delay (N,) in meters
+        """
+        return self.delays(
+            rcv_ecef=np.asarray(rcv_ecef, dtype=np.float64),
+            sv_pos=np.asarray(sv_pos, dtype=np.float64),
+            gps_tow=np.asarray(gps_tow, dtype=np.float64),
+            ion_params=np.asarray(ion_params, dtype=np.float64),
+            freq=np.asarray(freq, dtype=np.float64),
+            epsilon=sf.numeric_epsilon,
+        )
+
+
+def reference_delays(
+    rcv_ecef: np.ndarray, sv_pos: np.ndarray, gps_tow: float, ion_params: T.Sequence[float], freq: float
+) -> T.Tuple[float, float]:
+    """
+    Per-satellite port of RTKLIB's ecef2pos/satazel/ionmodel/tropmodel, the kind of loop the
+    batch evaluator replaces.
+    """
+    # ecef2pos
+    x, y, z = rcv_ecef
+    r2 = x * x + y * y
+    v, zk, sinp = EARTH_SEMI_MAJOR, 0.0, 0.0
+    zz = z
+    while abs(zz - zk) >= 1e-4:
+        zk = zz
+        sinp = zz / math.sqrt(r2 + zz * zz)
+        v = EARTH_SEMI_MAJOR / math.sqrt(1.0 - EARTH_ECCE_2 * sinp * sinp)
+        zz = z + v * EARTH_ECCE_2 * sinp
+    lat = math.atan(zz / math.sqrt(r2))
+    lon = math.atan2(y, x)
+    hgt = math.sqrt(r2 + zz * zz) - v
+
+    # satazel
+    e = (np.asarray(sv_pos) - rcv_ecef) / np.linalg.norm(np.asarray(sv_pos) - rcv_ecef)
+    sin_lat, cos_lat, sin_lon, cos_lon = math.sin(lat), math.cos(lat), math.sin(lon), math.cos(lon)
+    east = -sin_lon * e[0] + cos_lon * e[1]
+    north = -sin_lat * cos_lon * e[0] - sin_lat * sin_lon * e[1] + cos_lat * e[2]
+    up = cos_lat * cos_lon * e[0] + cos_lat * sin_lon * e[1] + sin_lat * e[2]
+    az = math.atan2(east, north)
+    el = math.asin(up)
+    if el <= 0.0:
+        return 0.0, 0.0
+
+    # ionmodel
+    psi = 0.0137 / (el / math.pi + 0.11) - 0.022
+    phi = lat / math.pi + psi * math.cos(az)
+    phi = min(max(phi, -0.416), 0.416)
+    lam = lon / math.pi + psi * math.sin(az) / math.cos(phi * math.pi)
+    phi += 0.064 * math.cos((lam - 1.617) * math.pi)
+    tt = 43200.0 * lam + gps_tow
+    tt -= math.floor(tt / 86400.0) * 86400.0
+    f = 1.0 + 16.0 * (0.53 - el / math.pi) ** 3
+    amp = ion_params[0] + phi * (ion_params[1] + phi * (ion_params[2] + phi * ion_params[3]))
+    per = ion_params[4] + phi * (ion_params[5] + phi * (ion_params[6] + phi * ion_params[7]))
+    amp = max(amp, 0.0)
+    per = max(per, 72000.0)
+    xx = 2.0 * math.pi * (tt - 50400.0) / per
+    ion = LIGHT_SPEED * f * (5e-9 + amp * (1.0 + xx * xx * (-0.5 + xx * xx / 24.0)) if abs(xx) < 1.57 else 5e-9)
+    ion *= (GPS_L1_FREQ / freq) ** 2
+    if hgt < -1e3:
+        ion = 0.0
+
+    # tropmodel
+    if hgt < -100.0 or hgt > 1e4:
+        return ion, 0.0
+    hgt = max(hgt, 0.0)
+    pres = 1013.25 * (1.0 - 2.2557e-5 * hgt) ** 5.2568
+    temp = TROP_TEMP0 - 6.5e-3 * hgt + 273.16
+    humi = 6.108 * TROP_HUMIDITY * math.exp((17.15 * temp - 4684.0) / (temp - 38.45))
+    z = math.pi / 2.0 - el
+    trph = 0.0022768 * pres / (1.0 - 0.00266 * math.cos(2.0 * lat) - 0.00028 * hgt / 1e3) / math.cos(z)
+    trpw = 0.002277 * (1255.0 / temp + 0.05) * humi / math.cos(z)
+    return ion, trph + trpw
+
+
+def gnss_atmosphere_factor_codegen(config: codegen.CodegenConfig) -> codegen.Codegen:
+    return codegen.Codegen.function(func=gnss_psr_dopp_atmosphere_residual, config=config).with_linearization(
+        which_args=GNSS_LINEARIZATION_ARGS, name="gnss_psr_dopp_atmosphere_factor"
+    )
+
+
+def generate_gnss_atmosphere_sizes(output_dir: T.Openable) -> T.List[GeneratedSize]:
+    sizes = []
+    for factor_codegen in (
+        gnss_single_factor_codegen(codegen.CppConfig()),
+        gnss_atmosphere_factor_codegen(codegen.CppConfig()),
+        codegen.Codegen.function(
+            func=gnss_atmosphere_delays, config=codegen.CppConfig(), output_names=["ion_delay", "tro_delay"]
+        ),
+    ):
+        start = time.perf_counter()
+        metadata = factor_codegen.generate_function(output_dir=output_dir)
+        sizes.append(generated_size(factor_codegen.name, metadata.generated_files[0], time.perf_counter() - start))
+    return sizes
+
+
+def check_gnss_atmosphere(
+    delays: AtmosphereDelays,
+    converter: GeodeticConverter,
+    output_dir: T.Openable,
+    num_obs: int = 200,
+    elevation_mask_deg: float = 5.0,
+) -> None:
+    """
+    The in-factor delays against the factor fed with the batch evaluator's delays, for the
+    satellites above the elevation mask.
+    """
+    data = random_epochs(num_obs, 1, 1)
+    inputs = single_factor_inputs(data)
+    gps_tow = np.random.default_rng(1).uniform(0.0, 604800.0, size=num_obs)
+
+    atmosphere_factor = load_numpy_batch_function(
+        generate_numpy_batch_function(gnss_atmosphere_factor_codegen(codegen.PythonConfig()), output_dir)
+    )
+    single_factor = load_numpy_batch_function(
+        generate_numpy_batch_function(gnss_single_factor_codegen(codegen.PythonConfig()), output_dir)
+    )
+    # 局部位置取0, 接收机就在ref_ecef上
+    rcv_ecef = inputs["ref_ecef"]
+    inputs = dict(inputs, Pi=np.zeros_like(inputs["Pi"]), Pj=np.zeros_like(inputs["Pj"]))
+    ion_delay, tro_delay = delays(rcv_ecef, inputs["sv_pos"], gps_tow, KLOBUCHAR_DEFAULT, inputs["freq"])
+    fed = dict(inputs, ion_delay=ion_delay, tro_delay=tro_delay)
+    in_factor = {
+        key: value for key, value in inputs.items() if key not in ("ion_delay", "tro_delay", "pr_uura", "dp_uura")
+    }
+    res, jacobian, _, _ = atmosphere_factor(
+        **in_factor, gps_tow=gps_tow, ion_params=np.array(KLOBUCHAR_DEFAULT), epsilon=sf.numeric_epsilon
+    )
+    expected_res, expected_jacobian, _, _ = single_factor(**fed, epsilon=sf.numeric_epsilon)
+    visible = converter.elevation_mask(rcv_ecef, inputs["sv_pos"], elevation_mask_deg)
+    print(
+        f"in-factor vs batch-fed, {np.count_nonzero(visible)} of {num_obs} satellites above "
+        f"{elevation_mask_deg:g} deg: max residual difference {np.max(np.abs(res - expected_res)[visible]):.2e}, "
+        f"max jacobian difference {np.max(np.abs(jacobian - expected_jacobian)[visible]):.2e} "
+        "(delay gradients w.r.t. the receiver position)"
+    )
+
+
+def benchmark_gnss_atmosphere(num_epochs: int, num_sats: int) -> None:
+    output_dir = tempfile.mkdtemp(prefix="gnss_atmosphere_")
+    delays = AtmosphereDelays(output_dir)
+    converter = GeodeticConverter(output_dir)
+
+    data = random_epochs(num_epochs, num_sats, num_sats)
+    rcv_ecef = data["ref_ecef"] + np.random.default_rng(2).uniform(0.0, 500.0, size=(num_epochs, 1)) * (
+        data["ref_ecef"] / EARTH_SEMI_MAJOR
+    )
+    gps_tow = np.random.default_rng(3).uniform(0.0, 604800.0, size=num_epochs)
+    rcv_rows = np.repeat(rcv_ecef, num_sats, axis=0)
+    sv_rows = data["sv_pos"].reshape(-1, 3)
+
+    start = time.perf_counter()
+    ion_delay, tro_delay = delays(rcv_rows, sv_rows, np.repeat(gps_tow, num_sats), KLOBUCHAR_DEFAULT, GPS_L1_FREQ)
+    batch_time = (time.perf_counter() - start) / num_epochs
+
+    # 逐历元调用: 接收机位置和时间只传一次
+    start = time.perf_counter()
+    for epoch in range(num_epochs):
+        delays(rcv_ecef[epoch], data["sv_pos"][epoch], gps_tow[epoch], KLOBUCHAR_DEFAULT, GPS_L1_FREQ)
+    epoch_time = (time.perf_counter() - start) / num_epochs
+
+    num_loop = min(num_epochs, 200)
+    start = time.perf_counter()
+    reference = np.array(
+        [
+            reference_delays(rcv_ecef[epoch], data["sv_pos"][epoch, sat], gps_tow[epoch], KLOBUCHAR_DEFAULT, GPS_L1_FREQ)
+            for epoch in range(num_loop)
+            for sat in range(num_sats)
+        ]
+    )
+    loop_time = (time.perf_counter() - start) / num_loop
+
+    # 包括地平线以下的卫星, 两边都是0
+    ion_error = np.max(np.abs(ion_delay[: num_loop * num_sats] - reference[:, 0]))
+    tro_error = np.max(np.abs(tro_delay[: num_loop * num_sats] - reference[:, 1]))
+    print(
+        f"{num_sats} satellites: all {num_epochs} epochs in one call {batch_time * 1e6:.1f} us/epoch, "
+        f"one call per epoch {epoch_time * 1e6:.1f} us/epoch, per-satellite python loop {loop_time * 1e6:.1f} us/epoch"
+    )
+    print(f"max difference to the per-satellite loop: ion_delay {ion_error:.1e} m, tro_delay {tro_error:.1e} m")
+    check_gnss_atmosphere(delays, converter, output_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmark", action="store_true", help="time the batch delay evaluator")
+    parser.add_argument("--num_epochs", type=int, default=2000, help="epochs for the benchmark")
+    parser.add_argument("--num_sats", type=int, default=40, help="satellites per epoch")
+    args = parser.parse_args()
+
+    print_sizes(generate_gnss_atmosphere_sizes(tempfile.mkdtemp(prefix="gnss_atmosphere_")))
+    if args.benchmark:
+        benchmark_gnss_atmosphere(args.num_epochs, args.num_sats)
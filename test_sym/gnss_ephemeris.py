@@ -0,0 +1,442 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+from dataclasses import astuple
+from dataclasses import dataclass
+from dataclasses import fields
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+from symforce.codegen import codegen_util
+
+from codegen_hoist import PRECOMPUTED_KEY
+from codegen_hoist import split_per_iteration_codegen
+from gnss import EARTH_OMG_GPS
+from gnss import LIGHT_SPEED
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+
+# 由广播星历计算卫星的位置/速度/钟差/钟漂(gnss_psr_dopp_residual的sv_pos, sv_vel, svdt, svddt).
+# 和RTKLIB的eph2pos/eph2clk一致, 适用于GPS/Galileo/BeiDou MEO/IGSO的开普勒星历.
+# 卫星位置是信号发射时刻的ECEF坐标, 不做地球自转的修正: 因子里的psr_sagnac/dopp_sagnac已经包含了Sagnac项.
+
+GPS_MU = 3.9860050e14
+# Galileo和BeiDou的引力常数
+GAL_MU = 3.986004418e14
+BDS_MU = 3.986004418e14
+# 开普勒方程的牛顿迭代次数, e < 0.1时4次以后误差已经低于double精度
+KEPLER_ITERATIONS = 5
+HALF_WEEK = 302400.0
+# 星历的最大有效时间(和RTKLIB的MAXDTOE一样)
+MAX_DTOE = {"G": 7200.0, "E": 14400.0, "C": 21600.0}
+STATE_OUTPUTS = ["sv_pos", "sv_vel", "svdt", "svddt"]
+
+
+@dataclass
+class BroadcastEphemeris:
+    """
+    Kepler broadcast ephemeris parameters, names as in RTKLIB's eph_t. Times are seconds of the
+    week.
+    """
+
+    sqrtA: float
+    e: float
+    i0: float
+    OMG0: float
+    omg: float
+    M0: float
+    deln: float
+    idot: float
+    OMGd: float
+    cuc: float
+    cus: float
+    crc: float
+    crs: float
+    cic: float
+    cis: float
+    toe: float
+    toc: float
+    af0: float
+    af1: float
+    af2: float
+    # 所属星座的引力常数
+    mu: float = GPS_MU
+
+
+EPHEMERIS_FIELDS = [field.name for field in fields(BroadcastEphemeris)]
+
+
+def kepler_eccentric_anomaly(M: sf.Scalar, e: sf.Scalar, iterations: int = KEPLER_ITERATIONS) -> sf.Scalar:
+    # 展开固定次数的牛顿迭代, 没有分支
+    E = M
+    for _ in range(iterations):
+        E = E - (E - e * sf.sin(E) - M) / (1 - e * sf.cos(E))
+    return E
+
+
+def kepler_orbit_position(tk: sf.Scalar, E: sf.Scalar, eph: BroadcastEphemeris) -> sf.V3:
+    """
+    ECEF position at tk seconds after toe, for the eccentric anomaly E.
+    """
+    A = eph.sqrtA * eph.sqrtA
+    sin_E, cos_E = sf.sin(E), sf.cos(E)
+    # e < 1时两个参数不会同时为0, 不需要epsilon
+    true_anomaly = sf.atan2(sf.sqrt(1 - eph.e * eph.e) * sin_E, cos_E - eph.e, epsilon=0)
+    phi = true_anomaly + eph.omg
+    sin_2phi, cos_2phi = sf.sin(2 * phi), sf.cos(2 * phi)
+    u = phi + eph.cus * sin_2phi + eph.cuc * cos_2phi
+    r = A * (1 - eph.e * cos_E) + eph.crs * sin_2phi + eph.crc * cos_2phi
+    i = eph.i0 + eph.idot * tk + eph.cis * sin_2phi + eph.cic * cos_2phi
+    x, y = r * sf.cos(u), r * sf.sin(u)
+    # 升交点经度, 包含地球自转
+    O = eph.OMG0 + (eph.OMGd - EARTH_OMG_GPS) * tk - EARTH_OMG_GPS * eph.toe
+    cos_i = sf.cos(i)
+    return sf.V3(
+        x * sf.cos(O) - y * cos_i * sf.sin(O),
+        x * sf.sin(O) + y * cos_i * sf.cos(O),
+        y * sf.sin(i),
+    )
+
+
+def broadcast_satellite_state(
+    t_rx_toe: sf.Scalar,
+    psr: sf.Scalar,
+    sqrtA: sf.Scalar,
+    e: sf.Scalar,
+    i0: sf.Scalar,
+    OMG0: sf.Scalar,
+    omg: sf.Scalar,
+    M0: sf.Scalar,
+    deln: sf.Scalar,
+    idot: sf.Scalar,
+    OMGd: sf.Scalar,
+    cuc: sf.Scalar,
+    cus: sf.Scalar,
+    crc: sf.Scalar,
+    crs: sf.Scalar,
+    cic: sf.Scalar,
+    cis: sf.Scalar,
+    toe: sf.Scalar,
+    toc: sf.Scalar,
+    af0: sf.Scalar,
+    af1: sf.Scalar,
+    af2: sf.Scalar,
+    mu: sf.Scalar,
+) -> T.Tuple[sf.V3, sf.V3, sf.Scalar, sf.Scalar]:
+    """
+    Satellite state at the transmit time of a signal received at t_rx_toe (receive time minus
+    toe, wrapped to +-half a week) with pseudorange psr.
+    """
+    eph = BroadcastEphemeris(
+        sqrtA, e, i0, OMG0, omg, M0, deln, idot, OMGd, cuc, cus, crc, crs, cic, cis, toe, toc, af0, af1, af2, mu
+    )
+    # 发射时刻: 先减去传播时间, 再减去卫星钟差(和RTKLIB一样迭代两次)
+    t_tx_toc = t_rx_toe - psr / LIGHT_SPEED + (toe - toc)
+    t_clock = t_tx_toc
+    for _ in range(2):
+        t_clock = t_tx_toc - (af0 + af1 * t_clock + af2 * t_clock * t_clock)
+    clock_bias = af0 + af1 * t_clock + af2 * t_clock * t_clock
+    tk = t_clock - (toe - toc)
+
+    # 位置对tk和E求导, 速度 = d/dtk + d/dE * dE/dtk
+    tk_symbol, E_symbol = sf.Symbol("tk"), sf.Symbol("E")
+    n = sf.sqrt(mu / (sqrtA * sqrtA) ** 3) + deln
+    position = kepler_orbit_position(tk_symbol, E_symbol, eph)
+    E_dot = n / (1 - e * sf.cos(E_symbol))
+    velocity = position.diff(tk_symbol) + position.diff(E_symbol) * E_dot
+    # 相对论效应的钟差修正
+    relativity = -2 * sf.sqrt(mu) * sqrtA * e * sf.sin(E_symbol) / LIGHT_SPEED**2
+    relativity_dot = relativity.diff(E_symbol) * E_dot
+
+    E = kepler_eccentric_anomaly(M0 + n * tk, e)
+    substitutions = {tk_symbol: tk, E_symbol: E}
+    svdt = clock_bias + relativity.subs(substitutions)
+    svddt = af1 + 2 * af2 * t_clock + relativity_dot.subs(substitutions)
+    return position.subs(substitutions), velocity.subs(substitutions), svdt, svddt
+
+
+def satellite_state_codegen(config: codegen.CodegenConfig) -> codegen.Codegen:
+    return codegen.Codegen.function(func=broadcast_satellite_state, config=config, output_names=STATE_OUTPUTS)
+
+
+def generate_satellite_state_code(output_dir: T.Optional[T.Openable] = None) -> None:
+    """
+    Ephemeris precompute (once per (sat, toe)) and per-epoch state functions.
+    """
+    precompute_codegen, state_codegen = split_per_iteration_codegen(
+        satellite_state_codegen(codegen.CppConfig()), EPHEMERIS_FIELDS, name="broadcast_satellite_state"
+    )
+    precompute_codegen.generate_function(output_dir)
+    state_codegen.generate_function(output_dir=output_dir, skip_directory_nesting=False)
+
+
+def wrap_half_week(dt: np.ndarray) -> np.ndarray:
+    return dt - np.round(dt / (2 * HALF_WEEK)) * 2 * HALF_WEEK
+
+
+class SatelliteStateCache:
+    """
+    Vectorized satellite states for all satellites of an epoch. The ephemeris-only part of the
+    computation (semi-major axis, mean motion, ...) is computed once per (sat, toe) and stored
+    with the ephemeris parameters the per-epoch function still needs.
+
+    The table grows geometrically; rows of ephemerides more than MAX_DTOE from the current
+    time are freed and reused, so the size stays bounded on long streams.
+    """
+
+    def __init__(self, output_dir: T.Openable, initial_capacity: int = 64) -> None:
+        precompute_codegen, state_codegen = split_per_iteration_codegen(
+            satellite_state_codegen(codegen.PythonConfig()), EPHEMERIS_FIELDS, name="broadcast_satellite_state"
+        )
+        self.precompute = load_numpy_batch_function(generate_numpy_batch_function(precompute_codegen, output_dir))
+        self.state = load_numpy_batch_function(generate_numpy_batch_function(state_codegen, output_dir))
+        # 每个epoch的状态函数还需要的星历参数
+        self.table_keys = [key for key in state_codegen.inputs.keys() if key in EPHEMERIS_FIELDS or key == PRECOMPUTED_KEY]
+        self.rows: T.Dict[T.Tuple[str, float], int] = {}
+        # table[key]是(capacity, width)的数组, 前num_rows行中不在free_rows里的是有效的
+        self.table: T.Dict[str, np.ndarray] = {}
+        self.capacity = initial_capacity
+        self.num_rows = 0
+        self.free_rows: T.List[int] = []
+        self.hits = self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def clear(self) -> None:
+        self.rows.clear()
+        self.free_rows.clear()
+        self.num_rows = 0
+        self.hits = self.misses = 0
+
+    def lookup(self, sats: T.Sequence[str], ephemerides: T.Sequence[BroadcastEphemeris]) -> np.ndarray:
+        """
+        Row indices of the ephemerides, precomputing the new ones in one batch.
+        """
+        keys = [(sat, eph.toe) for sat, eph in zip(sats, ephemerides)]
+        new = {key: eph for key, eph in zip(keys, ephemerides) if key not in self.rows}
+        self.misses += len(new)
+        self.hits += len(keys) - len(new)
+        if new:
+            params = np.array([astuple(eph) for eph in new.values()])
+            columns = dict(zip(EPHEMERIS_FIELDS, params.T))
+            new_values = {key: columns[key] for key in self.table_keys if key != PRECOMPUTED_KEY}
+            new_values[PRECOMPUTED_KEY] = self.precompute(**columns)
+            new_rows = self._allocate(len(new))
+            for key, value in new_values.items():
+                value = value.reshape(len(new), -1)
+                if key not in self.table:
+                    self.table[key] = np.empty((self.capacity, value.shape[1]))
+                self.table[key][new_rows] = value
+            self.rows.update(zip(new, new_rows.tolist()))
+        return np.array([self.rows[key] for key in keys])
+
+    def _allocate(self, count: int) -> np.ndarray:
+        # 先用释放掉的行, 不够时在末尾追加, 容量翻倍
+        reused = [self.free_rows.pop() for _ in range(min(count, len(self.free_rows)))]
+        num_appended = count - len(reused)
+        if self.num_rows + num_appended > self.capacity:
+            self.capacity = max(2 * self.capacity, self.num_rows + num_appended)
+            for key, column in self.table.items():
+                grown = np.empty((self.capacity, column.shape[1]))
+                grown[: self.num_rows] = column[: self.num_rows]
+                self.table[key] = grown
+        appended = list(range(self.num_rows, self.num_rows + num_appended))
+        self.num_rows += num_appended
+        return np.array(reused + appended, dtype=np.int64)
+
+    def evict(self, t: float) -> None:
+        """
+        Free the rows of ephemerides whose toe is more than MAX_DTOE from t (seconds of the week).
+        """
+        max_dtoe = max(MAX_DTOE.values())
+        expired = [
+            key for key in self.rows if abs(wrap_half_week(t - key[1])) > MAX_DTOE.get(key[0][0], max_dtoe)
+        ]
+        for key in expired:
+            self.free_rows.append(self.rows.pop(key))
+
+    def __call__(
+        self,
+        sats: T.Sequence[str],
+        ephemerides: T.Sequence[BroadcastEphemeris],
+        t_rx: T.Union[float, np.ndarray],
+        psr: np.ndarray,
+    ) -> T.Dict[str, np.ndarray]:
+        """
+        Args:
+            sats, ephemerides: the satellites of the epoch and their ephemeris
+            t_rx: receive time (seconds of the week, in the ephemeris' time system), scalar or (N,)
+                to batch several epochs
+            psr: (N,) pseudoranges
+
+        Returns:
+            sv_pos (N, 3), sv_vel (N, 3), svdt (N,), svddt (N,)
+        """
+        misses = self.misses
+        rows = self.lookup(sats, ephemerides)
+        t_rx_toe = wrap_half_week(t_rx - np.array([eph.toe for eph in ephemerides]))
+        inputs = {key: self.table[key][rows] for key in self.table_keys}
+        outputs = self.state(t_rx_toe=t_rx_toe, psr=psr, **inputs)
+        # 只有加入了新星历时表才会变大
+        if self.misses > misses:
+            self.evict(float(np.atleast_1d(t_rx)[-1]))
+        return dict(zip(STATE_OUTPUTS, outputs))
+
+
+def reference_satellite_state(
+    eph: BroadcastEphemeris, t_rx: float, psr: float
+) -> T.Tuple[np.ndarray, np.ndarray, float, float]:
+    """
+    Straightforward port of RTKLIB's eph2clk/eph2pos (iterative Kepler solution, velocity and
+    clock drift by finite differences) to check the generated functions.
+    """
+
+    def clock(t_tx: float) -> float:
+        t = wrap_half_week(t_tx - eph.toc)
+        for _ in range(2):
+            t = wrap_half_week(t_tx - eph.toc) - (eph.af0 + eph.af1 * t + eph.af2 * t * t)
+        return eph.af0 + eph.af1 * t + eph.af2 * t * t
+
+    def position(t: float) -> T.Tuple[np.ndarray, float]:
+        tk = wrap_half_week(t - eph.toe)
+        A = eph.sqrtA**2
+        M = eph.M0 + (np.sqrt(eph.mu / A**3) + eph.deln) * tk
+        E, Ek = M, 0.0
+        while abs(E - Ek) > 1e-14:
+            Ek = E
+            E -= (E - eph.e * np.sin(E) - M) / (1 - eph.e * np.cos(E))
+        u = np.arctan2(np.sqrt(1 - eph.e**2) * np.sin(E), np.cos(E) - eph.e) + eph.omg
+        r = A * (1 - eph.e * np.cos(E))
+        i = eph.i0 + eph.idot * tk
+        sin2u, cos2u = np.sin(2 * u), np.cos(2 * u)
+        u += eph.cus * sin2u + eph.cuc * cos2u
+        r += eph.crs * sin2u + eph.crc * cos2u
+        i += eph.cis * sin2u + eph.cic * cos2u
+        x, y = r * np.cos(u), r * np.sin(u)
+        O = eph.OMG0 + (eph.OMGd - EARTH_OMG_GPS) * tk - EARTH_OMG_GPS * eph.toe
+        pos = np.array([x * np.cos(O) - y * np.cos(i) * np.sin(O), x * np.sin(O) + y * np.cos(i) * np.cos(O), y * np.sin(i)])
+        relativity = -2 * np.sqrt(eph.mu * A) * eph.e * np.sin(E) / LIGHT_SPEED**2
+        return pos, relativity
+
+    clock_bias = clock(t_rx - psr / LIGHT_SPEED)
+    t_tx = t_rx - psr / LIGHT_SPEED - clock_bias
+    pos, relativity = position(t_tx)
+    h = 1e-3
+    pos_plus, relativity_plus = position(t_tx + h)
+    pos_minus, relativity_minus = position(t_tx - h)
+    svdt = clock_bias + relativity
+    svddt = eph.af1 + 2 * eph.af2 * wrap_half_week(t_tx - eph.toc) + (relativity_plus - relativity_minus) / (2 * h)
+    return pos, (pos_plus - pos_minus) / (2 * h), svdt, svddt
+
+
+def random_ephemerides(
+    rng: np.random.Generator, num_sats: int, toe: float
+) -> T.List[BroadcastEphemeris]:
+    return [
+        BroadcastEphemeris(
+            sqrtA=5153.7 + rng.normal(scale=1.0),
+            e=rng.uniform(0.0, 0.02),
+            i0=0.96 + rng.normal(scale=0.01),
+            OMG0=rng.uniform(-np.pi, np.pi),
+            omg=rng.uniform(-np.pi, np.pi),
+            M0=rng.uniform(-np.pi, np.pi),
+            deln=rng.normal(4.5e-9, 5e-10),
+            idot=rng.normal(scale=3e-10),
+            OMGd=rng.normal(-8e-9, 5e-10),
+            cuc=rng.normal(scale=3e-6),
+            cus=rng.normal(scale=3e-6),
+            crc=rng.normal(200.0, 50.0),
+            crs=rng.normal(scale=50.0),
+            cic=rng.normal(scale=1e-7),
+            cis=rng.normal(scale=1e-7),
+            toe=toe,
+            toc=toe,
+            af0=rng.normal(scale=1e-4),
+            af1=rng.normal(scale=1e-11),
+            af2=0.0,
+        )
+        for _ in range(num_sats)
+    ]
+
+
+def benchmark_satellite_states(num_sats: int, num_epochs: int, rate: float) -> None:
+    output_dir = tempfile.mkdtemp(prefix="gnss_ephemeris_")
+    cache = SatelliteStateCache(output_dir)
+    rng = np.random.default_rng(0)
+    sats = [f"G{k + 1:02d}" for k in range(num_sats)]
+    ephemerides = random_ephemerides(rng, num_sats, toe=7200.0)
+    t0 = 7200.0 - 600.0
+    psr = rng.uniform(2.0e7, 2.6e7, size=(num_epochs, num_sats))
+
+    # 和逐颗卫星的参考实现比较
+    state = cache(sats, ephemerides, t0, psr[0])
+    errors = np.zeros(4)
+    for k, eph in enumerate(ephemerides):
+        reference = reference_satellite_state(eph, t0, psr[0, k])
+        errors = np.maximum(
+            errors,
+            [
+                np.max(np.abs(state["sv_pos"][k] - reference[0])),
+                np.max(np.abs(state["sv_vel"][k] - reference[1])),
+                abs(state["svdt"][k] - reference[2]) * LIGHT_SPEED,
+                abs(state["svddt"][k] - reference[3]) * LIGHT_SPEED,
+            ],
+        )
+    print(
+        "max difference to the reference: sv_pos {:.1e} m, sv_vel {:.1e} m/s, svdt {:.1e} m, svddt {:.1e} m/s".format(
+            *errors
+        )
+    )
+
+    start = time.perf_counter()
+    for epoch in range(num_epochs):
+        cache(sats, ephemerides, t0 + epoch / rate, psr[epoch])
+    cached_time = (time.perf_counter() - start) / num_epochs
+
+    uncached = SatelliteStateCache(output_dir)
+    start = time.perf_counter()
+    for epoch in range(num_epochs):
+        uncached.clear()
+        uncached(sats, ephemerides, t0 + epoch / rate, psr[epoch])
+    uncached_time = (time.perf_counter() - start) / num_epochs
+
+    scalar = satellite_state_codegen(codegen.PythonConfig())
+    scalar_func = codegen_util.load_generated_function(
+        scalar.name, scalar.generate_function(output_dir=output_dir).function_dir
+    )
+    num_loop = min(num_epochs, 20)
+    start = time.perf_counter()
+    for epoch in range(num_loop):
+        t_rx = t0 + epoch / rate
+        for k, eph in enumerate(ephemerides):
+            scalar_func(wrap_half_week(t_rx - eph.toe), psr[epoch, k], *astuple(eph))
+    loop_time = (time.perf_counter() - start) / num_loop
+
+    print(
+        f"{num_sats} satellites x {num_epochs} epochs: cached {cached_time * 1e6:.1f} us/epoch "
+        f"(hit rate {cache.hits / (cache.hits + cache.misses):.3f}), "
+        f"precompute every epoch {uncached_time * 1e6:.1f} us/epoch, "
+        f"per-satellite loop {loop_time * 1e6:.1f} us/epoch"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_sats", type=int, default=40, help="satellites per epoch")
+    parser.add_argument("--num_epochs", type=int, default=600, help="epochs to compute")
+    parser.add_argument("--rate", type=float, default=10.0, help="epochs per second")
+    parser.add_argument("--benchmark", action="store_true", help="time the vectorized satellite states")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_satellite_states(args.num_sats, args.num_epochs, args.rate)
+    else:
+        from gnss import output_dir
+
+        generate_satellite_state_code(output_dir)
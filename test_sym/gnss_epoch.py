@@ -0,0 +1,210 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+from symforce.codegen import codegen_util
+
+from gnss import EARTH_SEMI_MAJOR
+from gnss import GNSS_LINEARIZATION_ARGS
+from gnss import GPS_L1_FREQ
+from gnss import gnss_epoch_factor_codegen
+from gnss import gnss_psr_dopp_residual
+from imu_residual_variants import GeneratedSize
+from imu_residual_variants import generated_size
+from imu_residual_variants import print_sizes
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+
+
+def gnss_single_factor_codegen(config: codegen.CodegenConfig) -> codegen.Codegen:
+    return codegen.Codegen.function(func=gnss_psr_dopp_residual, config=config).with_linearization(
+        which_args=GNSS_LINEARIZATION_ARGS
+    )
+
+
+# 比较一个历元因子和num_sats个单星因子的op数
+def generate_gnss_epoch_sizes(output_dir: T.Openable, num_sats_list: T.Sequence[int]) -> T.List[GeneratedSize]:
+    sizes = []
+    start = time.perf_counter()
+    single_codegen = gnss_single_factor_codegen(codegen.CppConfig())
+    metadata = single_codegen.generate_function(output_dir=output_dir)
+    single = generated_size(single_codegen.name, metadata.generated_files[0], time.perf_counter() - start)
+    sizes.append(single)
+
+    for num_sats in num_sats_list:
+        start = time.perf_counter()
+        epoch_codegen = gnss_epoch_factor_codegen(num_sats, codegen.CppConfig())
+        metadata = epoch_codegen.generate_function(output_dir=output_dir)
+        sizes.append(generated_size(epoch_codegen.name, metadata.generated_files[0], time.perf_counter() - start))
+        sizes.append(
+            GeneratedSize(
+                name=f"  {num_sats} x {single_codegen.name}",
+                total_ops=num_sats * single.total_ops,
+                lines=num_sats * single.lines,
+                bytes=num_sats * single.bytes,
+                seconds=single.seconds,
+            )
+        )
+    return sizes
+
+
+def random_epochs(
+    num_epochs: int, num_sats: int, num_valid: int, seed: int = 0
+) -> T.Dict[str, np.ndarray]:
+    """
+    Inputs of the epoch factor batched over epochs: the per-satellite arrays are
+    (num_epochs, num_sats), sv_pos / sv_vel (num_epochs, num_sats, 3). The first num_valid
+    slots of each epoch hold satellites above the anchor, the rest are zero and masked out.
+    """
+    rng = np.random.default_rng(seed)
+    lat, lon = rng.uniform(-1.2, 1.2, size=num_epochs), rng.uniform(-np.pi, np.pi, size=num_epochs)
+    up = np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+    ref_ecef = EARTH_SEMI_MAJOR * up
+    sv_direction = up[:, None] + rng.normal(scale=0.4, size=(num_epochs, num_sats, 3))
+    sv_pos = 2.6e7 * sv_direction / np.linalg.norm(sv_direction, axis=2, keepdims=True)
+    valid = (np.arange(num_sats) < num_valid).astype(float) * np.ones((num_epochs, 1))
+
+    def per_sat(values: np.ndarray) -> np.ndarray:
+        return values * valid
+
+    data = dict(
+        Pi=rng.normal(scale=10.0, size=(num_epochs, 3)),
+        Vi=rng.normal(size=(num_epochs, 3)),
+        Pj=rng.normal(scale=10.0, size=(num_epochs, 3)),
+        Vj=rng.normal(size=(num_epochs, 3)),
+        rcv_dt=rng.normal(scale=100.0, size=num_epochs),
+        rcv_ddt=rng.normal(size=num_epochs),
+        yaw_diff=rng.normal(scale=0.1, size=num_epochs),
+        ref_ecef=ref_ecef,
+        ratio=rng.uniform(size=num_epochs),
+        sv_pos=sv_pos * valid[:, :, None],
+        sv_vel=rng.normal(scale=3000.0, size=(num_epochs, num_sats, 3)) * valid[:, :, None],
+        ion_delay=per_sat(rng.uniform(1.0, 10.0, size=(num_epochs, num_sats))),
+        tro_delay=per_sat(rng.uniform(2.0, 20.0, size=(num_epochs, num_sats))),
+        tgd=per_sat(rng.normal(scale=1e-8, size=(num_epochs, num_sats))),
+        svdt=per_sat(rng.normal(scale=1e-4, size=(num_epochs, num_sats))),
+        svddt=per_sat(rng.normal(scale=1e-11, size=(num_epochs, num_sats))),
+        freq=np.full((num_epochs, num_sats), GPS_L1_FREQ),
+        psr_measured=per_sat(np.linalg.norm(sv_pos - ref_ecef[:, None], axis=2)),
+        dopp_measured=per_sat(rng.normal(scale=3000.0, size=(num_epochs, num_sats))),
+        pr_weight=per_sat(rng.uniform(0.1, 1.0, size=(num_epochs, num_sats))),
+        dp_weight=per_sat(rng.uniform(0.1, 1.0, size=(num_epochs, num_sats))),
+        valid=valid,
+    )
+    return data
+
+
+def single_factor_inputs(data: T.Dict[str, np.ndarray]) -> T.Dict[str, np.ndarray]:
+    """
+    The valid satellites of every epoch as rows of the single satellite factor.
+    """
+    epoch, sat = np.nonzero(data["valid"])
+    inputs = {}
+    for key in ("Pi", "Vi", "Pj", "Vj", "rcv_dt", "rcv_ddt", "yaw_diff", "ref_ecef", "ratio"):
+        inputs[key] = data[key][epoch]
+    for key in ("ion_delay", "tro_delay", "tgd", "sv_pos", "sv_vel", "svdt", "svddt", "freq",
+                "psr_measured", "dopp_measured", "pr_weight", "dp_weight"):
+        inputs[key] = data[key][epoch, sat]
+    inputs["pr_uura"] = inputs["dp_uura"] = 1.0
+    return inputs
+
+
+def check_gnss_epoch(num_sats: int, num_valid: int, seed: int = 0) -> float:
+    """
+    Max relative difference between the epoch factor and the single satellite factors of its
+    valid slots: stacked residuals, and summed hessian / rhs.
+    """
+    gen_dir = tempfile.mkdtemp(prefix="gnss_epoch_")
+    epoch_codegen = gnss_epoch_factor_codegen(num_sats, codegen.PythonConfig())
+    epoch_factor = codegen_util.load_generated_function(
+        epoch_codegen.name, epoch_codegen.generate_function(output_dir=gen_dir).function_dir
+    )
+    single_codegen = gnss_single_factor_codegen(codegen.PythonConfig())
+    single_factor = codegen_util.load_generated_function(
+        single_codegen.name, single_codegen.generate_function(output_dir=gen_dir).function_dir
+    )
+
+    data = {key: value[0] for key, value in random_epochs(1, num_sats, num_valid, seed).items()}
+    epoch_inputs = dict(data, sv_pos=data["sv_pos"].T, sv_vel=data["sv_vel"].T, epsilon=sf.numeric_epsilon)
+    res, _, hessian, rhs = epoch_factor(**epoch_inputs)
+
+    expected_res = np.zeros(2 * num_sats)
+    expected_hessian = np.zeros_like(hessian)
+    expected_rhs = np.zeros(len(rhs))
+    rows = single_factor_inputs({key: value[None] for key, value in data.items()})
+    for k in range(num_valid):
+        single_inputs = {key: (value[k] if isinstance(value, np.ndarray) else value) for key, value in rows.items()}
+        single_res, _, single_hessian, single_rhs = single_factor(**single_inputs, epsilon=sf.numeric_epsilon)
+        expected_res[2 * k : 2 * k + 2] = np.ravel(single_res)
+        expected_hessian += single_hessian
+        expected_rhs += np.ravel(single_rhs)
+
+    errors = [
+        (np.ravel(res), expected_res),
+        (np.tril(hessian), np.tril(expected_hessian)),
+        (np.ravel(rhs), expected_rhs),
+    ]
+    return max(
+        float(np.max(np.abs(actual - expected) / np.maximum(np.abs(expected), 1.0)))
+        for actual, expected in errors
+    )
+
+
+def benchmark_gnss_epoch(num_epochs: int, num_sats: int, num_valid: int) -> None:
+    """
+    Linearize num_epochs epochs with the numpy batch epoch factor, against the single satellite
+    factor batched over all valid observations.
+    """
+    gen_dir = tempfile.mkdtemp(prefix="gnss_epoch_")
+    epoch_factor = load_numpy_batch_function(
+        generate_numpy_batch_function(gnss_epoch_factor_codegen(num_sats, codegen.PythonConfig()), gen_dir)
+    )
+    single_factor = load_numpy_batch_function(
+        generate_numpy_batch_function(gnss_single_factor_codegen(codegen.PythonConfig()), gen_dir)
+    )
+    data = random_epochs(num_epochs, num_sats, num_valid)
+    single_inputs = single_factor_inputs(data)
+
+    start = time.perf_counter()
+    _, _, epoch_hessian, epoch_rhs = epoch_factor(**data, epsilon=sf.numeric_epsilon)
+    epoch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, _, single_hessian, single_rhs = single_factor(**single_inputs, epsilon=sf.numeric_epsilon)
+    # 每个历元的单星因子累加起来
+    hessian = np.zeros_like(epoch_hessian)
+    np.add.at(hessian, np.nonzero(data["valid"])[0], single_hessian)
+    single_time = time.perf_counter() - start
+
+    difference = np.max(np.abs(np.tril(hessian) - np.tril(epoch_hessian)) / np.maximum(np.abs(hessian), 1.0))
+    print(
+        f"{num_epochs} epochs, {num_valid} of {num_sats} slots valid: "
+        f"epoch factor {epoch_time / num_epochs * 1e6:.1f} us/epoch, "
+        f"single factors {single_time / num_epochs * 1e6:.1f} us/epoch, "
+        f"max relative hessian difference {difference:.2e}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_sats", type=int, nargs="+", default=[8, 16, 40], help="satellite capacity per epoch")
+    parser.add_argument("--num_valid", type=int, default=32, help="valid satellites per epoch for check/benchmark")
+    parser.add_argument("--check", action="store_true", help="compare against the single satellite factor")
+    parser.add_argument("--benchmark", action="store_true", help="time the numpy batch epoch factor")
+    parser.add_argument("--num_epochs", type=int, default=1000, help="epochs for the benchmark")
+    args = parser.parse_args()
+
+    print_sizes(generate_gnss_epoch_sizes(tempfile.mkdtemp(prefix="gnss_epoch_"), args.num_sats))
+    for num_sats in args.num_sats:
+        num_valid = min(args.num_valid, num_sats)
+        if args.check:
+            print(f"{num_sats} slots: max relative error {check_gnss_epoch(num_sats, num_valid):.3e}")
+        if args.benchmark:
+            benchmark_gnss_epoch(args.num_epochs, num_sats, num_valid)
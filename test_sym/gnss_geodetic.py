@@ -0,0 +1,185 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+from symforce.codegen import codegen_util
+
+from gnss import EARTH_SEMI_MAJOR
+from gnss import ecef2enu
+from gnss import ecef2geo
+from gnss import sat_azel
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+
+# gnss.py里ecef2geo, ecef2enu, sat_azel的向量化版本: 输入是(N, 3)的数组,
+# 函数由同样的符号表达式生成, 所以和因子里的计算完全一致
+
+GEODETIC_FUNCTIONS = {
+    "ecef2geo": (ecef2geo, ["lla"]),
+    "ecef2enu": (ecef2enu, ["enu"]),
+    "sat_azel": (sat_azel, ["azel"]),
+}
+
+
+class GeodeticConverter:
+    """
+    Batch ECEF <-> geodetic conversions, with the numpy functions generated on first use.
+    Large inputs are processed in chunks of chunk_size points to bound the temporaries.
+    """
+
+    def __init__(self, output_dir: T.Openable, chunk_size: int = 1 << 18) -> None:
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+        self.functions: T.Dict[str, T.Callable] = {}
+        self.output_shapes: T.Dict[str, T.Tuple[int, ...]] = {}
+
+    def function(self, name: str) -> T.Callable:
+        if name not in self.functions:
+            func, output_names = GEODETIC_FUNCTIONS[name]
+            metadata = generate_numpy_batch_function(
+                codegen.Codegen.function(func=func, config=codegen.PythonConfig(), output_names=output_names),
+                self.output_dir,
+                name=f"{name}_batch",
+            )
+            self.functions[name] = load_numpy_batch_function(metadata)
+            self.output_shapes[name] = metadata.output_shapes[output_names[0]]
+        return self.functions[name]
+
+    def _call_chunked(self, name: str, *args: T.Any) -> np.ndarray:
+        arrays = [np.asarray(arg, dtype=np.float64) for arg in args]
+        num_points = max(array.shape[0] if array.ndim == 2 else 1 for array in arrays)
+        func = self.function(name)
+        if num_points <= self.chunk_size:
+            return func(*arrays)
+        output = np.empty((num_points, *self.output_shapes[name]))
+        for start in range(0, num_points, self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            output[chunk] = func(*[array[chunk] if array.ndim == 2 else array for array in arrays])
+        return output
+
+    def ecef2geo(self, xyz: np.ndarray, epsilon: float = sf.numeric_epsilon) -> np.ndarray:
+        """
+        (N, 3) ECEF positions -> (N, 3) latitude (deg), longitude (deg), altitude (m).
+        """
+        return self._call_chunked("ecef2geo", xyz, epsilon)
+
+    def ecef2enu(self, ref_lla: np.ndarray, v_ecef: np.ndarray) -> np.ndarray:
+        """
+        (N, 3) ECEF vectors rotated into the ENU frame at ref_lla ((3,) or (N, 3)).
+        """
+        return self._call_chunked("ecef2enu", ref_lla, v_ecef)
+
+    def sat_azel(self, rcv_ecef: np.ndarray, sat_ecef: np.ndarray, epsilon: float = sf.numeric_epsilon) -> np.ndarray:
+        """
+        (N, 2) azimuth and elevation (rad) of the satellites seen from the receivers.
+        """
+        return self._call_chunked("sat_azel", rcv_ecef, sat_ecef, epsilon)
+
+    def elevation_mask(self, rcv_ecef: np.ndarray, sat_ecef: np.ndarray, min_elevation_deg: float) -> np.ndarray:
+        return self.sat_azel(rcv_ecef, sat_ecef)[:, 1] >= np.radians(min_elevation_deg)
+
+
+def random_ecef(rng: np.random.Generator, num_points: int) -> T.Tuple[np.ndarray, np.ndarray]:
+    """
+    Receivers between -500 m and 10 km altitude and satellites at GNSS orbit radius above them.
+    """
+    lat, lon = rng.uniform(-1.5, 1.5, size=num_points), rng.uniform(-np.pi, np.pi, size=num_points)
+    up = np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+    rcv = (EARTH_SEMI_MAJOR + rng.uniform(-500.0, 1e4, size=(num_points, 1))) * up
+    sat_direction = up + rng.normal(scale=0.5, size=(num_points, 3))
+    sat = 2.6e7 * sat_direction / np.linalg.norm(sat_direction, axis=1, keepdims=True)
+    return rcv, sat
+
+
+def symbolic_reference(name: str, *args: np.ndarray) -> np.ndarray:
+    """
+    Evaluate the symbolic definition in gnss.py for one point.
+    """
+    func = GEODETIC_FUNCTIONS[name][0]
+    symbolic_args = [sf.V3(*arg) if np.ndim(arg) == 1 else arg for arg in args]
+    # 没有显式传epsilon的地方(比如normalized())用的是默认的epsilon符号
+    result = func(*symbolic_args).subs(sf.epsilon(), sf.numeric_epsilon)
+    return np.array(result.evalf().to_storage(), dtype=float)
+
+
+def check_geodetic(converter: GeodeticConverter, num_points: int = 20, seed: int = 0) -> T.Dict[str, float]:
+    rng = np.random.default_rng(seed)
+    rcv, sat = random_ecef(rng, num_points)
+    epsilon = sf.numeric_epsilon
+    lla = converter.ecef2geo(rcv)
+    checks = {
+        "ecef2geo": (lla, [symbolic_reference("ecef2geo", p, epsilon) for p in rcv]),
+        "ecef2enu": (
+            converter.ecef2enu(lla, sat - rcv),
+            [symbolic_reference("ecef2enu", l, v) for l, v in zip(lla, sat - rcv)],
+        ),
+        "sat_azel": (
+            converter.sat_azel(rcv, sat),
+            [symbolic_reference("sat_azel", r, s, epsilon) for r, s in zip(rcv, sat)],
+        ),
+    }
+    return {
+        name: float(np.max(np.abs(batch - np.array(reference)) / np.maximum(np.abs(np.array(reference)), 1.0)))
+        for name, (batch, reference) in checks.items()
+    }
+
+
+def benchmark_geodetic(num_points: int, num_loop_points: int = 20000) -> None:
+    """
+    Batch conversion of num_points points against calling the generated scalar python function
+    once per point (on num_loop_points of them).
+    """
+    output_dir = tempfile.mkdtemp(prefix="gnss_geodetic_")
+    converter = GeodeticConverter(output_dir)
+    for name, error in check_geodetic(converter).items():
+        print(f"{name:<9} max relative difference to the symbolic definition {error:.2e}")
+
+    rng = np.random.default_rng(1)
+    rcv, sat = random_ecef(rng, num_points)
+    ref_lla = converter.ecef2geo(rcv[:1])[0]
+    batch_calls = {
+        "ecef2geo": lambda: converter.ecef2geo(rcv),
+        "ecef2enu": lambda: converter.ecef2enu(ref_lla, sat - rcv),
+        "sat_azel": lambda: converter.sat_azel(rcv, sat),
+    }
+    loop_args = {
+        "ecef2geo": lambda i: (rcv[i], sf.numeric_epsilon),
+        "ecef2enu": lambda i: (ref_lla, sat[i] - rcv[i]),
+        "sat_azel": lambda i: (rcv[i], sat[i], sf.numeric_epsilon),
+    }
+
+    for name, (func, output_names) in GEODETIC_FUNCTIONS.items():
+        start = time.perf_counter()
+        batch = batch_calls[name]()
+        batch_time = time.perf_counter() - start
+
+        scalar = codegen.Codegen.function(func=func, config=codegen.PythonConfig(), output_names=output_names)
+        scalar_func = codegen_util.load_generated_function(
+            scalar.name, scalar.generate_function(output_dir=output_dir).function_dir
+        )
+        num_loop = min(num_loop_points, num_points)
+        start = time.perf_counter()
+        loop = np.array([np.ravel(scalar_func(*loop_args[name](i))) for i in range(num_loop)])
+        loop_time = time.perf_counter() - start
+
+        print(
+            f"{name:<9} batch {batch_time / num_points * 1e9:7.1f} ns/point ({num_points} points), "
+            f"loop {loop_time / num_loop * 1e9:8.1f} ns/point, "
+            f"max difference {np.max(np.abs(batch[:num_loop] - loop)):.1e}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_points", type=int, default=1000000, help="points for the batch conversion")
+    parser.add_argument("--num_loop_points", type=int, default=20000, help="points for the per-point loop")
+    args = parser.parse_args()
+
+    benchmark_geodetic(args.num_points, args.num_loop_points)
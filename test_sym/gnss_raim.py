@@ -0,0 +1,269 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+
+from gnss import LIGHT_SPEED
+from gnss import gnss_satellite_residual
+from gnss_epoch import random_epochs
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+
+# 构建因子之前的RAIM粗差剔除: 每个历元用伪距+多普勒做最小二乘(接收机位置/速度/钟差/钟漂8维),
+# 残差平方和超过卡方门限时剔除归一化残差最大的卫星, 再重新求解. 所有历元一起向量化计算.
+
+RAIM_STATE_ARGS = ["P_ecef", "V_ecef", "rcv_dt", "rcv_ddt"]
+RAIM_STATE_DIM = 8
+RAIM_OBSERVATION_KEYS = [
+    "ion_delay", "tro_delay", "tgd", "sv_pos", "sv_vel", "svdt", "svddt", "freq", "psr_measured", "dopp_measured",
+]
+
+
+def raim_satellite_residual(
+    P_ecef: sf.V3,
+    V_ecef: sf.V3,
+    rcv_dt: sf.Scalar,
+    rcv_ddt: sf.Scalar,
+    ion_delay: sf.Scalar,
+    tro_delay: sf.Scalar,
+    tgd: sf.Scalar,
+    sv_pos: sf.V3,
+    sv_vel: sf.V3,
+    svdt: sf.Scalar,
+    svddt: sf.Scalar,
+    freq: sf.Scalar,
+    psr_measured: sf.Scalar,
+    dopp_measured: sf.Scalar,
+    epsilon: sf.Scalar = 0
+) -> sf.V2:
+    # 和因子同一个残差定义, 不加权: 伪距残差(m)和多普勒残差(m/s)
+    return gnss_satellite_residual(
+        P_ecef, V_ecef, rcv_dt, rcv_ddt, ion_delay, tro_delay, tgd, sv_pos, sv_vel, svdt, svddt, freq,
+        psr_measured, dopp_measured, 1, 1,
+    )
+
+
+def chi_square_threshold(dof: np.ndarray, false_alarm: float) -> np.ndarray:
+    """
+    Wilson-Hilferty approximation of the chi-square quantile 1 - false_alarm.
+    """
+    z = statistics.NormalDist().inv_cdf(1.0 - false_alarm)
+    dof = np.maximum(dof, 1)
+    return dof * (1.0 - 2.0 / (9.0 * dof) + z * np.sqrt(2.0 / (9.0 * dof))) ** 3
+
+
+@dataclass
+class RaimConfig:
+    pr_sigma: float = 3.0
+    dopp_sigma: float = 0.1
+    false_alarm: float = 1e-3
+    max_exclusions: int = 5
+    iterations: int = 5
+
+
+@dataclass
+class RaimResult:
+    """
+    keep: (E, S) observations that go into the graph
+    state: (E, 8) least-squares P_ecef, V_ecef, rcv_dt, rcv_ddt
+    passed: (E,) epochs whose final residuals pass the chi-square test
+    """
+
+    keep: np.ndarray
+    state: np.ndarray
+    passed: np.ndarray
+    seconds: float
+
+    def summary(self, valid: np.ndarray) -> str:
+        num_valid = int(valid.sum())
+        rejected = int((valid & ~self.keep).sum())
+        epochs_with_rejections = int(np.any(valid & ~self.keep, axis=1).sum())
+        return (
+            f"{len(self.keep)} epochs in {self.seconds * 1e3:.1f} ms ({self.seconds / len(self.keep) * 1e6:.1f} us/epoch): "
+            f"rejected {rejected} of {num_valid} observations ({rejected / max(num_valid, 1) * 100:.2f}%) "
+            f"in {epochs_with_rejections} epochs, {int((~self.passed).sum())} epochs still failing"
+        )
+
+
+class RaimScreen:
+    """
+    Batched least-squares residual pre-screen over epochs of up to S satellites, in the slot
+    layout of gnss_epoch.random_epochs (per-satellite arrays (E, S), sv_pos / sv_vel (E, S, 3),
+    valid (E, S)).
+    """
+
+    def __init__(self, output_dir: T.Openable, config: T.Optional[RaimConfig] = None) -> None:
+        self.config = config if config is not None else RaimConfig()
+        self.residual = load_numpy_batch_function(
+            generate_numpy_batch_function(
+                codegen.Codegen.function(func=raim_satellite_residual, config=codegen.PythonConfig()).with_linearization(
+                    which_args=RAIM_STATE_ARGS,
+                    linearization_mode=codegen.LinearizationMode.STACKED_JACOBIAN,
+                ),
+                output_dir,
+            )
+        )
+
+    def linearize(
+        self, data: T.Dict[str, np.ndarray], state: np.ndarray
+    ) -> T.Tuple[np.ndarray, np.ndarray]:
+        num_epochs, num_sats = data["valid"].shape
+
+        def rows(value: np.ndarray) -> np.ndarray:
+            return np.repeat(value, num_sats, axis=0)
+
+        res, jacobian = self.residual(
+            P_ecef=rows(state[:, 0:3]),
+            V_ecef=rows(state[:, 3:6]),
+            rcv_dt=rows(state[:, 6]),
+            rcv_ddt=rows(state[:, 7]),
+            **{key: data[key].reshape(num_epochs * num_sats, -1) for key in RAIM_OBSERVATION_KEYS},
+            epsilon=sf.numeric_epsilon,
+        )
+        return res.reshape(num_epochs, num_sats, 2), jacobian.reshape(num_epochs, num_sats, 2, RAIM_STATE_DIM)
+
+    def solve(
+        self, data: T.Dict[str, np.ndarray], keep: np.ndarray, state: np.ndarray
+    ) -> T.Tuple[np.ndarray, np.ndarray]:
+        """
+        Gauss-Newton over all epochs at once. Returns the state and the normalized residuals.
+        """
+        sigma = np.array([self.config.pr_sigma, self.config.dopp_sigma])
+        for _ in range(self.config.iterations):
+            res, jacobian = self.linearize(data, state)
+            weights = keep[:, :, None] / sigma**2
+            hessian = np.einsum("esri,esr,esrj->eij", jacobian, weights, jacobian)
+            rhs = np.einsum("esri,esr,esr->ei", jacobian, weights, res)
+            # 可见卫星不足4颗的历元也要能解, 加一个很小的阻尼
+            hessian += 1e-9 * np.eye(RAIM_STATE_DIM)
+            state = state - np.linalg.solve(hessian, rhs[:, :, None])[:, :, 0]
+        res, _ = self.linearize(data, state)
+        return state, res / sigma * keep[:, :, None]
+
+    def __call__(self, data: T.Dict[str, np.ndarray], initial_state: np.ndarray) -> RaimResult:
+        """
+        Args:
+            data: one or more epochs in the slot layout
+            initial_state: (E, 8) linearization point, e.g. the anchor / previous solution
+        """
+        start = time.perf_counter()
+        keep = data["valid"].astype(bool).copy()
+        state = np.array(initial_state, dtype=np.float64)
+        passed = np.zeros(len(keep), dtype=bool)
+        active = np.arange(len(keep))
+        for exclusion in range(self.config.max_exclusions + 1):
+            subset = {key: value[active] for key, value in data.items()}
+            state[active], normalized = self.solve(subset, keep[active], state[active])
+            # 伪距和多普勒各4个未知数
+            num_obs = keep[active].sum(axis=1)
+            dof = 2 * num_obs - RAIM_STATE_DIM
+            statistic = np.sum(normalized**2, axis=(1, 2))
+            ok = (dof <= 0) | (statistic <= chi_square_threshold(dof, self.config.false_alarm))
+            passed[active[ok]] = True
+            # 剩下的观测不足以再检验时也停止剔除
+            failed = ~ok & (num_obs > RAIM_STATE_DIM // 2 + 1)
+            if exclusion == self.config.max_exclusions or not np.any(failed):
+                break
+            worst = np.argmax(np.max(np.abs(normalized[failed]), axis=2), axis=1)
+            keep[active[failed], worst] = False
+            active = active[failed]
+        return RaimResult(keep=keep, state=state, passed=passed, seconds=time.perf_counter() - start)
+
+
+def simulate_epochs(
+    screen: RaimScreen,
+    num_epochs: int,
+    num_sats: int,
+    num_valid: int,
+    outlier_rate: float,
+    seed: int = 0,
+) -> T.Tuple[T.Dict[str, np.ndarray], np.ndarray, np.ndarray]:
+    """
+    Epochs with measurements consistent with raim_satellite_residual plus noise, and gross
+    errors (30-300 m pseudorange or 5-50 m/s doppler) on outlier_rate of the observations.
+
+    Returns:
+        data, the true (E, 8) states and the (E, S) outlier mask
+    """
+    rng = np.random.default_rng(seed)
+    data = random_epochs(num_epochs, num_sats, num_valid, seed)
+    valid = data["valid"].astype(bool)
+    true_state = np.column_stack(
+        [
+            data["ref_ecef"] + rng.normal(scale=20.0, size=(num_epochs, 3)),
+            rng.normal(scale=2.0, size=(num_epochs, 3)),
+            rng.normal(scale=1e4, size=num_epochs),
+            rng.normal(scale=10.0, size=num_epochs),
+        ]
+    )
+    # 测量值为0时残差就是预测值
+    data["psr_measured"] = np.zeros_like(data["psr_measured"])
+    data["dopp_measured"] = np.zeros_like(data["dopp_measured"])
+    predicted, _ = screen.linearize(data, true_state)
+    wavelength = LIGHT_SPEED / data["freq"]
+    psr = predicted[:, :, 0] + rng.normal(scale=screen.config.pr_sigma, size=valid.shape)
+    dopp_velocity = predicted[:, :, 1] + rng.normal(scale=screen.config.dopp_sigma, size=valid.shape)
+
+    outliers = valid & (rng.uniform(size=valid.shape) < outlier_rate)
+    on_psr = rng.uniform(size=valid.shape) < 0.5
+    sign = rng.choice([-1.0, 1.0], size=valid.shape)
+    psr += outliers * on_psr * sign * rng.uniform(30.0, 300.0, size=valid.shape)
+    dopp_velocity += outliers * ~on_psr * sign * rng.uniform(5.0, 50.0, size=valid.shape)
+
+    data["psr_measured"] = psr * valid
+    # r_doppler = dopp_estimated + dopp_measured * wavelength
+    data["dopp_measured"] = -dopp_velocity / wavelength * valid
+    return data, true_state, outliers
+
+
+def benchmark_gnss_raim(num_epochs: int, num_sats: int, num_valid: int, outlier_rate: float) -> None:
+    output_dir = tempfile.mkdtemp(prefix="gnss_raim_")
+    screen = RaimScreen(output_dir)
+    data, true_state, outliers = simulate_epochs(screen, num_epochs, num_sats, num_valid, outlier_rate)
+    valid = data["valid"].astype(bool)
+    # 从anchor出发, 钟差未知
+    initial_state = np.column_stack([data["ref_ecef"], np.zeros((num_epochs, 5))])
+
+    screen({key: value[:1] for key, value in data.items()}, initial_state[:1])
+    result = screen(data, initial_state)
+    print(f"batched:   {result.summary(valid)}")
+
+    num_loop = min(num_epochs, 200)
+    start = time.perf_counter()
+    for epoch in range(num_loop):
+        screen({key: value[epoch : epoch + 1] for key, value in data.items()}, initial_state[epoch : epoch + 1])
+    loop_time = (time.perf_counter() - start) / num_loop
+    print(f"per-epoch: {loop_time * 1e6:.1f} us/epoch ({num_loop} epochs, one call each)")
+
+    rejected = valid & ~result.keep
+    detected = int((rejected & outliers).sum())
+    false_rejections = int((rejected & ~outliers).sum())
+    print(
+        f"outliers: {int(outliers.sum())} injected, {detected} rejected "
+        f"({detected / max(int(outliers.sum()), 1) * 100:.1f}%), "
+        f"{false_rejections} good observations rejected "
+        f"({false_rejections / max(int((valid & ~outliers).sum()), 1) * 100:.2f}%)"
+    )
+    clean = result.passed & ~np.any(result.keep & outliers, axis=1)
+    position_error = np.linalg.norm(result.state[clean, :3] - true_state[clean, :3], axis=1)
+    print(f"position error of the clean solutions: median {np.median(position_error):.2f} m, max {position_error.max():.2f} m")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_epochs", type=int, default=2000, help="epochs to screen")
+    parser.add_argument("--num_sats", type=int, default=40, help="satellite slots per epoch")
+    parser.add_argument("--num_valid", type=int, default=32, help="valid satellites per epoch")
+    parser.add_argument("--outlier_rate", type=float, default=0.03, help="fraction of observations with gross errors")
+    args = parser.parse_args()
+
+    benchmark_gnss_raim(args.num_epochs, args.num_sats, args.num_valid, args.outlier_rate)
@@ -0,0 +1,638 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import bisect
+import collections
+import os
+import resource
+import tempfile
+import time
+from dataclasses import dataclass
+from dataclasses import replace
+from datetime import datetime
+from datetime import timedelta
+
+import numpy as np
+
+from symforce import typing as T
+
+from gnss import GNSS_EPOCH_SATELLITE_SCALARS
+from gnss import EARTH_OMG_GPS
+from gnss import GPS_L1_FREQ
+from gnss import KLOBUCHAR_DEFAULT
+from gnss import LIGHT_SPEED
+from gnss_atmosphere import AtmosphereDelays
+from gnss_ephemeris import BDS_MU
+from gnss_ephemeris import GAL_MU
+from gnss_ephemeris import GPS_MU
+from gnss_ephemeris import MAX_DTOE
+from gnss_ephemeris import BroadcastEphemeris
+from gnss_ephemeris import SatelliteStateCache
+from gnss_ephemeris import random_ephemerides
+from gnss_geodetic import GeodeticConverter
+from gnss_raim import RaimScreen
+from gnss_weighting import elevation_weights
+
+# 流式读取RINEX 3观测/导航文件, 按历元输出gnss_epoch因子(gnss_epoch_inputs)的卫星数组.
+# 文件逐行读取, 星历只保留当前时刻附近的, 内存占用和文件长度无关.
+# 支持GPS L1 C/A, Galileo E1, BeiDou B1I(MEO/IGSO); GLONASS和BeiDou GEO的轨道模型不同, 跳过
+
+GPS_EPOCH = datetime(1980, 1, 6)
+WEEK_SECONDS = 604800.0
+# BDT比GPST晚14秒, 周数差1356
+BDT_TO_GPST = 14.0
+BDS_WEEK_OFFSET = 1356
+BDS_B1I_FREQ = 1561.098e6
+
+# 每个星座用的伪距/多普勒观测类型和频率
+OBS_SIGNALS = {
+    "G": ("C1C", "D1C", GPS_L1_FREQ),
+    "E": ("C1C", "D1C", GPS_L1_FREQ),
+    "C": ("C2I", "D2I", BDS_B1I_FREQ),
+}
+SYSTEM_MU = {"G": GPS_MU, "E": GAL_MU, "C": BDS_MU}
+# 导航记录后面的轨道行数
+NAV_ORBIT_LINES = {"R": 3, "S": 3}
+# 没有URA时的默认伪距精度(m)
+DEFAULT_URA = 2.0
+
+
+def gps_time(year: int, month: int, day: int, hour: int, minute: int, second: float) -> T.Tuple[int, float]:
+    """
+    Calendar time to GPS week and seconds of the week.
+    """
+    whole = int(second)
+    delta = datetime(year, month, day, hour, minute, whole) - GPS_EPOCH
+    seconds = delta.days * 86400.0 + delta.seconds + (second - whole)
+    week = int(seconds // WEEK_SECONDS)
+    return week, seconds - week * WEEK_SECONDS
+
+
+def rinex_float(field: str) -> float:
+    field = field.strip()
+    return float(field.replace("D", "E").replace("d", "E")) if field else float("nan")
+
+
+def obs_field(index: int) -> slice:
+    """
+    Columns of the index-th observation (14 characters of value, LLI and signal strength) in a
+    satellite line.
+    """
+    return slice(3 + 16 * index, 3 + 16 * index + 14)
+
+
+@dataclass
+class RinexObsEpoch:
+    week: int
+    tow: float
+    sats: T.List[str]
+    psr: np.ndarray
+    dopp: np.ndarray
+    freq: np.ndarray
+
+
+class RinexObsReader:
+    """
+    Streams a RINEX 3 observation file epoch by epoch. Only the header is kept in memory.
+    """
+
+    def __init__(self, path: T.Openable) -> None:
+        self.path = path
+        self.obs_types: T.Dict[str, T.List[str]] = {}
+        self.approx_position = np.zeros(3)
+        with open(path) as f:
+            self._read_header(f)
+        # 每个星座的伪距/多普勒在卫星行里的列
+        self.columns: T.Dict[str, T.Tuple[slice, slice, float]] = {}
+        for system, (psr_code, dopp_code, freq) in OBS_SIGNALS.items():
+            types = self.obs_types.get(system, [])
+            if psr_code in types and dopp_code in types:
+                self.columns[system] = (obs_field(types.index(psr_code)), obs_field(types.index(dopp_code)), freq)
+
+    def _read_header(self, f: T.TextIO) -> None:
+        system = None
+        for line in f:
+            label = line[60:].strip()
+            if label == "RINEX VERSION / TYPE":
+                assert line[5] == "3", f"{self.path}: not a RINEX 3 file"
+            elif label == "APPROX POSITION XYZ":
+                self.approx_position = np.array([float(value) for value in line[:42].split()])
+            elif label == "SYS / # / OBS TYPES":
+                # 观测类型多于13个时续行的星座字段为空
+                if line[0] != " ":
+                    system = line[0]
+                    self.obs_types[system] = []
+                self.obs_types[system].extend(line[7:58].split())
+            elif label == "END OF HEADER":
+                break
+
+    def __iter__(self) -> T.Iterator[RinexObsEpoch]:
+        with open(self.path) as f:
+            self._read_header(f)
+            for line in f:
+                if not line.startswith(">"):
+                    continue
+                flag = int(line[31])
+                num_records = int(line[32:35])
+                records = [next(f) for _ in range(num_records)]
+                # 事件标志>1时后面是头文件记录, 不是观测
+                if flag > 1:
+                    continue
+                week, tow = gps_time(
+                    int(line[2:6]), int(line[7:9]), int(line[10:12]), int(line[13:15]), int(line[16:18]),
+                    float(line[18:29]),
+                )
+                sats, psr, dopp, freq = [], [], [], []
+                for record in records:
+                    columns = self.columns.get(record[0])
+                    if columns is None:
+                        continue
+                    psr_field, dopp_field, sat_freq = columns
+                    value = rinex_float(record[psr_field])
+                    if not value > 0.0:
+                        continue
+                    sats.append(record[:3].replace(" ", "0"))
+                    psr.append(value)
+                    dopp.append(rinex_float(record[dopp_field]))
+                    freq.append(sat_freq)
+                yield RinexObsEpoch(
+                    week=week, tow=tow, sats=sats, psr=np.array(psr), dopp=np.array(dopp), freq=np.array(freq)
+                )
+
+
+@dataclass
+class NavRecord:
+    sat: str
+    # toe的绝对GPS时间(s), 用来选择最近的星历
+    toe_time: float
+    ephemeris: BroadcastEphemeris
+    tgd: float
+    ura: float
+    health: float
+    # GPS时间减去星历的时间系统(s), 北斗为BDT_TO_GPST; 接收时间要先减去它再和toe/toc比较
+    gpst_offset: float = 0.0
+
+
+class RinexNavReader:
+    """
+    Streams the Kepler ephemerides of a RINEX 3 navigation file. toe_time is absolute GPS time,
+    while the ephemeris keeps toe/toc in its own system time (BDT for BeiDou, as the orbit's earth
+    rotation term needs), with gpst_offset converting the receive time.
+    """
+
+    def __init__(self, path: T.Openable) -> None:
+        self.path = path
+        self.ion_params = list(KLOBUCHAR_DEFAULT)
+        with open(path) as f:
+            self._read_header(f)
+
+    def _read_header(self, f: T.TextIO) -> None:
+        for line in f:
+            label = line[60:].strip()
+            if label == "IONOSPHERIC CORR" and line[:4] in ("GPSA", "GPSB"):
+                offset = 0 if line[:4] == "GPSA" else 4
+                for k in range(4):
+                    self.ion_params[offset + k] = rinex_float(line[5 + 12 * k : 17 + 12 * k])
+            elif label == "END OF HEADER":
+                break
+
+    def __iter__(self) -> T.Iterator[NavRecord]:
+        with open(self.path) as f:
+            self._read_header(f)
+            for line in f:
+                if not line.strip():
+                    continue
+                system = line[0]
+                orbit_lines = [next(f) for _ in range(NAV_ORBIT_LINES.get(system, 7))]
+                if system not in SYSTEM_MU:
+                    continue
+                prn = int(line[1:3])
+                # BeiDou GEO卫星
+                if system == "C" and (prn <= 5 or prn >= 59):
+                    continue
+                orbit = [
+                    [rinex_float(orbit_line[4 + 19 * k : 23 + 19 * k]) for k in range(4)] for orbit_line in orbit_lines
+                ]
+                clock = [rinex_float(line[23 + 19 * k : 42 + 19 * k]) for k in range(3)]
+                _, toc = gps_time(
+                    int(line[4:8]), int(line[9:11]), int(line[12:14]), int(line[15:17]), int(line[18:20]),
+                    float(line[21:23]),
+                )
+                toe = orbit[2][0]
+                week = int(orbit[4][2])
+                gpst_offset = 0.0
+                if system == "C":
+                    gpst_offset = BDT_TO_GPST
+                    week += BDS_WEEK_OFFSET
+                toe_time = week * WEEK_SECONDS + toe + gpst_offset
+                # toe/toc是周内秒
+                toe, toc = toe % WEEK_SECONDS, toc % WEEK_SECONDS
+                ephemeris = BroadcastEphemeris(
+                    sqrtA=orbit[1][3], e=orbit[1][1], i0=orbit[3][0], OMG0=orbit[2][2], omg=orbit[3][2],
+                    M0=orbit[0][3], deln=orbit[0][2], idot=orbit[4][0], OMGd=orbit[3][3], cuc=orbit[1][0],
+                    cus=orbit[1][2], crc=orbit[3][1], crs=orbit[0][1], cic=orbit[2][1], cis=orbit[2][3],
+                    toe=toe, toc=toc, af0=clock[0], af1=clock[1], af2=clock[2], mu=SYSTEM_MU[system],
+                )
+                ura = orbit[5][0] if orbit[5][0] > 0.0 else DEFAULT_URA
+                yield NavRecord(
+                    sat=line[:3].replace(" ", "0"), toe_time=toe_time, ephemeris=ephemeris, tgd=orbit[5][2],
+                    ura=ura, health=orbit[5][1], gpst_offset=gpst_offset,
+                )
+
+
+class EphemerisStore:
+    """
+    Ephemerides of a navigation file indexed by satellite. All records are read up front: nav
+    files are small, and merged ones (e.g. the IGS/MGEX BRDC files) are sorted by satellite rather
+    than by toe, so they can not be streamed along with the observations.
+    """
+
+    def __init__(self, records: T.Iterable[NavRecord]) -> None:
+        self.by_sat: T.Dict[str, T.List[NavRecord]] = {}
+        for record in records:
+            self.by_sat.setdefault(record.sat, []).append(record)
+        # 每颗卫星按toe排序, 选择时二分查找
+        self.toe_times: T.Dict[str, T.List[float]] = {}
+        for sat, records_of_sat in self.by_sat.items():
+            records_of_sat.sort(key=lambda record: record.toe_time)
+            self.toe_times[sat] = [record.toe_time for record in records_of_sat]
+
+    def __len__(self) -> int:
+        return sum(len(records) for records in self.by_sat.values())
+
+    def select(self, sat: str, t: float) -> T.Optional[NavRecord]:
+        records = self.by_sat.get(sat)
+        if not records:
+            return None
+        k = bisect.bisect_left(self.toe_times[sat], t)
+        record = min(records[max(k - 1, 0) : k + 1], key=lambda record: abs(record.toe_time - t))
+        if abs(record.toe_time - t) > MAX_DTOE[sat[0]] or record.health != 0.0:
+            return None
+        return record
+
+
+@dataclass
+class GnssEpoch:
+    """
+    One epoch in the gnss_epoch factor layout: slots holds sv_pos / sv_vel (num_sats, 3) and the
+    GNSS_EPOCH_SATELLITE_SCALARS (num_sats,), with the first len(sats) slots valid.
+    """
+
+    week: int
+    tow: float
+    sats: T.List[str]
+    slots: T.Dict[str, np.ndarray]
+    pr_uura: np.ndarray
+    dp_uura: np.ndarray
+
+
+class GnssEpochStream:
+    """
+    RINEX observation + navigation files to GnssEpochs: satellite states from the broadcast
+    ephemerides, Klobuchar/Saastamoinen delays and elevation weights at rcv_ecef (the header's
+    approximate position unless set, e.g. to the current estimate). The navigation file is read
+    up front, the observation file is streamed.
+    """
+
+    def __init__(
+        self,
+        obs_path: T.Openable,
+        nav_path: T.Openable,
+        output_dir: T.Openable,
+        num_sats: int = 40,
+        elevation_mask_deg: float = 10.0,
+    ) -> None:
+        self.obs = RinexObsReader(obs_path)
+        self.nav = RinexNavReader(nav_path)
+        self.ephemerides = EphemerisStore(self.nav)
+        self.num_sats = num_sats
+        self.elevation_mask = np.radians(elevation_mask_deg)
+        self.rcv_ecef = self.obs.approx_position
+        self.states = SatelliteStateCache(output_dir)
+        self.delays = AtmosphereDelays(output_dir)
+        self.converter = GeodeticConverter(output_dir)
+
+    def __iter__(self) -> T.Iterator[GnssEpoch]:
+        for obs in self.obs:
+            t = obs.week * WEEK_SECONDS + obs.tow
+            selected = [(k, self.ephemerides.select(sat, t)) for k, sat in enumerate(obs.sats)]
+            selected = [(k, record) for k, record in selected if record is not None]
+            if not selected:
+                yield self._epoch(obs, [], [], {})
+                continue
+            index = np.array([k for k, _ in selected])
+            records = [record for _, record in selected]
+            # 接收时间换到各星历的时间系统
+            t_rx = obs.tow - np.array([record.gpst_offset for record in records])
+            state = self.states(
+                [record.sat for record in records], [record.ephemeris for record in records], t_rx, obs.psr[index]
+            )
+            elevation = self.converter.sat_azel(self.rcv_ecef, state["sv_pos"])[:, 1]
+            # 截止角以下的去掉, 卫星太多时保留仰角最高的num_sats颗
+            order = [k for k in np.argsort(-elevation) if elevation[k] >= self.elevation_mask][: self.num_sats]
+            yield self._epoch(
+                obs,
+                [records[k] for k in order],
+                index[order],
+                {key: value[order] for key, value in state.items()},
+                elevation[order],
+            )
+
+    def _epoch(
+        self,
+        obs: RinexObsEpoch,
+        records: T.List[NavRecord],
+        index: np.ndarray,
+        state: T.Dict[str, np.ndarray],
+        elevation: T.Optional[np.ndarray] = None,
+    ) -> GnssEpoch:
+        num_valid = len(records)
+        slots = {
+            "sv_pos": np.zeros((self.num_sats, 3)),
+            "sv_vel": np.zeros((self.num_sats, 3)),
+            **{key: np.zeros(self.num_sats) for key in GNSS_EPOCH_SATELLITE_SCALARS},
+        }
+        # 空的位置频率也要是有限值
+        slots["freq"][:] = GPS_L1_FREQ
+        pr_uura, dp_uura = np.ones(self.num_sats), np.ones(self.num_sats)
+        if num_valid:
+            valid = slice(0, num_valid)
+            for key in ("sv_pos", "sv_vel", "svdt", "svddt"):
+                slots[key][valid] = state[key]
+            slots["tgd"][valid] = [record.tgd for record in records]
+            slots["freq"][valid] = obs.freq[index]
+            slots["psr_measured"][valid] = obs.psr[index]
+            slots["dopp_measured"][valid] = obs.dopp[index]
+            slots["ion_delay"][valid], slots["tro_delay"][valid] = self.delays(
+                self.rcv_ecef, state["sv_pos"], obs.tow, self.nav.ion_params, obs.freq[index]
+            )
+            pr_uura[valid] = dp_uura[valid] = [record.ura for record in records]
+            slots["pr_weight"][valid], slots["dp_weight"][valid] = elevation_weights(
+                elevation, pr_uura[valid], dp_uura[valid]
+            )
+            slots["valid"][valid] = 1.0
+        return GnssEpoch(
+            week=obs.week, tow=obs.tow, sats=[record.sat for record in records], slots=slots,
+            pr_uura=pr_uura, dp_uura=dp_uura,
+        )
+
+
+def stack_epochs(epochs: T.Sequence[GnssEpoch]) -> T.Dict[str, np.ndarray]:
+    """
+    Epoch slots stacked to (E, num_sats, ...) for the batch epoch factor or RaimScreen.
+    """
+    return {key: np.stack([epoch.slots[key] for epoch in epochs]) for key in epochs[0].slots}
+
+
+def header_line(content: str, label: str) -> str:
+    return f"{content:<60}{label}\n"
+
+
+def format_rinex_float(value: float) -> str:
+    return f"{value:19.12E}".replace("E", "D")
+
+
+def format_rinex_time(t: float) -> T.Tuple[int, int, int, int, int, float]:
+    time = GPS_EPOCH + timedelta(seconds=t)
+    return time.year, time.month, time.day, time.hour, time.minute, time.second + time.microsecond * 1e-6
+
+
+def write_synthetic_rinex(
+    obs_path: T.Openable,
+    nav_path: T.Openable,
+    output_dir: T.Openable,
+    duration: float,
+    rate: float,
+    rcv_ecef: np.ndarray,
+    num_gps: int = 32,
+    num_galileo: int = 24,
+    num_beidou: int = 14,
+    week: int = 2300,
+    start_tow: float = 3600.0,
+    pr_noise: float = 1.0,
+    seed: int = 0,
+) -> None:
+    """
+    Static receiver observing GPS/Galileo/BeiDou satellites on random Kepler orbits, with
+    pseudoranges and dopplers consistent with gnss_satellite_residual (same ephemerides, delays
+    and tgd). Ephemerides are re-broadcast every 2 hours, propagated so the orbits stay continuous;
+    BeiDou ephemerides are in BDT.
+    """
+    rng = np.random.default_rng(seed)
+    # C01-C05是GEO, 读取时会跳过
+    sats = (
+        [f"G{k + 1:02d}" for k in range(num_gps)]
+        + [f"E{k + 1:02d}" for k in range(num_galileo)]
+        + [f"C{k + 6:02d}" for k in range(num_beidou)]
+    )
+    gpst_offset = np.array([BDT_TO_GPST if sat[0] == "C" else 0.0 for sat in sats])
+    freq = np.array([OBS_SIGNALS[sat[0]][2] for sat in sats])
+    start = week * WEEK_SECONDS + start_tow
+    toe_times = np.arange((start // 7200.0 - 1) * 7200.0, start + duration + 2 * 7200.0, 7200.0)
+    base = random_ephemerides(rng, len(sats), toe=toe_times[0] % WEEK_SECONDS)
+    tgd = rng.normal(scale=5e-9, size=len(sats))
+    # ephemerides[k][sat]: toe_times[k]的星历
+    # OMG0是相对周起点的, toe跨周时要补上地球自转, 不然两份星历在跨周处算出的轨道不一样
+    ephemerides = []
+    for toe_time in toe_times:
+        dt = toe_time - toe_times[0]
+        ephemerides.append(
+            [
+                replace(
+                    eph,
+                    M0=eph.M0 + (np.sqrt(SYSTEM_MU[sat[0]] / eph.sqrtA**6) + eph.deln) * dt,
+                    OMG0=eph.OMG0
+                    + eph.OMGd * dt
+                    + EARTH_OMG_GPS * ((toe_time - sat_offset) % WEEK_SECONDS - eph.toe - dt),
+                    toe=(toe_time - sat_offset) % WEEK_SECONDS,
+                    toc=(toe_time - sat_offset) % WEEK_SECONDS,
+                    af0=eph.af0 + eph.af1 * dt,
+                    mu=SYSTEM_MU[sat[0]],
+                )
+                for sat, eph, sat_offset in zip(sats, base, gpst_offset)
+            ]
+        )
+
+    with open(nav_path, "w") as f:
+        f.write(header_line(f"{'3.04':>9}{'':11}{'N: GNSS NAV DATA':<20}M: MIXED", "RINEX VERSION / TYPE"))
+        for label, values in (("GPSA", KLOBUCHAR_DEFAULT[:4]), ("GPSB", KLOBUCHAR_DEFAULT[4:])):
+            fields = "".join(f"{value:12.4E}".replace("E", "D") for value in values)
+            f.write(header_line(f"{label} {fields}", "IONOSPHERIC CORR"))
+        f.write(header_line("", "END OF HEADER"))
+        for toe_time, records in zip(toe_times, ephemerides):
+            for sat, eph, sat_tgd, sat_offset in zip(sats, records, tgd, gpst_offset):
+                # 北斗的toc和周数用BDT
+                year, month, day, hour, minute, second = format_rinex_time(toe_time - sat_offset)
+                sat_week = int((toe_time - sat_offset) // WEEK_SECONDS)
+                if sat[0] == "C":
+                    sat_week -= BDS_WEEK_OFFSET
+                orbit = [
+                    [0.0, eph.crs, eph.deln, eph.M0],
+                    [eph.cuc, eph.e, eph.cus, eph.sqrtA],
+                    [eph.toe, eph.cic, eph.OMG0, eph.cis],
+                    [eph.i0, eph.crc, eph.omg, eph.OMGd],
+                    [eph.idot, 0.0, sat_week, 0.0],
+                    [DEFAULT_URA, 0.0, sat_tgd, 0.0],
+                    [eph.toe, 4.0, 0.0, 0.0],
+                ]
+                f.write(
+                    f"{sat} {year:04d} {month:02d} {day:02d} {hour:02d} {minute:02d} {int(second):02d}"
+                    + "".join(format_rinex_float(value) for value in (eph.af0, eph.af1, eph.af2))
+                    + "\n"
+                )
+                for values in orbit:
+                    f.write("    " + "".join(format_rinex_float(value) for value in values) + "\n")
+
+    cache = SatelliteStateCache(output_dir)
+    delays = AtmosphereDelays(output_dir)
+    converter = GeodeticConverter(output_dir)
+    screen = RaimScreen(output_dir)
+    wavelength = LIGHT_SPEED / freq
+    num_epochs = int(round(duration * rate))
+    chunk = int(rate * 60)
+    with open(obs_path, "w") as f:
+        f.write(header_line(f"{'3.04':>9}{'':11}{'O: OBSERVATION DATA':<20}M: MIXED", "RINEX VERSION / TYPE"))
+        f.write(header_line("".join(f"{value:14.4f}" for value in rcv_ecef), "APPROX POSITION XYZ"))
+        for system, types in (("G", "C1C D1C S1C"), ("E", "C1C D1C S1C"), ("C", "C2I D2I S2I")):
+            f.write(header_line(f"{system}{3:5d} {types}", "SYS / # / OBS TYPES"))
+        f.write(header_line("", "END OF HEADER"))
+
+        for first in range(0, num_epochs, chunk):
+            # 一分钟的历元一起算, 每个历元所有卫星的槽位
+            t = start + np.arange(first, min(first + chunk, num_epochs)) / rate
+            nearest = np.clip(np.round((t - toe_times[0]) / 7200.0).astype(int), 0, len(toe_times) - 1)
+            rows_t = np.repeat(t, len(sats))
+            rows_eph = [eph for k in nearest for eph in ephemerides[k]]
+            rows_sats = sats * len(t)
+            rows_freq = np.tile(freq, len(t))
+            # 星历时间系统里的接收时间
+            rows_t_rx = rows_t % WEEK_SECONDS - np.tile(gpst_offset, len(t))
+            state = cache(rows_sats, rows_eph, rows_t_rx, np.full(len(rows_t), 2.2e7))
+            state = cache(rows_sats, rows_eph, rows_t_rx, np.linalg.norm(state["sv_pos"] - rcv_ecef, axis=1))
+            elevation = converter.sat_azel(rcv_ecef, state["sv_pos"])[:, 1]
+            ion_delay, tro_delay = delays(
+                rcv_ecef, state["sv_pos"], rows_t % WEEK_SECONDS, KLOBUCHAR_DEFAULT, rows_freq
+            )
+            shape = (len(t), len(sats))
+            data = {
+                "sv_pos": state["sv_pos"].reshape(*shape, 3),
+                "sv_vel": state["sv_vel"].reshape(*shape, 3),
+                "svdt": state["svdt"].reshape(shape),
+                "svddt": state["svddt"].reshape(shape),
+                "ion_delay": ion_delay.reshape(shape),
+                "tro_delay": tro_delay.reshape(shape),
+                "tgd": np.broadcast_to(tgd, shape),
+                "freq": np.broadcast_to(freq, shape),
+                "psr_measured": np.zeros(shape),
+                "dopp_measured": np.zeros(shape),
+                "valid": (elevation.reshape(shape) > 0.0).astype(float),
+            }
+            # 静止接收机, 钟差为0
+            true_state = np.zeros((len(t), 8))
+            true_state[:, :3] = rcv_ecef
+            predicted, _ = screen.linearize(data, true_state)
+            psr = predicted[:, :, 0] + rng.normal(scale=pr_noise, size=shape)
+            dopp = -(predicted[:, :, 1] + rng.normal(scale=0.05, size=shape)) / wavelength
+            snr = 30.0 + 20.0 * np.sin(np.maximum(elevation, 0.0)).reshape(shape)
+
+            for e, epoch_time in enumerate(t):
+                visible = np.nonzero(data["valid"][e])[0]
+                year, month, day, hour, minute, second = format_rinex_time(epoch_time)
+                lines = [
+                    f"> {year:04d} {month:02d} {day:02d} {hour:02d} {minute:02d}{second:11.7f}  0{len(visible):3d}\n"
+                ]
+                lines.extend(
+                    f"{sats[k]}{psr[e, k]:14.3f}  {dopp[e, k]:14.3f}  {snr[e, k]:14.3f}  \n" for k in visible
+                )
+                f.write("".join(lines))
+
+
+def current_rss_mb() -> float:
+    # Linux上读当前的RSS, 其他系统退回到峰值
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_rinex_stream(duration: float, rate: float, raim_chunk: int = 100) -> None:
+    output_dir = tempfile.mkdtemp(prefix="gnss_rinex_")
+    obs_path, nav_path = os.path.join(output_dir, "synthetic.obs"), os.path.join(output_dir, "synthetic.nav")
+    # 北纬30度附近的静止接收机
+    lat, lon = np.radians(30.5), np.radians(114.3)
+    rcv_ecef = 6378137.0 * np.array([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+    start = time.perf_counter()
+    write_synthetic_rinex(obs_path, nav_path, output_dir, duration, rate, rcv_ecef)
+    print(
+        f"wrote {duration / 3600:.2f} h at {rate:g} Hz in {time.perf_counter() - start:.1f} s: "
+        f"obs {os.path.getsize(obs_path) / 2**20:.1f} MB, nav {os.path.getsize(nav_path) / 2**10:.1f} kB"
+    )
+
+    num_epochs = 0
+    start = time.perf_counter()
+    for _ in RinexObsReader(obs_path):
+        num_epochs += 1
+    parse_time = time.perf_counter() - start
+    print(f"parse only: {num_epochs} epochs, {num_epochs / parse_time:.0f} epochs/s")
+
+    stream = GnssEpochStream(obs_path, nav_path, output_dir)
+    screen = RaimScreen(output_dir)
+    rss = []
+    buffer: T.List[GnssEpoch] = []
+    num_valid: T.Counter[str] = collections.Counter()
+    num_rejected: T.Counter[str] = collections.Counter()
+    position_errors = []
+
+    def screen_buffer() -> None:
+        data = stack_epochs(buffer)
+        initial_state = np.column_stack([np.broadcast_to(stream.rcv_ecef, (len(buffer), 3)), np.zeros((len(buffer), 5))])
+        result = screen(data, initial_state)
+        for epoch, keep in zip(buffer, result.keep):
+            for sat, sat_keep in zip(epoch.sats, keep):
+                num_valid[sat[0]] += 1
+                num_rejected[sat[0]] += int(not sat_keep)
+        position_errors.append(np.linalg.norm(result.state[:, :3] - rcv_ecef, axis=1))
+        buffer.clear()
+
+    start = time.perf_counter()
+    for k, epoch in enumerate(stream):
+        buffer.append(epoch)
+        if len(buffer) == raim_chunk:
+            screen_buffer()
+        if (k + 1) % max(num_epochs // 10, 1) == 0:
+            rss.append(current_rss_mb())
+    if buffer:
+        screen_buffer()
+    stream_time = time.perf_counter() - start
+    position_error = np.concatenate(position_errors)
+    print(
+        f"stream + states + delays + weights + RAIM: {num_epochs / stream_time:.0f} epochs/s "
+        f"({stream_time / num_epochs * 1e6:.0f} us/epoch), "
+        f"{sum(num_valid.values()) / num_epochs:.1f} satellites/epoch"
+    )
+    print("RSS at each 10% of the file: " + ", ".join(f"{value:.0f}" for value in rss) + " MB")
+    print(
+        "RAIM rejected "
+        + ", ".join(f"{system} {num_rejected[system]} of {num_valid[system]}" for system in sorted(num_valid))
+        + f" observations, least-squares position error median {np.median(position_error):.2f} m, "
+        f"max {position_error.max():.2f} m"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--obs", help="RINEX 3 observation file")
+    parser.add_argument("--nav", help="RINEX 3 navigation file")
+    parser.add_argument("--num_sats", type=int, default=40, help="satellite slots per epoch")
+    parser.add_argument("--duration", type=float, default=900.0, help="synthetic log length (s) for the benchmark")
+    parser.add_argument("--rate", type=float, default=10.0, help="synthetic log rate (Hz)")
+    args = parser.parse_args()
+
+    if args.obs and args.nav:
+        num_epochs, start = 0, time.perf_counter()
+        for epoch in GnssEpochStream(args.obs, args.nav, tempfile.mkdtemp(prefix="gnss_rinex_"), args.num_sats):
+            num_epochs += 1
+        print(f"{num_epochs} epochs, {num_epochs / (time.perf_counter() - start):.0f} epochs/s")
+    else:
+        benchmark_rinex_stream(args.duration, args.rate)
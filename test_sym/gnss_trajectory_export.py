@@ -0,0 +1,193 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+from symforce.codegen import codegen_util
+
+from array_file import create_array_file
+from array_file import read_array_file
+from codegen_hoist import split_per_iteration_codegen
+from gnss import EARTH_SEMI_MAJOR
+from gnss import calc_p_ecef
+from gnss import ecef2geo
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+
+# 把整条优化后的轨迹(Pi/Pj/ratio, 共用yaw_diff/ref_ecef)一次转换成ECEF和LLA, 写到可以memmap的文件.
+# yaw_diff/ref_ecef只出现在ENU->ECEF的旋转里, 用split_per_iteration_codegen提出来只算一次.
+# 文件格式见array_file.py
+
+MAGIC = b"GNSSTRJ1"
+TRAJECTORY_SHARED_ARGS = ["yaw_diff", "ref_ecef", "epsilon"]
+TRAJECTORY_OUTPUTS = ["P_ecef", "lla"]
+
+
+def trajectory_ecef_lla(
+    Pi: sf.V3,
+    Pj: sf.V3,
+    ratio: sf.Scalar,
+    yaw_diff: sf.Scalar,
+    ref_ecef: sf.V3,
+    epsilon: sf.Scalar = 0
+) -> T.Tuple[sf.V3, sf.V3]:
+    # 速度和钟差不影响位置
+    P_ecef = calc_p_ecef(Pi, sf.V3.zero(), Pj, sf.V3.zero(), 0, 0, yaw_diff, ref_ecef, ratio, epsilon)
+    return P_ecef, ecef2geo(P_ecef, epsilon)
+
+
+def trajectory_codegen(config: codegen.CodegenConfig) -> codegen.Codegen:
+    return codegen.Codegen.function(func=trajectory_ecef_lla, config=config, output_names=TRAJECTORY_OUTPUTS)
+
+
+def create_trajectory_file(
+    path: T.Openable, num_states: int, metadata: T.Dict[str, T.Any]
+) -> T.Dict[str, np.memmap]:
+    """
+    Allocate the file for num_states states and return writable (num_states, 3) float64
+    memmaps of P_ecef and lla.
+    """
+    return create_array_file(
+        path, MAGIC, dict(metadata=metadata), {key: (np.float64, (num_states, 3)) for key in TRAJECTORY_OUTPUTS}
+    )
+
+
+def read_trajectory(path: T.Openable) -> T.Tuple[T.Dict[str, T.Any], T.Dict[str, np.memmap]]:
+    header, arrays = read_array_file(path, MAGIC)
+    return header["metadata"], arrays
+
+
+class TrajectoryExporter:
+    """
+    Batched calc_p_ecef + ecef2geo over a whole trajectory, processed in chunks of chunk_size
+    states straight into the output memmaps.
+    """
+
+    def __init__(self, output_dir: T.Openable, chunk_size: int = 1 << 18) -> None:
+        precompute_codegen, hoisted_codegen = split_per_iteration_codegen(
+            trajectory_codegen(codegen.PythonConfig()), TRAJECTORY_SHARED_ARGS, name="trajectory_ecef_lla"
+        )
+        self.precompute = load_numpy_batch_function(generate_numpy_batch_function(precompute_codegen, output_dir))
+        self.convert = load_numpy_batch_function(generate_numpy_batch_function(hoisted_codegen, output_dir))
+        self.shared_inputs = [key for key in TRAJECTORY_SHARED_ARGS if key in hoisted_codegen.inputs.keys()]
+        self.chunk_size = chunk_size
+
+    def __call__(
+        self,
+        path: T.Openable,
+        Pi: np.ndarray,
+        Pj: np.ndarray,
+        ratio: np.ndarray,
+        yaw_diff: float,
+        ref_ecef: np.ndarray,
+    ) -> T.Dict[str, np.memmap]:
+        """
+        Args:
+            Pi, Pj: (N, 3) local positions (arrays or memmaps), ratio: (N,)
+            yaw_diff, ref_ecef: shared by the whole trajectory
+        """
+        shared = dict(yaw_diff=float(yaw_diff), ref_ecef=np.asarray(ref_ecef, dtype=np.float64), epsilon=sf.numeric_epsilon)
+        precomputed = self.precompute(**shared)
+        num_states = len(Pi)
+        outputs = create_trajectory_file(
+            path, num_states, dict(yaw_diff=shared["yaw_diff"], ref_ecef=shared["ref_ecef"].tolist())
+        )
+        for start in range(0, num_states, self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            P_ecef, lla = self.convert(
+                Pi=Pi[chunk], Pj=Pj[chunk], ratio=ratio[chunk], precomputed=precomputed,
+                **{key: shared[key] for key in self.shared_inputs},
+            )
+            outputs["P_ecef"][chunk] = P_ecef
+            outputs["lla"][chunk] = lla
+        for value in outputs.values():
+            value.flush()
+        return outputs
+
+
+def random_trajectory(num_states: int, seed: int = 0) -> T.Dict[str, T.Any]:
+    """
+    A smooth local trajectory of num_states states (random walk velocity), with the Pj of each
+    state the Pi of the next one.
+    """
+    rng = np.random.default_rng(seed)
+    steps = np.cumsum(rng.normal(scale=0.01, size=(num_states + 1, 3)), axis=0)
+    positions = np.cumsum(steps, axis=0)
+    lat, lon = 0.5, 2.0
+    return dict(
+        Pi=positions[:-1],
+        Pj=positions[1:],
+        ratio=rng.uniform(size=num_states),
+        yaw_diff=0.3,
+        ref_ecef=(EARTH_SEMI_MAJOR + 50.0) * np.array([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]),
+    )
+
+
+def benchmark_trajectory_export(num_states: int, num_loop_states: int = 10000) -> None:
+    output_dir = tempfile.mkdtemp(prefix="gnss_trajectory_")
+    exporter = TrajectoryExporter(output_dir)
+    trajectory = random_trajectory(num_states)
+    path = os.path.join(output_dir, "trajectory.bin")
+
+    start = time.perf_counter()
+    exporter(path, **trajectory)
+    export_time = time.perf_counter() - start
+    metadata, arrays = read_trajectory(path)
+    print(
+        f"exported {num_states} states in {export_time:.2f} s ({export_time / num_states * 1e9:.0f} ns/state), "
+        f"file {os.path.getsize(path) / 2**20:.0f} MB"
+    )
+
+    # 不提取公共部分: 每个状态都重新算ENU->ECEF的旋转
+    full = load_numpy_batch_function(generate_numpy_batch_function(trajectory_codegen(codegen.PythonConfig()), output_dir))
+    num_full = min(num_states, exporter.chunk_size)
+    start = time.perf_counter()
+    full_P_ecef, full_lla = full(
+        Pi=trajectory["Pi"][:num_full], Pj=trajectory["Pj"][:num_full], ratio=trajectory["ratio"][:num_full],
+        yaw_diff=trajectory["yaw_diff"], ref_ecef=trajectory["ref_ecef"], epsilon=sf.numeric_epsilon,
+    )
+    full_time = (time.perf_counter() - start) / num_full
+
+    # 逐个状态调用生成的python函数
+    scalar = trajectory_codegen(codegen.PythonConfig())
+    scalar_func = codegen_util.load_generated_function(
+        scalar.name, scalar.generate_function(output_dir=output_dir).function_dir
+    )
+    num_loop = min(num_states, num_loop_states)
+    start = time.perf_counter()
+    loop = [
+        scalar_func(
+            trajectory["Pi"][k], trajectory["Pj"][k], trajectory["ratio"][k], trajectory["yaw_diff"],
+            trajectory["ref_ecef"], sf.numeric_epsilon,
+        )
+        for k in range(num_loop)
+    ]
+    loop_time = (time.perf_counter() - start) / num_loop
+
+    loop_P_ecef = np.array([P_ecef for P_ecef, _ in loop])
+    loop_lla = np.array([lla for _, lla in loop])
+    print(
+        f"no hoisting batch {full_time * 1e9:.0f} ns/state, per-state python loop {loop_time * 1e9:.0f} ns/state "
+        f"({loop_time * num_states:.0f} s for the whole trajectory)"
+    )
+    print(
+        f"max difference: to the batch without hoisting {np.max(np.abs(arrays['P_ecef'][:num_full] - full_P_ecef)):.1e} m, "
+        f"to the loop P_ecef {np.max(np.abs(arrays['P_ecef'][:num_loop] - loop_P_ecef)):.1e} m, "
+        f"lla {np.max(np.abs(arrays['lla'][:num_loop] - loop_lla)):.1e}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_states", type=int, default=1000000, help="trajectory length for the benchmark")
+    parser.add_argument("--num_loop_states", type=int, default=10000, help="states for the per-state loop")
+    args = parser.parse_args()
+
+    benchmark_trajectory_export(args.num_states, args.num_loop_states)
@@ -0,0 +1,153 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+from symforce.codegen import codegen_util
+
+from gnss import PSR_TO_DOPP_RATIO
+from gnss import gnss_receiver_ecef
+from gnss import gnss_weighted_factor_codegen
+from gnss import relative_sqrt_info
+from gnss import sat_azel
+from gnss_epoch import gnss_single_factor_codegen
+from gnss_epoch import random_epochs
+from gnss_epoch import single_factor_inputs
+from gnss_geodetic import GeodeticConverter
+from imu_residual_variants import GeneratedSize
+from imu_residual_variants import generated_size
+from imu_residual_variants import print_sizes
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+
+# 在因子里按仰角加权(gnss_psr_dopp_weighted_factor)和调用方先在Python里算sat_azel和权重再构建因子的比较.
+# gnss_psr_dopp_weighted_constant_factor和GVINS一样, jacobian里不含权重对状态的导数
+
+RECEIVER_ARGS = ["Pi", "Vi", "Pj", "Vj", "yaw_diff", "ref_ecef", "ratio"]
+
+
+def generate_gnss_weighted_sizes(output_dir: T.Openable) -> T.List[GeneratedSize]:
+    sizes = []
+    for factor_codegen in (
+        gnss_single_factor_codegen(codegen.CppConfig()),
+        gnss_weighted_factor_codegen(codegen.CppConfig()),
+        gnss_weighted_factor_codegen(codegen.CppConfig(), weight_jacobian=False),
+        codegen.Codegen.function(func=sat_azel, config=codegen.CppConfig(), output_names=["azel"]),
+    ):
+        start = time.perf_counter()
+        metadata = factor_codegen.generate_function(output_dir=output_dir)
+        sizes.append(generated_size(factor_codegen.name, metadata.generated_files[0], time.perf_counter() - start))
+    return sizes
+
+
+def elevation_weights(
+    elevation: np.ndarray, pr_uura: np.ndarray, dp_uura: np.ndarray
+) -> T.Tuple[np.ndarray, np.ndarray]:
+    sin_el_2 = np.sin(elevation) ** 2
+    return sin_el_2 / pr_uura * relative_sqrt_info, sin_el_2 / dp_uura * relative_sqrt_info * PSR_TO_DOPP_RATIO
+
+
+def benchmark_gnss_weighting(num_sats: int, rate: float, num_epochs: int) -> None:
+    """
+    Linearize num_epochs epochs of num_sats satellites with the in-factor weighting, and with
+    the weights computed before the factor: per satellite with the generated python sat_azel,
+    and batched with GeodeticConverter.
+    """
+    output_dir = tempfile.mkdtemp(prefix="gnss_weighting_")
+
+    def load(func_codegen: codegen.Codegen) -> T.Callable:
+        return load_numpy_batch_function(generate_numpy_batch_function(func_codegen, output_dir))
+
+    weighted_factor = load(gnss_weighted_factor_codegen(codegen.PythonConfig()))
+    constant_weight_factor = load(gnss_weighted_factor_codegen(codegen.PythonConfig(), weight_jacobian=False))
+    single_factor = load(gnss_single_factor_codegen(codegen.PythonConfig()))
+    receiver_ecef = load(
+        codegen.Codegen.function(func=gnss_receiver_ecef, config=codegen.PythonConfig(), output_names=["P_ecef", "V_ecef"])
+    )
+    azel_codegen = codegen.Codegen.function(func=sat_azel, config=codegen.PythonConfig(), output_names=["azel"])
+    scalar_sat_azel = codegen_util.load_generated_function(
+        azel_codegen.name, azel_codegen.generate_function(output_dir=output_dir).function_dir
+    )
+    converter = GeodeticConverter(output_dir)
+
+    rng = np.random.default_rng(1)
+    inputs = single_factor_inputs(random_epochs(num_epochs, num_sats, num_sats))
+    inputs["pr_uura"] = rng.uniform(1.0, 4.0, size=num_epochs * num_sats)
+    inputs["dp_uura"] = rng.uniform(1.0, 4.0, size=num_epochs * num_sats)
+    weighted_keys = [key for key in inputs if key not in ("pr_weight", "dp_weight")]
+    epochs = [
+        {key: value[epoch * num_sats : (epoch + 1) * num_sats] for key, value in inputs.items()}
+        for epoch in range(num_epochs)
+    ]
+
+    def in_factor(epoch_inputs: T.Dict[str, np.ndarray], factor: T.Callable) -> T.Tuple[np.ndarray, ...]:
+        return factor(**{key: epoch_inputs[key] for key in weighted_keys}, epsilon=sf.numeric_epsilon)
+
+    def precomputed(epoch_inputs: T.Dict[str, np.ndarray], batched: bool) -> T.Tuple[np.ndarray, ...]:
+        # 调用方用当前状态的接收机位置算仰角, 所有卫星的接收机状态相同
+        P_ecef, _ = receiver_ecef(
+            **{key: epoch_inputs[key][:1] for key in RECEIVER_ARGS}, epsilon=sf.numeric_epsilon
+        )
+        if batched:
+            elevation = converter.sat_azel(P_ecef, epoch_inputs["sv_pos"])[:, 1]
+        else:
+            elevation = np.array(
+                [scalar_sat_azel(P_ecef[0], sv_pos, sf.numeric_epsilon)[1] for sv_pos in epoch_inputs["sv_pos"]]
+            )
+        pr_weight, dp_weight = elevation_weights(elevation, epoch_inputs["pr_uura"], epoch_inputs["dp_uura"])
+        return single_factor(
+            **dict(epoch_inputs, pr_weight=pr_weight, dp_weight=dp_weight), epsilon=sf.numeric_epsilon
+        )
+
+    paths = {
+        "in-factor weights": lambda epoch_inputs: in_factor(epoch_inputs, weighted_factor),
+        "in-factor constant weights": lambda epoch_inputs: in_factor(epoch_inputs, constant_weight_factor),
+        "python per-satellite sat_azel": lambda epoch_inputs: precomputed(epoch_inputs, batched=False),
+        "python batched sat_azel": lambda epoch_inputs: precomputed(epoch_inputs, batched=True),
+    }
+    results = {}
+    for name, path in paths.items():
+        path(epochs[0])
+        start = time.perf_counter()
+        results[name] = [path(epoch_inputs) for epoch_inputs in epochs]
+        epoch_time = (time.perf_counter() - start) / num_epochs
+        print(
+            f"{name:<30} {epoch_time * 1e6:8.1f} us/epoch, "
+            f"{epoch_time * rate * 100:.2f}% of a {rate:g} Hz stream with {num_sats} satellites"
+        )
+
+    # 在Python里算的权重对因子是常数, jacobian和in-factor constant weights一致
+    reference = results["python batched sat_azel"]
+    for name, result in results.items():
+        if name == "python batched sat_azel":
+            continue
+        differences = [
+            max(
+                np.max(np.abs(actual[k] - expected[k]) / np.maximum(np.abs(expected[k]), 1.0))
+                for actual, expected in zip(result, reference)
+            )
+            for k in (0, 1)
+        ]
+        print(
+            f"{name:<30} max relative difference to precomputed weights: "
+            f"residual {differences[0]:.2e}, jacobian {differences[1]:.2e}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmark", action="store_true", help="time in-factor against precomputed weights")
+    parser.add_argument("--num_sats", type=int, default=40, help="satellites per epoch")
+    parser.add_argument("--rate", type=float, default=10.0, help="epochs per second")
+    parser.add_argument("--num_epochs", type=int, default=600, help="epochs for the benchmark")
+    args = parser.parse_args()
+
+    print_sizes(generate_gnss_weighted_sizes(tempfile.mkdtemp(prefix="gnss_weighting_")))
+    if args.benchmark:
+        benchmark_gnss_weighting(args.num_sats, args.rate, args.num_epochs)
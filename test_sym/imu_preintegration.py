@@ -0,0 +1,588 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+from symforce.codegen import codegen_util
+
+from vins import deltaQ
+from vins import output_dir
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# 预积分的状态, 名字和顺序与imu_residual的输入一致
+IMU_PREINTEGRATION_STATE = [
+    "delta_p",
+    "delta_q",
+    "delta_v",
+    "dp_dba",
+    "dp_dbg",
+    "dq_dbg",
+    "dv_dba",
+    "dv_dbg",
+]
+IMU_PREINTEGRATION_OUTPUTS = [f"new_{name}" for name in IMU_PREINTEGRATION_STATE]
+
+
+def midpoint_integration(
+    acc_0: sf.V3,
+    gyr_0: sf.V3,
+    acc_1: sf.V3,
+    gyr_1: sf.V3,
+    dt: sf.Scalar,
+    delta_p: sf.V3,
+    delta_q: sf.Rot3,
+    delta_v: sf.V3,
+    ba: sf.V3,
+    bg: sf.V3,
+) -> T.Tuple[sf.V3, sf.Rot3, sf.V3]:
+    # 中值积分, 和VINS-Mono的midPointIntegration一致
+    un_acc_0 = delta_q * (acc_0 - ba)
+    un_gyr = 0.5 * (gyr_0 + gyr_1) - bg
+    result_delta_q = delta_q * deltaQ(un_gyr * dt)
+    q = sf.V4(result_delta_q.to_storage())
+    result_delta_q = sf.Rot3.from_storage(q / q.norm(epsilon=0))
+    un_acc_1 = result_delta_q * (acc_1 - ba)
+    un_acc = 0.5 * (un_acc_0 + un_acc_1)
+    result_delta_p = delta_p + delta_v * dt + 0.5 * un_acc * dt * dt
+    result_delta_v = delta_v + un_acc * dt
+    return result_delta_p, result_delta_q, result_delta_v
+
+
+# imu预积分的一步: 把一对相邻的imu采样融合进delta_p/delta_q/delta_v以及对零偏的雅可比
+def imu_preintegration_step(
+    acc_0: sf.V3,
+    gyr_0: sf.V3,
+    acc_1: sf.V3,
+    gyr_1: sf.V3,
+    dt: sf.Scalar,
+    delta_p: sf.V3,
+    delta_q: sf.Rot3,
+    delta_v: sf.V3,
+    dp_dba: sf.M33,
+    dp_dbg: sf.M33,
+    dq_dbg: sf.M33,
+    dv_dba: sf.M33,
+    dv_dbg: sf.M33,
+    linearized_ba: sf.V3,
+    linearized_bg: sf.V3,
+) -> T.Tuple[sf.V3, sf.Rot3, sf.V3, sf.M33, sf.M33, sf.M33, sf.M33, sf.M33]:
+    # 对零偏的雅可比直接对积分公式求导得到:
+    # 零偏加上扰动dba/dbg, 之前的预积分量按imu_residual里的一阶模型修正, 积分一步后在扰动为0处求导
+    dba = sf.V3.symbolic("dba")
+    dbg = sf.V3.symbolic("dbg")
+    perturbed_delta_p = delta_p + dp_dba * dba + dp_dbg * dbg
+    perturbed_delta_q = delta_q * deltaQ(dq_dbg * dbg)
+    perturbed_delta_v = delta_v + dv_dba * dba + dv_dbg * dbg
+
+    result_delta_p, result_delta_q, result_delta_v = midpoint_integration(
+        acc_0, gyr_0, acc_1, gyr_1, dt, delta_p, delta_q, delta_v, linearized_ba, linearized_bg
+    )
+    perturbed_p, perturbed_q, perturbed_v = midpoint_integration(
+        acc_0,
+        gyr_0,
+        acc_1,
+        gyr_1,
+        dt,
+        perturbed_delta_p,
+        perturbed_delta_q,
+        perturbed_delta_v,
+        linearized_ba + dba,
+        linearized_bg + dbg,
+    )
+    # 和imu_residual中的r_q一样, 旋转误差取2倍的虚部
+    perturbed_theta = 2 * sf.V3((result_delta_q.inverse() * perturbed_q).q.xyz)
+
+    zero_perturbation = {**dict(zip(dba, [0, 0, 0])), **dict(zip(dbg, [0, 0, 0]))}
+    new_dp_dba = perturbed_p.jacobian(dba).subs(zero_perturbation)
+    new_dp_dbg = perturbed_p.jacobian(dbg).subs(zero_perturbation)
+    new_dq_dbg = perturbed_theta.jacobian(dbg).subs(zero_perturbation)
+    new_dv_dba = perturbed_v.jacobian(dba).subs(zero_perturbation)
+    new_dv_dbg = perturbed_v.jacobian(dbg).subs(zero_perturbation)
+
+    return (
+        result_delta_p,
+        result_delta_q,
+        result_delta_v,
+        new_dp_dba,
+        new_dp_dbg,
+        new_dq_dbg,
+        new_dv_dba,
+        new_dv_dbg,
+    )
+
+
+def imu_transition_jacobians(
+    acc_0: sf.V3,
+    gyr_0: sf.V3,
+    acc_1: sf.V3,
+    gyr_1: sf.V3,
+    dt: sf.Scalar,
+    delta_q: sf.Rot3,
+    linearized_ba: sf.V3,
+    linearized_bg: sf.V3,
+) -> T.Tuple[sf.Matrix, sf.Matrix]:
+    """
+    Jacobians of the error state after one step with respect to the error state before it (F, 15x15)
+    and to the noise [n_acc_0, n_gyr_0, n_acc_1, n_gyr_1, n_ba, n_bg] (V, 15x18). The error state is
+    ordered like the residual of imu_residual: [p, q, v, ba, bg].
+    """
+    # 误差状态和噪声都用符号表示, 积分一步后在0处求导, F和V中已知为0的块会自动得到精确的0
+    error = [sf.V3.symbolic(name) for name in ("err_p", "err_theta", "err_v", "err_ba", "err_bg")]
+    noise = [sf.V3.symbolic(name) for name in ("n_a0", "n_g0", "n_a1", "n_g1", "n_ba", "n_bg")]
+    err_p, err_theta, err_v, err_ba, err_bg = error
+    n_a0, n_g0, n_a1, n_g1, n_ba, n_bg = noise
+
+    # F和V与delta_p/delta_v的取值无关, 名义状态直接取0
+    result_delta_p, result_delta_q, result_delta_v = midpoint_integration(
+        acc_0, gyr_0, acc_1, gyr_1, dt, sf.V3(), delta_q, sf.V3(), linearized_ba, linearized_bg
+    )
+    perturbed_p, perturbed_q, perturbed_v = midpoint_integration(
+        acc_0 + n_a0,
+        gyr_0 + n_g0,
+        acc_1 + n_a1,
+        gyr_1 + n_g1,
+        dt,
+        err_p,
+        delta_q * deltaQ(err_theta),
+        err_v,
+        linearized_ba + err_ba,
+        linearized_bg + err_bg,
+    )
+    new_error = sf.Matrix.block_matrix(
+        [
+            [perturbed_p - result_delta_p],
+            [2 * sf.V3((result_delta_q.inverse() * perturbed_q).q.xyz)],
+            [perturbed_v - result_delta_v],
+            [err_ba + n_ba * dt],
+            [err_bg + n_bg * dt],
+        ]
+    )
+
+    error_state = sf.Matrix.block_matrix([[e] for e in error])
+    noise_state = sf.Matrix.block_matrix([[n] for n in noise])
+    zeros = {symbol: 0 for symbol in list(error_state) + list(noise_state)}
+    F = new_error.jacobian(error_state).subs(zeros)
+    V = new_error.jacobian(noise_state).subs(zeros)
+    return F, V
+
+
+def symmetric_from_upper(P: sf.Matrix) -> sf.Matrix:
+    # 协方差是对称的, 只用上三角(含对角线)的元素, 生成的代码也只会读上三角
+    P_sym = sf.Matrix(P.rows, P.cols)
+    for i in range(P.rows):
+        for j in range(P.cols):
+            P_sym[i, j] = P[min(i, j), max(i, j)]
+    return P_sym
+
+
+# imu预积分协方差的传播: P_new = F * P * F^T + V * noise * V^T
+def imu_covariance_step(
+    acc_0: sf.V3,
+    gyr_0: sf.V3,
+    acc_1: sf.V3,
+    gyr_1: sf.V3,
+    dt: sf.Scalar,
+    delta_q: sf.Rot3,
+    linearized_ba: sf.V3,
+    linearized_bg: sf.V3,
+    covariance: sf.Matrix(15, 15),
+    acc_n: sf.Scalar,
+    gyr_n: sf.Scalar,
+    acc_w: sf.Scalar,
+    gyr_w: sf.Scalar,
+) -> sf.Matrix(15, 15):
+    F, V = imu_transition_jacobians(
+        acc_0, gyr_0, acc_1, gyr_1, dt, delta_q, linearized_ba, linearized_bg
+    )
+    P = symmetric_from_upper(covariance)
+    noise_var = [acc_n**2] * 3 + [gyr_n**2] * 3 + [acc_n**2] * 3 + [gyr_n**2] * 3
+    noise_var += [acc_w**2] * 3 + [gyr_w**2] * 3
+    # 噪声协方差是对角阵, 不需要做完整的矩阵乘法
+    P_new = F * P * F.T + V * sf.Matrix.diag(noise_var) * V.T
+
+    # Generate the equations for the upper triangular matrix and the diagonal only
+    # Since the matrix is symmetric, the lower triangle does not need to be derived
+    for index in range(15):
+        for j in range(15):
+            if index > j:
+                P_new[index, j] = 0
+
+    return P_new
+
+
+def imu_preintegration_step_storage(
+    acc_0: sf.V3,
+    gyr_0: sf.V3,
+    acc_1: sf.V3,
+    gyr_1: sf.V3,
+    dt: sf.Scalar,
+    delta_p: sf.V3,
+    delta_q: sf.V4,
+    delta_v: sf.V3,
+    dp_dba: sf.M33,
+    dp_dbg: sf.M33,
+    dq_dbg: sf.M33,
+    dv_dba: sf.M33,
+    dv_dbg: sf.M33,
+    linearized_ba: sf.V3,
+    linearized_bg: sf.V3,
+) -> T.Tuple[sf.V3, sf.V4, sf.V3, sf.M33, sf.M33, sf.M33, sf.M33, sf.M33]:
+    # numba只支持标量/向量/矩阵类型的输入输出, delta_q用[x, y, z, w]的存储表示
+    outputs = imu_preintegration_step(
+        acc_0,
+        gyr_0,
+        acc_1,
+        gyr_1,
+        dt,
+        delta_p,
+        sf.Rot3.from_storage(delta_q),
+        delta_v,
+        dp_dba,
+        dp_dbg,
+        dq_dbg,
+        dv_dba,
+        dv_dbg,
+        linearized_ba,
+        linearized_bg,
+    )
+    return outputs[:1] + (sf.V4(outputs[1].to_storage()),) + outputs[2:]
+
+
+def imu_covariance_step_storage(
+    acc_0: sf.V3,
+    gyr_0: sf.V3,
+    acc_1: sf.V3,
+    gyr_1: sf.V3,
+    dt: sf.Scalar,
+    delta_q: sf.V4,
+    linearized_ba: sf.V3,
+    linearized_bg: sf.V3,
+    covariance: sf.Matrix(15, 15),
+    acc_n: sf.Scalar,
+    gyr_n: sf.Scalar,
+    acc_w: sf.Scalar,
+    gyr_w: sf.Scalar,
+) -> sf.Matrix(15, 15):
+    return imu_covariance_step(
+        acc_0,
+        gyr_0,
+        acc_1,
+        gyr_1,
+        dt,
+        sf.Rot3.from_storage(delta_q),
+        linearized_ba,
+        linearized_bg,
+        covariance,
+        acc_n,
+        gyr_n,
+        acc_w,
+        gyr_w,
+    )
+
+
+def imu_transition_jacobians_storage(
+    acc_0: sf.V3,
+    gyr_0: sf.V3,
+    acc_1: sf.V3,
+    gyr_1: sf.V3,
+    dt: sf.Scalar,
+    delta_q: sf.V4,
+    linearized_ba: sf.V3,
+    linearized_bg: sf.V3,
+) -> T.Tuple[sf.Matrix, sf.Matrix]:
+    return imu_transition_jacobians(
+        acc_0, gyr_0, acc_1, gyr_1, dt, sf.Rot3.from_storage(delta_q), linearized_ba, linearized_bg
+    )
+
+
+# for imu preintegration
+def generate_imu_preintegration_code(
+    output_dir: T.Optional[T.Openable] = None, print_code: bool = False
+) -> None:
+    preintegration_codegen = codegen.Codegen.function(
+        func=imu_preintegration_step,
+        config=codegen.CppConfig(),
+        output_names=IMU_PREINTEGRATION_OUTPUTS,
+    )
+    preintegration_codegen.generate_function(output_dir)
+
+    covariance_codegen = codegen.Codegen.function(
+        func=imu_covariance_step,
+        config=codegen.CppConfig(),
+        output_names=["new_covariance"],
+    )
+    covariance_codegen.generate_function(output_dir)
+
+
+def load_python_function(
+    func: T.Callable, output_dir: T.Openable, output_names: T.Optional[T.Sequence[str]] = None
+) -> T.Callable:
+    """
+    Generate the python version of func (compiled with numba when it is installed) and load it.
+    """
+    func_codegen = codegen.Codegen.function(
+        func=func,
+        config=codegen.PythonConfig(use_numba=numba is not None),
+        output_names=output_names,
+    )
+    metadata = func_codegen.generate_function(output_dir)
+    return codegen_util.load_generated_function(func_codegen.name, metadata.function_dir)
+
+
+def load_imu_preintegration_step(output_dir: T.Openable) -> T.Callable:
+    return load_python_function(
+        imu_preintegration_step_storage, output_dir, IMU_PREINTEGRATION_OUTPUTS
+    )
+
+
+def load_imu_covariance_step(output_dir: T.Openable) -> T.Callable:
+    return load_python_function(imu_covariance_step_storage, output_dir, ["new_covariance"])
+
+
+def make_integrate_chunk(
+    step: T.Callable, covariance_step: T.Optional[T.Callable] = None
+) -> T.Callable:
+    """
+    Loop over a chunk of samples calling step, and covariance_step if given. With numba the whole
+    loop is compiled, so there is no python overhead per sample.
+    """
+
+    def integrate_chunk(
+        acc_0: np.ndarray,
+        gyr_0: np.ndarray,
+        dts: np.ndarray,
+        accs: np.ndarray,
+        gyrs: np.ndarray,
+        state: T.Tuple[np.ndarray, ...],
+        covariance: np.ndarray,
+        linearized_ba: np.ndarray,
+        linearized_bg: np.ndarray,
+        noise: np.ndarray,
+    ) -> T.Tuple[T.Tuple[np.ndarray, ...], np.ndarray]:
+        for k in range(dts.shape[0]):
+            if covariance_step is not None:
+                # 协方差传播用的是这一步积分之前的delta_q
+                covariance = covariance_step(
+                    acc_0,
+                    gyr_0,
+                    accs[k],
+                    gyrs[k],
+                    dts[k],
+                    state[1],
+                    linearized_ba,
+                    linearized_bg,
+                    covariance,
+                    noise[0],
+                    noise[1],
+                    noise[2],
+                    noise[3],
+                )
+            state = step(
+                acc_0,
+                gyr_0,
+                accs[k],
+                gyrs[k],
+                dts[k],
+                state[0],
+                state[1],
+                state[2],
+                state[3],
+                state[4],
+                state[5],
+                state[6],
+                state[7],
+                linearized_ba,
+                linearized_bg,
+            )
+            acc_0 = accs[k]
+            gyr_0 = gyrs[k]
+        return state, covariance
+
+    if numba is not None:
+        return numba.njit(integrate_chunk)
+    return integrate_chunk
+
+
+class ImuPreintegration:
+    """
+    Streaming imu preintegration between two keyframes, the python counterpart of VINS-Mono's
+    IntegrationBase. Samples are pushed in chunks, the outputs feed imu_residual directly.
+
+    noise is [acc_n, gyr_n, acc_w, gyr_w]; the covariance is only propagated if integrate_chunk was
+    made with a covariance_step.
+    """
+
+    def __init__(
+        self,
+        integrate_chunk: T.Callable,
+        acc_0: np.ndarray,
+        gyr_0: np.ndarray,
+        linearized_ba: np.ndarray,
+        linearized_bg: np.ndarray,
+        noise: T.Sequence[float] = (0.08, 0.004, 0.00004, 2.0e-6),
+    ) -> None:
+        self.integrate_chunk = integrate_chunk
+        self.acc_0 = np.asarray(acc_0, dtype=np.float64)
+        self.gyr_0 = np.asarray(gyr_0, dtype=np.float64)
+        self.linearized_ba = np.asarray(linearized_ba, dtype=np.float64)
+        self.linearized_bg = np.asarray(linearized_bg, dtype=np.float64)
+        self.noise = np.asarray(noise, dtype=np.float64)
+        self.sum_dt = 0.0
+        self.state = (
+            np.zeros(3),
+            np.array([0.0, 0.0, 0.0, 1.0]),
+            np.zeros(3),
+        ) + tuple(np.zeros((3, 3)) for _ in range(5))
+        # 只保存上三角
+        self.upper_covariance = np.zeros((15, 15))
+
+    def push(self, dts: np.ndarray, accs: np.ndarray, gyrs: np.ndarray) -> None:
+        """
+        Fold a chunk of samples: dts (K,), accs (K, 3), gyrs (K, 3). dts[k] is the time between
+        sample k and the previous sample (the last sample of the previous chunk for k = 0).
+        """
+        dts = np.ascontiguousarray(dts, dtype=np.float64)
+        accs = np.ascontiguousarray(accs, dtype=np.float64)
+        gyrs = np.ascontiguousarray(gyrs, dtype=np.float64)
+        if dts.shape[0] == 0:
+            return
+        self.state, self.upper_covariance = self.integrate_chunk(
+            self.acc_0,
+            self.gyr_0,
+            dts,
+            accs,
+            gyrs,
+            self.state,
+            self.upper_covariance,
+            self.linearized_ba,
+            self.linearized_bg,
+            self.noise,
+        )
+        self.acc_0 = accs[-1]
+        self.gyr_0 = gyrs[-1]
+        self.sum_dt += float(np.sum(dts))
+
+    def covariance(self) -> np.ndarray:
+        return self.upper_covariance + np.triu(self.upper_covariance, 1).T
+
+    def sqrt_info(self) -> np.ndarray:
+        """
+        Square-root information at keyframe time, same as VINS-Mono:
+        LLT(covariance.inverse()).matrixL().transpose()
+        """
+        information = np.linalg.inv(self.covariance())
+        return np.linalg.cholesky(0.5 * (information + information.T)).T
+
+    def imu_residual_args(self) -> T.Dict[str, T.Any]:
+        """
+        Preintegrated quantities as keyword arguments of imu_residual (delta_q as [x, y, z, w]).
+        """
+        args = dict(zip(IMU_PREINTEGRATION_STATE, self.state))
+        args["sum_dt"] = self.sum_dt
+        args["linearized_ba"] = self.linearized_ba
+        args["linearized_bg"] = self.linearized_bg
+        args["sqrt_info"] = self.sqrt_info()
+        return args
+
+
+def make_dense_covariance_step(transition_jacobians: T.Callable) -> T.Callable:
+    """
+    Reference for the benchmark: the same propagation with dense matrix products, as in
+    VINS-Mono (F * P * F^T + V * noise * V^T).
+    """
+
+    def dense_covariance_step(
+        acc_0: np.ndarray,
+        gyr_0: np.ndarray,
+        acc_1: np.ndarray,
+        gyr_1: np.ndarray,
+        dt: float,
+        delta_q: np.ndarray,
+        linearized_ba: np.ndarray,
+        linearized_bg: np.ndarray,
+        covariance: np.ndarray,
+        acc_n: float,
+        gyr_n: float,
+        acc_w: float,
+        gyr_w: float,
+    ) -> np.ndarray:
+        F, V = transition_jacobians(
+            acc_0, gyr_0, acc_1, gyr_1, dt, delta_q, linearized_ba, linearized_bg
+        )
+        noise_var = np.empty(18)
+        noise_var[0:3] = acc_n**2
+        noise_var[3:6] = gyr_n**2
+        noise_var[6:9] = acc_n**2
+        noise_var[9:12] = gyr_n**2
+        noise_var[12:15] = acc_w**2
+        noise_var[15:18] = gyr_w**2
+        P = covariance + np.triu(covariance, 1).T
+        return np.triu(F @ P @ F.T + (V * noise_var) @ V.T)
+
+    if numba is not None:
+        return numba.njit(dense_covariance_step)
+    return dense_covariance_step
+
+
+def benchmark_imu_preintegration(num_samples: int, chunk_size: int) -> None:
+    gen_dir = tempfile.mkdtemp(prefix="imu_preintegration_")
+    step = load_imu_preintegration_step(gen_dir)
+    covariance_step = load_imu_covariance_step(gen_dir)
+    dense_covariance_step = make_dense_covariance_step(
+        load_python_function(imu_transition_jacobians_storage, gen_dir, ["F", "V"])
+    )
+    rng = np.random.default_rng(0)
+    dts = np.full(num_samples, 1.0 / 400.0)
+    accs = rng.normal(scale=0.5, size=(num_samples, 3)) + np.array([0.0, 0.0, 9.81])
+    gyrs = rng.normal(scale=0.1, size=(num_samples, 3))
+    bias = np.zeros(3)
+
+    def run(integrate_chunk: T.Callable) -> T.Tuple[ImuPreintegration, float]:
+        # 第一次调用包含numba编译的时间
+        ImuPreintegration(integrate_chunk, accs[0], gyrs[0], bias, bias).push(
+            dts[:2], accs[:2], gyrs[:2]
+        )
+        preintegration = ImuPreintegration(integrate_chunk, accs[0], gyrs[0], bias, bias)
+        start = time.perf_counter()
+        for begin in range(1, num_samples, chunk_size):
+            end = min(begin + chunk_size, num_samples)
+            preintegration.push(dts[begin:end], accs[begin:end], gyrs[begin:end])
+        return preintegration, time.perf_counter() - start
+
+    print(f"samples: {num_samples}, chunk size: {chunk_size}, numba: {numba is not None}")
+    _, elapsed = run(make_integrate_chunk(step))
+    print(f"  preintegration:                     {elapsed / num_samples * 1e9:6.0f} ns/sample")
+    preintegration, elapsed = run(make_integrate_chunk(step, covariance_step))
+    print(f"  + generated covariance propagation: {elapsed / num_samples * 1e9:6.0f} ns/sample")
+    dense, elapsed = run(make_integrate_chunk(step, dense_covariance_step))
+    print(f"  + dense covariance propagation:     {elapsed / num_samples * 1e9:6.0f} ns/sample")
+
+    relative_error = np.max(np.abs(dense.covariance() - preintegration.covariance())) / np.max(
+        np.abs(dense.covariance())
+    )
+    print(f"  covariance relative difference: {relative_error:.3e}")
+    print(f"  sum_dt: {preintegration.sum_dt:.3f} s, delta_q: {preintegration.state[1]}")
+    print(f"  sqrt_info diagonal: {np.diag(preintegration.sqrt_info())}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_samples", type=int, default=400 * 60, help="number of imu samples")
+    parser.add_argument("--chunk_size", type=int, default=80, help="samples per push")
+    parser.add_argument("--benchmark", action="store_true", help="time the streaming integration")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_imu_preintegration(args.num_samples, args.chunk_size)
+    else:
+        generate_imu_preintegration_code(output_dir)
@@ -0,0 +1,100 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import re
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from symforce import codegen
+from symforce import typing as T
+
+from vins import imu_block_diagonal_whitening
+from vins import imu_dense_whitening
+from vins import imu_diagonal_whitening
+from vins import imu_upper_triangular_whitening
+from vins import imu_whitened_residual_codegen
+from vins import output_dir
+
+IMU_LINEARIZATION_ARGS = ["Pi", "Qi", "Vi", "Bai", "Bgi", "Pj", "Qj", "Vj", "Baj", "Bgj"]
+
+# sqrt_info的结构 -> 对应的whitening函数
+IMU_RESIDUAL_VARIANTS = {
+    "dense": imu_dense_whitening,
+    "upper_triangular": imu_upper_triangular_whitening,
+    "block_diagonal": imu_block_diagonal_whitening,
+    "diagonal": imu_diagonal_whitening,
+}
+
+
+def imu_residual_variant_name(variant: str) -> str:
+    # 稠密的版本和vins.imu_residual同名, 生成的还是imu_factor
+    return "imu_residual" if variant == "dense" else f"imu_{variant}_residual"
+
+
+@dataclass
+class GeneratedSize:
+    name: str
+    total_ops: int
+    lines: int
+    bytes: int
+    seconds: float
+
+
+def generated_size(name: str, generated_file: Path, seconds: float) -> GeneratedSize:
+    text = generated_file.read_text()
+    match = re.search(r"Total ops: (\d+)", text)
+    return GeneratedSize(
+        name=name,
+        total_ops=int(match.group(1)) if match else -1,
+        lines=text.count("\n"),
+        bytes=len(text.encode()),
+        seconds=seconds,
+    )
+
+
+# 生成各种sqrt_info结构的imu因子, 并统计op数和生成代码的大小
+def generate_imu_residual_variant_code(
+    output_dir: T.Optional[T.Openable] = None,
+    variants: T.Sequence[str] = tuple(IMU_RESIDUAL_VARIANTS),
+) -> T.List[GeneratedSize]:
+    sizes = []
+    for variant in variants:
+        start = time.perf_counter()
+        imu_codegen_with_linearization = imu_whitened_residual_codegen(
+            IMU_RESIDUAL_VARIANTS[variant], codegen.CppConfig(), imu_residual_variant_name(variant)
+        ).with_linearization(which_args=IMU_LINEARIZATION_ARGS)
+        metadata = imu_codegen_with_linearization.generate_function(
+            output_dir=output_dir, skip_directory_nesting=False
+        )
+        sizes.append(
+            generated_size(
+                imu_codegen_with_linearization.name,
+                metadata.generated_files[0],
+                time.perf_counter() - start,
+            )
+        )
+    return sizes
+
+
+def print_sizes(sizes: T.Sequence[GeneratedSize]) -> None:
+    width = max([46] + [len(size.name) + 2 for size in sizes])
+    print(f"{'factor':<{width}}{'total ops':>10}{'lines':>8}{'bytes':>10}{'codegen s':>11}")
+    for size in sizes:
+        print(
+            f"{size.name:<{width}}{size.total_ops:>10}{size.lines:>8}{size.bytes:>10}{size.seconds:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--variants",
+        nargs="+",
+        choices=list(IMU_RESIDUAL_VARIANTS),
+        default=list(IMU_RESIDUAL_VARIANTS),
+        help="sqrt_info structures to generate",
+    )
+    args = parser.parse_args()
+
+    print_sizes(generate_imu_residual_variant_code(output_dir, args.variants))
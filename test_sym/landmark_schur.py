@@ -0,0 +1,545 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import typing as T
+
+from numpy_codegen import load_numpy_batch_function
+from projection_batch import PROJECTION_LINEARIZATION_ARGS
+from projection_batch import generate_projection_batch_code
+from projection_batch import projection_gnc_factor_batch
+
+# 滑窗状态的顺序: 每帧[P, Q]各6维, 最后是外参[tic, qic]6维, 逆深度全部通过Schur补消去
+POSE_DIM = 6
+# projection_gnc_factor的每个线性化变量 -> (状态块: 0 host帧, 1 target帧, 2 外参, 块内偏移),
+# inv_dep_i是逆深度
+PROJECTION_ARG_BLOCKS = {
+    "Pi": (0, 0),
+    "Qi": (0, 3),
+    "Pj": (1, 0),
+    "Qj": (1, 3),
+    "tic": (2, 0),
+    "qic": (2, 3),
+}
+
+
+@dataclass
+class ProjectionLayout:
+    """
+    Columns of a projection_gnc_factor linearization for a which_args set: where each pose /
+    extrinsic column goes in the window state, and the inverse depth column, if linearized.
+    """
+
+    dim: int
+    # 属于位姿/外参的列, 和每列所在的块(0 host, 1 target, 2 外参)及块内偏移
+    state_columns: np.ndarray
+    block: np.ndarray
+    offset: np.ndarray
+    # 用到的块, 交叉项按这个顺序存
+    blocks: np.ndarray
+    landmark: T.Optional[int]
+
+
+def projection_layout(which_args: T.Sequence[str] = PROJECTION_LINEARIZATION_ARGS) -> ProjectionLayout:
+    state_columns, block, offset = [], [], []
+    landmark = None
+    column = 0
+    for arg in which_args:
+        if arg == "inv_dep_i":
+            landmark = column
+            column += 1
+            continue
+        arg_block, arg_offset = PROJECTION_ARG_BLOCKS[arg]
+        state_columns.extend(range(column, column + 3))
+        block.extend([arg_block] * 3)
+        offset.extend(range(arg_offset, arg_offset + 3))
+        column += 3
+    return ProjectionLayout(
+        dim=column,
+        state_columns=np.array(state_columns, dtype=int),
+        block=np.array(block, dtype=int),
+        offset=np.array(offset, dtype=int),
+        blocks=np.unique(np.array(block, dtype=int)),
+        landmark=landmark,
+    )
+
+
+def quat_to_matrix(q: np.ndarray) -> np.ndarray:
+    """
+    Rotation matrices (..., 3, 3) of quaternions stored as [x, y, z, w].
+    """
+    x, y, z, w = np.moveaxis(q, -1, 0)
+    return np.stack(
+        [
+            np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], -1),
+            np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], -1),
+            np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], -1),
+        ],
+        -2,
+    )
+
+
+def quat_multiply(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    ax, ay, az, aw = np.moveaxis(a, -1, 0)
+    bx, by, bz, bw = np.moveaxis(b, -1, 0)
+    return np.stack(
+        [
+            aw * bx + ax * bw + ay * bz - az * by,
+            aw * by - ax * bz + ay * bw + az * bx,
+            aw * bz + ax * by - ay * bx + az * bw,
+            aw * bw - ax * bx - ay * by - az * bz,
+        ],
+        -1,
+    )
+
+
+def quat_from_tangent(v: np.ndarray) -> np.ndarray:
+    """
+    Same as sf.Rot3.from_tangent, for an array of rotation vectors (..., 3).
+    """
+    theta = np.linalg.norm(v, axis=-1, keepdims=True)
+    half_theta = 0.5 * theta
+    # theta很小时sin(theta/2)/theta取极限1/2
+    scale = np.where(theta > 1e-12, np.sin(half_theta) / np.maximum(theta, 1e-12), 0.5)
+    return np.concatenate([v * scale, np.cos(half_theta)], axis=-1)
+
+
+@dataclass
+class CrossBlockGroup:
+    """
+    Features whose cross terms touch the same pose blocks (e.g. the same host and target frames),
+    so their part of the Schur complement is one dense product.
+    """
+
+    features: np.ndarray
+    # (len(features), 块数)的交叉项行号, 和这些块在位姿/外参状态里的下标
+    rows: np.ndarray
+    state_index: np.ndarray
+
+
+def cross_block_groups(feature: np.ndarray, block: np.ndarray) -> T.List[CrossBlockGroup]:
+    """
+    Args:
+        feature, block: (feature, pose block) of every cross term row, sorted by feature
+    """
+    features, starts, counts = np.unique(feature, return_index=True, return_counts=True)
+    groups = []
+    for count in np.unique(counts):
+        selected = counts == count
+        rows = starts[selected, None] + np.arange(count)
+        # 按碰到的位姿块排序, 相同的排在一起
+        order = np.lexsort(block[rows].T[::-1])
+        signatures = block[rows[order]]
+        group_starts = np.flatnonzero(np.r_[True, np.any(signatures[1:] != signatures[:-1], axis=1)])
+        for signature, members in zip(signatures[group_starts], np.split(order, group_starts[1:])):
+            groups.append(
+                CrossBlockGroup(
+                    features=features[selected][members],
+                    rows=rows[members],
+                    state_index=(POSE_DIM * signature[:, None] + np.arange(POSE_DIM)).ravel(),
+                )
+            )
+    return groups
+
+
+@dataclass
+class SchurSystem:
+    # 位姿和外参的部分
+    H_xx: np.ndarray
+    b_x: np.ndarray
+    # 位姿/外参和逆深度的交叉项, 只存非零的6维块: 每个(特征点, 位姿块)一行, 按特征点排序.
+    # 外参是最后一个块(num_poses)
+    H_xl: np.ndarray
+    H_xl_feature: np.ndarray
+    H_xl_block: np.ndarray
+    H_xl_groups: T.List[CrossBlockGroup]
+    # 逆深度部分, 每个特征点只有1维, 所以是对角的
+    H_ll: np.ndarray
+    b_l: np.ndarray
+
+    def dense_H_xl(self) -> np.ndarray:
+        """
+        (state_dim, num_features) cross term, only for reference solves on small windows.
+        """
+        H_xl = np.zeros((self.H_xx.shape[0], self.H_ll.shape[0]))
+        rows = POSE_DIM * self.H_xl_block[:, None] + np.arange(POSE_DIM)
+        H_xl[rows, self.H_xl_feature[:, None]] = self.H_xl
+        return H_xl
+
+
+def observation_state_indices(
+    idx_i: np.ndarray, idx_j: np.ndarray, num_poses: int, layout: ProjectionLayout
+) -> np.ndarray:
+    """
+    (N, len(layout.state_columns)) indices into the pose/extrinsic state of the pose and extrinsic
+    columns (Pi, Qi, Pj, Qj, tic, qic, whichever are linearized) of each observation.
+    """
+    blocks = np.column_stack([idx_i, idx_j, np.full_like(idx_i, num_poses)])
+    return POSE_DIM * blocks[:, layout.block] + layout.offset
+
+
+def cross_blocks(
+    idx_i: np.ndarray, idx_j: np.ndarray, feature_idx: np.ndarray, num_poses: int, layout: ProjectionLayout
+) -> T.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The (feature, pose block) pairs the cross term touches, sorted by feature, and for every
+    observation the index of each of its pose/extrinsic columns in the flattened (rows, POSE_DIM)
+    cross term. Empty if the inverse depth is not linearized.
+    """
+    if layout.landmark is None:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty, np.zeros((idx_i.shape[0], 0), dtype=int)
+    num_blocks = num_poses + 1
+    blocks = np.column_stack([idx_i, idx_j, np.full_like(idx_i, num_poses)])[:, layout.blocks]
+    keys, rows = np.unique(feature_idx[:, None] * num_blocks + blocks, return_inverse=True)
+    rows = rows.reshape(blocks.shape)[:, np.searchsorted(layout.blocks, layout.block)]
+    return keys // num_blocks, keys % num_blocks, POSE_DIM * rows + layout.offset
+
+
+def assemble_schur_system(
+    hessian: np.ndarray,
+    rhs: np.ndarray,
+    idx_i: np.ndarray,
+    idx_j: np.ndarray,
+    feature_idx: np.ndarray,
+    num_poses: int,
+    num_features: int,
+    layout: T.Optional[ProjectionLayout] = None,
+) -> SchurSystem:
+    """
+    Accumulate the per-observation linearizations of projection_gnc_factor (hessian is lower
+    triangular, as generated by symforce) into the blocks of the window system.
+
+    Args:
+        layout: columns of the linearization, projection_layout(which_args) of the factor variant,
+            by default all of PROJECTION_LINEARIZATION_ARGS
+    """
+    layout = layout or projection_layout()
+    # symforce只计算hessian的下三角
+    hessian = np.tril(hessian) + np.swapaxes(np.tril(hessian, -1), 1, 2)
+
+    state_dim = POSE_DIM * (num_poses + 1)
+    indices = observation_state_indices(idx_i, idx_j, num_poses, layout)
+    columns, landmark = layout.state_columns, layout.landmark
+
+    H_xx = np.zeros((state_dim, state_dim))
+    np.add.at(H_xx, (indices[:, :, None], indices[:, None, :]), hessian[:, columns[:, None], columns])
+    b_x = np.zeros(state_dim)
+    np.add.at(b_x, indices, rhs[:, columns])
+
+    H_xl_feature, H_xl_block, H_xl_index = cross_blocks(idx_i, idx_j, feature_idx, num_poses, layout)
+    H_xl = np.zeros(H_xl_feature.shape[0] * POSE_DIM)
+    H_ll = np.zeros(num_features)
+    b_l = np.zeros(num_features)
+    # 逆深度不线性化时(landmark固定)没有交叉项, 逆深度的步长是0
+    if landmark is not None:
+        np.add.at(H_xl, H_xl_index, hessian[:, columns, landmark])
+        np.add.at(H_ll, feature_idx, hessian[:, landmark, landmark])
+        np.add.at(b_l, feature_idx, rhs[:, landmark])
+
+    return SchurSystem(
+        H_xx=H_xx, b_x=b_x, H_xl=H_xl.reshape(-1, POSE_DIM), H_xl_feature=H_xl_feature, H_xl_block=H_xl_block,
+        H_xl_groups=cross_block_groups(H_xl_feature, H_xl_block), H_ll=H_ll, b_l=b_l,
+    )
+
+
+@dataclass
+class SchurStructure:
+    """
+    Index structure of assemble_schur_system for a fixed set of observations, so that the
+    accumulation is a few np.bincount calls when only the linearization values change.
+    """
+
+    state_dim: int
+    num_features: int
+    layout: ProjectionLayout
+    # 从下三角的hessian取出完整对称矩阵的下标
+    symmetric_index: np.ndarray
+    H_xx_index: np.ndarray
+    b_x_index: np.ndarray
+    H_xl_index: np.ndarray
+    H_xl_feature: np.ndarray
+    H_xl_block: np.ndarray
+    H_xl_groups: T.List[CrossBlockGroup]
+    feature_idx: np.ndarray
+
+
+def build_schur_structure(
+    idx_i: np.ndarray,
+    idx_j: np.ndarray,
+    feature_idx: np.ndarray,
+    num_poses: int,
+    num_features: int,
+    layout: T.Optional[ProjectionLayout] = None,
+) -> SchurStructure:
+    layout = layout or projection_layout()
+    dim = layout.dim
+    rows, cols = np.indices((dim, dim))
+    state_dim = POSE_DIM * (num_poses + 1)
+    indices = observation_state_indices(idx_i, idx_j, num_poses, layout)
+    H_xl_feature, H_xl_block, H_xl_index = cross_blocks(idx_i, idx_j, feature_idx, num_poses, layout)
+    return SchurStructure(
+        state_dim=state_dim,
+        num_features=num_features,
+        layout=layout,
+        symmetric_index=np.where(rows >= cols, rows * dim + cols, cols * dim + rows).ravel(),
+        H_xx_index=(indices[:, :, None] * state_dim + indices[:, None, :]).ravel(),
+        b_x_index=indices.ravel(),
+        H_xl_index=H_xl_index.ravel(),
+        H_xl_feature=H_xl_feature,
+        H_xl_block=H_xl_block,
+        H_xl_groups=cross_block_groups(H_xl_feature, H_xl_block),
+        feature_idx=feature_idx,
+    )
+
+
+def assemble_schur_system_from_structure(
+    structure: SchurStructure, hessian: np.ndarray, rhs: np.ndarray
+) -> SchurSystem:
+    """
+    Same result as assemble_schur_system, reusing the indices of build_schur_structure.
+    """
+    num_obs = hessian.shape[0]
+    dim = structure.layout.dim
+    columns, landmark = structure.layout.state_columns, structure.layout.landmark
+    state_dim, num_features = structure.state_dim, structure.num_features
+    hessian = hessian.reshape(num_obs, dim * dim)[:, structure.symmetric_index].reshape(num_obs, dim, dim)
+
+    H_xx = np.bincount(
+        structure.H_xx_index,
+        weights=hessian[:, columns[:, None], columns].ravel(),
+        minlength=state_dim * state_dim,
+    ).reshape(state_dim, state_dim)
+    b_x = np.bincount(structure.b_x_index, weights=rhs[:, columns].ravel(), minlength=state_dim)
+    num_cross_rows = structure.H_xl_feature.shape[0]
+    if landmark is None:
+        H_xl = np.zeros((0, POSE_DIM))
+        H_ll = np.zeros(num_features)
+        b_l = np.zeros(num_features)
+    else:
+        H_xl = np.bincount(
+            structure.H_xl_index,
+            weights=hessian[:, columns, landmark].ravel(),
+            minlength=num_cross_rows * POSE_DIM,
+        ).reshape(num_cross_rows, POSE_DIM)
+        H_ll = np.bincount(structure.feature_idx, weights=hessian[:, landmark, landmark], minlength=num_features)
+        b_l = np.bincount(structure.feature_idx, weights=rhs[:, landmark], minlength=num_features)
+
+    return SchurSystem(
+        H_xx=H_xx, b_x=b_x, H_xl=H_xl, H_xl_feature=structure.H_xl_feature, H_xl_block=structure.H_xl_block,
+        H_xl_groups=structure.H_xl_groups, H_ll=H_ll, b_l=b_l,
+    )
+
+
+def solve_schur(
+    system: SchurSystem, damping: float = 1e-6, fixed_poses: T.Sequence[int] = (0,)
+) -> T.Tuple[np.ndarray, np.ndarray]:
+    """
+    Solve H * delta = -rhs by eliminating every inverse depth with its own 1x1 Schur complement,
+    then back-substitute the depths.
+
+    Args:
+        damping: Levenberg-Marquardt style damping added to the diagonal
+        fixed_poses: poses held constant (gauge), by default the oldest frame
+
+    Returns:
+        delta of the pose/extrinsic state (6 * (num_poses + 1),) and of the inverse depths
+    """
+    H_ll = system.H_ll + damping
+    S = system.H_xx.copy()
+    g = system.b_x.copy()
+    # 每个特征点的逆深度是1维的, H_ll是对角阵: S -= h h^T / H_ll, 只在特征点碰到的位姿块之间累加,
+    # 碰到同样位姿块的特征点一起算
+    group_cross = []
+    for group in system.H_xl_groups:
+        W = system.H_xl[group.rows].reshape(group.features.shape[0], -1)
+        scaled = W / H_ll[group.features, None]
+        S[np.ix_(group.state_index, group.state_index)] -= W.T @ scaled
+        g[group.state_index] -= scaled.T @ system.b_l[group.features]
+        group_cross.append(W)
+    S[np.diag_indices_from(S)] += damping
+
+    free = np.ones(S.shape[0], dtype=bool)
+    for pose in fixed_poses:
+        free[POSE_DIM * pose : POSE_DIM * (pose + 1)] = False
+
+    delta_x = np.zeros(S.shape[0])
+    delta_x[free] = np.linalg.solve(S[np.ix_(free, free)], -g[free])
+
+    # 回代求逆深度
+    H_xl_delta_x = np.zeros_like(H_ll)
+    for group, W in zip(system.H_xl_groups, group_cross):
+        H_xl_delta_x[group.features] = W @ delta_x[group.state_index]
+    delta_l = -(system.b_l + H_xl_delta_x) / H_ll
+    return delta_x, delta_l
+
+
+def solve_dense(
+    system: SchurSystem, damping: float = 1e-6, fixed_poses: T.Sequence[int] = (0,)
+) -> T.Tuple[np.ndarray, np.ndarray]:
+    """
+    Reference: the same step solved on the full Hessian, with all inverse depths in it.
+    """
+    state_dim = system.H_xx.shape[0]
+    H_xl = system.dense_H_xl()
+    H = np.block([[system.H_xx, H_xl], [H_xl.T, np.diag(system.H_ll)]])
+    b = np.concatenate([system.b_x, system.b_l])
+    H[np.diag_indices_from(H)] += damping
+
+    free = np.ones(H.shape[0], dtype=bool)
+    for pose in fixed_poses:
+        free[POSE_DIM * pose : POSE_DIM * (pose + 1)] = False
+
+    delta = np.zeros(H.shape[0])
+    delta[free] = np.linalg.solve(H[np.ix_(free, free)], -b[free])
+    return delta[:state_dim], delta[state_dim:]
+
+
+def retract_window(
+    P: np.ndarray,
+    Q: np.ndarray,
+    tic: np.ndarray,
+    qic: np.ndarray,
+    inv_dep: np.ndarray,
+    delta_x: np.ndarray,
+    delta_l: np.ndarray,
+) -> T.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Apply a step in the tangent space, the same way as symforce's retract for V3 and Rot3.
+    """
+    num_poses = P.shape[0]
+    delta_poses = delta_x[: POSE_DIM * num_poses].reshape(num_poses, POSE_DIM)
+    delta_extrinsic = delta_x[POSE_DIM * num_poses :]
+    return (
+        P + delta_poses[:, :3],
+        quat_multiply(Q, quat_from_tangent(delta_poses[:, 3:])),
+        tic + delta_extrinsic[:3],
+        quat_multiply(qic, quat_from_tangent(delta_extrinsic[3:])),
+        inv_dep + delta_l,
+    )
+
+
+def random_tracks(
+    num_features: int, num_poses: int, track_length: int, seed: int = 0
+) -> T.Dict[str, np.ndarray]:
+    """
+    Features observed from their host frame in the next track_length - 1 frames of a random
+    window, with noisy observations.
+    """
+    rng = np.random.default_rng(seed)
+    P = np.cumsum(rng.normal(scale=0.2, size=(num_poses, 3)), axis=0)
+    Q = np.tile([0.0, 0.0, 0.0, 1.0], (num_poses, 1))
+    Q = quat_multiply(Q, quat_from_tangent(rng.normal(scale=0.05, size=(num_poses, 3))))
+    tic = np.array([0.05, 0.0, 0.0])
+    qic = np.array([0.0, 0.0, 0.0, 1.0])
+
+    host = rng.integers(0, num_poses - track_length + 1, size=num_features)
+    inv_dep = rng.uniform(0.1, 0.5, size=num_features)
+    pts_host = np.column_stack(
+        [rng.uniform(-0.4, 0.4, size=(num_features, 2)), np.ones(num_features)]
+    )
+
+    # 把特征点投影到后续的帧中
+    feature_idx = np.repeat(np.arange(num_features), track_length - 1)
+    idx_i = host[feature_idx]
+    idx_j = idx_i + np.tile(np.arange(1, track_length), num_features)
+    R_ic = quat_to_matrix(qic)
+    pts_imu_i = (R_ic @ (pts_host[feature_idx] / inv_dep[feature_idx, None]).T).T + tic
+    pts_w = np.einsum("nij,nj->ni", quat_to_matrix(Q[idx_i]), pts_imu_i) + P[idx_i]
+    pts_imu_j = np.einsum("nji,nj->ni", quat_to_matrix(Q[idx_j]), pts_w - P[idx_j])
+    pts_camera_j = (R_ic.T @ (pts_imu_j - tic).T).T
+    pts_j = pts_camera_j / pts_camera_j[:, 2:3]
+    pts_j[:, :2] += rng.normal(scale=1.0 / 460.0, size=(pts_j.shape[0], 2))
+
+    return dict(
+        pts_i=pts_host[feature_idx],
+        pts_j=pts_j,
+        feature_idx=feature_idx,
+        idx_i=idx_i,
+        idx_j=idx_j,
+        P=P,
+        Q=Q,
+        tic=tic,
+        qic=qic,
+        inv_dep=inv_dep,
+    )
+
+
+def benchmark_landmark_schur(num_features: int, num_poses: int, track_length: int) -> None:
+    factor = load_numpy_batch_function(
+        generate_projection_batch_code(tempfile.mkdtemp(prefix="landmark_schur_"))
+    )
+    data = random_tracks(num_features, num_poses, track_length)
+    # 初始值加上扰动
+    rng = np.random.default_rng(1)
+    inv_dep = data["inv_dep"] * rng.uniform(0.8, 1.2, size=num_features)
+    P = data["P"] + rng.normal(scale=0.02, size=data["P"].shape)
+    P[0] = data["P"][0]
+    Q, tic, qic = data["Q"], data["tic"], data["qic"]
+
+    for iteration in range(5):
+        start = time.perf_counter()
+        res, _, hessian, rhs = projection_gnc_factor_batch(
+            factor,
+            data["pts_i"],
+            data["pts_j"],
+            inv_dep[data["feature_idx"]],
+            data["idx_i"],
+            data["idx_j"],
+            P,
+            Q,
+            tic,
+            qic,
+            weight=1.0,
+            gnc_mu=0.0,
+            gnc_scale=1.0,
+            epsilon=sf.numeric_epsilon,
+        )
+        linearize_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        system = assemble_schur_system(
+            hessian, rhs, data["idx_i"], data["idx_j"], data["feature_idx"], num_poses, num_features
+        )
+        assemble_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        delta_x, delta_l = solve_schur(system)
+        schur_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dense_delta_x, dense_delta_l = solve_dense(system)
+        dense_time = time.perf_counter() - start
+
+        difference = max(
+            np.max(np.abs(delta_x - dense_delta_x)), np.max(np.abs(delta_l - dense_delta_l))
+        )
+        print(
+            f"iteration {iteration}: cost {0.5 * np.sum(res**2):.4e}, "
+            f"linearize {linearize_time * 1e3:.1f} ms, assemble {assemble_time * 1e3:.1f} ms, "
+            f"schur solve {schur_time * 1e3:.2f} ms, full solve {dense_time * 1e3:.2f} ms, "
+            f"max step difference {difference:.2e}"
+        )
+        P, Q, tic, qic, inv_dep = retract_window(P, Q, tic, qic, inv_dep, delta_x, delta_l)
+
+    state_dim = POSE_DIM * (num_poses + 1)
+    print(
+        f"reduced system {state_dim}x{state_dim} instead of "
+        f"{state_dim + num_features}x{state_dim + num_features}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_features", type=int, default=300, help="features in the window")
+    parser.add_argument("--num_poses", type=int, default=10, help="frames in the window")
+    parser.add_argument("--track_length", type=int, default=5, help="frames observing a feature")
+    args = parser.parse_args()
+
+    benchmark_landmark_schur(args.num_features, args.num_poses, args.track_length)
@@ -0,0 +1,344 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+
+from landmark_schur import quat_multiply
+from landmark_schur import quat_to_matrix
+from landmark_schur import random_tracks
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+from projection_batch import generate_projection_batch_code
+from projection_batch import projection_gnc_factor_batch
+from vins import extrinsic_prior_error
+from vins import imu_diagonal_whitening
+from vins import imu_whitened_residual_codegen
+from vins import keyframe_prior_error
+
+# 滑窗状态的顺序: 每个关键帧[P, Q, V, Ba, Bg]共15维, 最后是外参[tic, qic]6维
+KEYFRAME_DIM = 15
+EXTRINSIC_DIM = 6
+IMU_LINEARIZATION_ARGS = ["Pi", "Qi", "Vi", "Bai", "Bgi", "Pj", "Qj", "Vj", "Baj", "Bgj"]
+
+# 和VINS-Mono一样, 小于这个值的特征值当作0
+EIGENVALUE_EPSILON = 1e-8
+
+
+@dataclass
+class MarginalizationPrior:
+    """
+    Linear prior r0 + A * dx left after marginalizing the oldest keyframe. It covers the first
+    num_keyframes - 1 keyframes of the window and the extrinsics, and dx is the tangent space error
+    of those states with respect to the linearization point.
+    """
+
+    linearized_jacobian: np.ndarray
+    linearized_residual: np.ndarray
+    P0: np.ndarray
+    Q0: np.ndarray
+    V0: np.ndarray
+    Ba0: np.ndarray
+    Bg0: np.ndarray
+    tic0: np.ndarray
+    qic0: np.ndarray
+
+    def linearize(
+        self,
+        keyframe_error: T.Callable,
+        extrinsic_error: T.Callable,
+        P: np.ndarray,
+        Q: np.ndarray,
+        V: np.ndarray,
+        Ba: np.ndarray,
+        Bg: np.ndarray,
+        tic: np.ndarray,
+        qic: np.ndarray,
+    ) -> T.Tuple[np.ndarray, np.ndarray]:
+        """
+        Residual and jacobian of the prior at the given states of the keyframes it covers.
+        """
+        num_keyframes = self.P0.shape[0]
+        dx_keyframes, J_keyframes = keyframe_error(
+            P, Q, V, Ba, Bg, self.P0, self.Q0, self.V0, self.Ba0, self.Bg0
+        )
+        dx_extrinsic, J_extrinsic = extrinsic_error(tic, qic, self.tic0, self.qic0)
+        dx = np.concatenate([dx_keyframes.ravel(), dx_extrinsic.ravel()])
+
+        residual = self.linearized_residual + self.linearized_jacobian @ dx
+        # jacobian = A * blockdiag(d(dx)/dx), 按块相乘
+        A_keyframes = self.linearized_jacobian[:, : KEYFRAME_DIM * num_keyframes]
+        A_keyframes = A_keyframes.reshape(-1, num_keyframes, KEYFRAME_DIM)
+        jacobian = np.concatenate(
+            [
+                np.einsum("rki,kij->rkj", A_keyframes, J_keyframes).reshape(-1, KEYFRAME_DIM * num_keyframes),
+                self.linearized_jacobian[:, KEYFRAME_DIM * num_keyframes :] @ J_extrinsic[0],
+            ],
+            axis=1,
+        )
+        return residual, jacobian
+
+
+def generate_prior_error_batch_code(output_dir: T.Openable) -> T.Tuple[T.Callable, T.Callable]:
+    errors = []
+    for func, which_args in (
+        (keyframe_prior_error, ["P", "Q", "V", "Ba", "Bg"]),
+        (extrinsic_prior_error, ["tic", "qic"]),
+    ):
+        prior_codegen_with_jacobians = codegen.Codegen.function(
+            func=func,
+            config=codegen.PythonConfig(),
+        ).with_linearization(
+            which_args=which_args,
+            name=f"{func.__name__}_with_jacobian",
+            linearization_mode=codegen.LinearizationMode.STACKED_JACOBIAN,
+        )
+        errors.append(
+            load_numpy_batch_function(
+                generate_numpy_batch_function(prior_codegen_with_jacobians, output_dir)
+            )
+        )
+    return errors[0], errors[1]
+
+
+def window_state_indices(
+    idx_i: np.ndarray, idx_j: np.ndarray, num_keyframes: int
+) -> np.ndarray:
+    """
+    (N, 18) indices into the window state of the Pi, Qi, Pj, Qj, tic, qic columns of each
+    projection_gnc_factor linearization.
+    """
+    pose = np.arange(6)
+    extrinsic = KEYFRAME_DIM * num_keyframes + pose
+    return np.concatenate(
+        [
+            KEYFRAME_DIM * idx_i[:, None] + pose,
+            KEYFRAME_DIM * idx_j[:, None] + pose,
+            np.broadcast_to(extrinsic, (idx_i.shape[0], EXTRINSIC_DIM)),
+        ],
+        axis=1,
+    )
+
+
+def prior_state_indices(num_keyframes: int) -> np.ndarray:
+    # 先验覆盖窗口中前num_keyframes - 1个关键帧和外参
+    return np.concatenate(
+        [
+            np.arange(KEYFRAME_DIM * (num_keyframes - 1)),
+            KEYFRAME_DIM * num_keyframes + np.arange(EXTRINSIC_DIM),
+        ]
+    )
+
+
+def pseudo_inverse(H: np.ndarray) -> np.ndarray:
+    eigenvalues, eigenvectors = np.linalg.eigh(0.5 * (H + H.T))
+    inverse_eigenvalues = np.where(
+        eigenvalues > EIGENVALUE_EPSILON, 1.0 / np.maximum(eigenvalues, EIGENVALUE_EPSILON), 0.0
+    )
+    return (eigenvectors * inverse_eigenvalues) @ eigenvectors.T
+
+
+def marginalize_oldest_keyframe(
+    num_keyframes: int,
+    imu_residual: np.ndarray,
+    imu_jacobian: np.ndarray,
+    projection_hessian: np.ndarray,
+    projection_rhs: np.ndarray,
+    idx_i: np.ndarray,
+    idx_j: np.ndarray,
+    feature_idx: np.ndarray,
+    P: np.ndarray,
+    Q: np.ndarray,
+    V: np.ndarray,
+    Ba: np.ndarray,
+    Bg: np.ndarray,
+    tic: np.ndarray,
+    qic: np.ndarray,
+    prior: T.Optional[T.Tuple[np.ndarray, np.ndarray]] = None,
+) -> MarginalizationPrior:
+    """
+    Marginalize keyframe 0 of the window and the inverse depths of the features it hosts.
+
+    Args:
+        imu_residual, imu_jacobian: linearization of the imu_factor between keyframes 0 and 1
+        projection_hessian, projection_rhs: linearizations of the projection_gnc_factor
+            observations of the features hosted in keyframe 0 (idx_i == 0)
+        feature_idx: feature of each of those observations
+        P, Q, V, Ba, Bg, tic, qic: current states of the whole window
+        prior: residual and jacobian of the previous prior at the current states, if any
+
+    Returns:
+        the prior on keyframes 1..num_keyframes-1 and the extrinsics, which become keyframes
+        0..num_keyframes-2 once the window slides
+    """
+    assert np.all(idx_i == 0), "only the observations hosted in the oldest keyframe are marginalized"
+    window_dim = KEYFRAME_DIM * num_keyframes + EXTRINSIC_DIM
+    H = np.zeros((window_dim, window_dim))
+    b = np.zeros(window_dim)
+
+    # imu因子: 关键帧0和1
+    imu_indices = np.arange(2 * KEYFRAME_DIM)
+    H[np.ix_(imu_indices, imu_indices)] += imu_jacobian.T @ imu_jacobian
+    b[imu_indices] += imu_jacobian.T @ imu_residual
+
+    # 上一次边缘化得到的先验
+    if prior is not None:
+        prior_residual, prior_jacobian = prior
+        prior_indices = prior_state_indices(num_keyframes)
+        H[np.ix_(prior_indices, prior_indices)] += prior_jacobian.T @ prior_jacobian
+        b[prior_indices] += prior_jacobian.T @ prior_residual
+
+    # 重投影因子, 逆深度每个特征点1维, 先用Schur补消去
+    features, local_feature_idx = np.unique(feature_idx, return_inverse=True)
+    hessian = np.tril(projection_hessian) + np.swapaxes(np.tril(projection_hessian, -1), 1, 2)
+    indices = window_state_indices(idx_i, idx_j, num_keyframes)
+    np.add.at(H, (indices[:, :, None], indices[:, None, :]), hessian[:, :18, :18])
+    np.add.at(b, indices, projection_rhs[:, :18])
+    H_xl = np.zeros((window_dim, features.shape[0]))
+    np.add.at(H_xl, (indices, local_feature_idx[:, None]), hessian[:, :18, 18])
+    H_ll = np.zeros(features.shape[0])
+    np.add.at(H_ll, local_feature_idx, hessian[:, 18, 18])
+    b_l = np.zeros(features.shape[0])
+    np.add.at(b_l, local_feature_idx, projection_rhs[:, 18])
+
+    H_xl_inv_ll = H_xl / np.where(H_ll > EIGENVALUE_EPSILON, H_ll, np.inf)
+    H -= H_xl_inv_ll @ H_xl.T
+    b -= H_xl_inv_ll @ b_l
+
+    # 再消去最老的关键帧
+    m = np.arange(KEYFRAME_DIM)
+    r = np.arange(KEYFRAME_DIM, window_dim)
+    H_mm_inv = pseudo_inverse(H[np.ix_(m, m)])
+    H_rm = H[np.ix_(r, m)]
+    H_prior = H[np.ix_(r, r)] - H_rm @ H_mm_inv @ H_rm.T
+    b_prior = b[r] - H_rm @ H_mm_inv @ b[m]
+
+    # 分解成 H_prior = A^T * A, b_prior = A^T * r0
+    eigenvalues, eigenvectors = np.linalg.eigh(0.5 * (H_prior + H_prior.T))
+    valid = eigenvalues > EIGENVALUE_EPSILON
+    sqrt_eigenvalues = np.where(valid, np.sqrt(np.maximum(eigenvalues, 0.0)), 0.0)
+    inv_sqrt_eigenvalues = np.where(valid, 1.0 / np.maximum(sqrt_eigenvalues, EIGENVALUE_EPSILON), 0.0)
+
+    return MarginalizationPrior(
+        linearized_jacobian=sqrt_eigenvalues[:, None] * eigenvectors.T,
+        linearized_residual=inv_sqrt_eigenvalues * (eigenvectors.T @ b_prior),
+        P0=P[1:].copy(),
+        Q0=Q[1:].copy(),
+        V0=V[1:].copy(),
+        Ba0=Ba[1:].copy(),
+        Bg0=Bg[1:].copy(),
+        tic0=tic.copy(),
+        qic0=qic.copy(),
+    )
+
+
+def benchmark_marginalization(
+    num_keyframes: int, num_steps: int, features_per_keyframe: int, track_length: int
+) -> None:
+    """
+    Slide a window along a synthetic trajectory, marginalizing the oldest keyframe at each step.
+    """
+    gen_dir = tempfile.mkdtemp(prefix="marginalization_")
+    keyframe_error, extrinsic_error = generate_prior_error_batch_code(gen_dir)
+    projection_factor = load_numpy_batch_function(generate_projection_batch_code(gen_dir))
+    imu_factor = load_numpy_batch_function(
+        generate_numpy_batch_function(
+            imu_whitened_residual_codegen(
+                imu_diagonal_whitening, codegen.PythonConfig(), "imu_diagonal_residual"
+            ).with_linearization(which_args=IMU_LINEARIZATION_ARGS),
+            gen_dir,
+        )
+    )
+
+    total_keyframes = num_steps + num_keyframes
+    data = random_tracks(features_per_keyframe * total_keyframes, total_keyframes, track_length)
+    host = data["idx_i"]
+    rng = np.random.default_rng(2)
+    P, Q, tic, qic = data["P"], data["Q"], data["tic"], data["qic"]
+    V = rng.normal(scale=0.5, size=(total_keyframes, 3))
+    Ba = np.zeros((total_keyframes, 3))
+    Bg = np.zeros((total_keyframes, 3))
+    G = np.array([0.0, 0.0, 9.81])
+    sum_dt = 0.1
+
+    prior = None
+    for step in range(num_steps):
+        window = slice(step, step + num_keyframes)
+        states = (P[window], Q[window], V[window], Ba[window], Bg[window])
+        start = time.perf_counter()
+
+        # 用真值构造预积分量, 只关心线性化和边缘化的耗时
+        R_i_inv = quat_to_matrix(Q[step]).T
+        delta_q = quat_multiply(Q[step] * np.array([-1.0, -1.0, -1.0, 1.0]), Q[step + 1])
+        imu_residual, imu_jacobian, _, _ = imu_factor(
+            P[step], Q[step], V[step], Ba[step], Bg[step],
+            P[step + 1], Q[step + 1], V[step + 1], Ba[step + 1], Bg[step + 1],
+            R_i_inv @ (0.5 * G * sum_dt**2 + P[step + 1] - P[step] - V[step] * sum_dt),
+            delta_q,
+            R_i_inv @ (G * sum_dt + V[step + 1] - V[step]),
+            G, sum_dt, *[np.zeros((3, 3))] * 5, Ba[step], Bg[step], np.full(15, 10.0),
+        )
+
+        hosted = host == step
+        _, _, projection_hessian, projection_rhs = projection_gnc_factor_batch(
+            projection_factor,
+            data["pts_i"][hosted],
+            data["pts_j"][hosted],
+            data["inv_dep"][data["feature_idx"][hosted]],
+            data["idx_i"][hosted] - step,
+            data["idx_j"][hosted] - step,
+            states[0],
+            states[1],
+            tic,
+            qic,
+            weight=1.0,
+            gnc_mu=0.0,
+            gnc_scale=1.0,
+            epsilon=sf.numeric_epsilon,
+        )
+
+        prior_linearization = None
+        if prior is not None:
+            prior_linearization = prior.linearize(
+                keyframe_error, extrinsic_error, *(x[:-1] for x in states), tic, qic
+            )
+
+        prior = marginalize_oldest_keyframe(
+            num_keyframes,
+            imu_residual[0],
+            imu_jacobian[0],
+            projection_hessian,
+            projection_rhs,
+            data["idx_i"][hosted] - step,
+            data["idx_j"][hosted] - step,
+            data["feature_idx"][hosted],
+            *states,
+            tic,
+            qic,
+            prior=prior_linearization,
+        )
+        elapsed = time.perf_counter() - start
+        print(
+            f"step {step:3d}: {np.count_nonzero(hosted):4d} observations marginalized, "
+            f"prior dim {prior.linearized_residual.shape[0]}, {elapsed * 1e3:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_keyframes", type=int, default=10, help="keyframes in the window")
+    parser.add_argument("--num_steps", type=int, default=30, help="number of marginalizations")
+    parser.add_argument("--features_per_keyframe", type=int, default=30, help="features hosted per keyframe")
+    parser.add_argument("--track_length", type=int, default=5, help="frames observing a feature")
+    args = parser.parse_args()
+
+    benchmark_marginalization(
+        args.num_keyframes, args.num_steps, args.features_per_keyframe, args.track_length
+    )
@@ -0,0 +1,197 @@
+import importlib.util
+import itertools
+from dataclasses import dataclass
+from pathlib import Path
+
+import sympy
+from sympy.printing.numpy import NumPyPrinter
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import ops
+from symforce import typing as T
+from symforce.values import Values
+
+# 把symforce的符号函数生成为批量(向量化)的NumPy函数:
+# 每个输入的第0维是批量维度N, 所有中间变量都是长度为N的数组, 一次调用完成N次计算.
+# 不需要批量的输入(比如epsilon、外参)直接传单个值即可, 会自动广播.
+
+
+class NumpyBatchPrinter(NumPyPrinter):
+    """
+    NumPy printer for the symforce specific functions, so that every generated line is an
+    elementwise numpy expression over the batch dimension.
+    """
+
+    def __init__(self) -> None:
+        super().__init__({"fully_qualified_modules": True, "strict": True})
+
+    @staticmethod
+    def _print_Rational(expr: sympy.Rational) -> str:
+        return f"{expr.p}./{expr.q}."
+
+    def _print_Max(self, expr: sympy.Max) -> str:
+        if len(expr.args) == 1:
+            return self._print(expr.args[0])
+        return f"numpy.maximum({self._print(expr.args[0])}, {self._print(sympy.Max(*expr.args[1:]))})"
+
+    def _print_Min(self, expr: sympy.Min) -> str:
+        if len(expr.args) == 1:
+            return self._print(expr.args[0])
+        return f"numpy.minimum({self._print(expr.args[0])}, {self._print(sympy.Min(*expr.args[1:]))})"
+
+    def _print_SignNoZero(self, expr: sympy.Expr) -> str:
+        return f"numpy.copysign(1.0, {self._print(expr.args[0])})"
+
+    def _print_CopysignNoZero(self, expr: sympy.Expr) -> str:
+        return f"numpy.copysign({self._print(expr.args[0])}, {self._print(expr.args[1])})"
+
+
+@dataclass
+class NumpyBatchMetadata:
+    name: str
+    generated_file: Path
+    input_dims: T.Dict[str, int]
+    output_shapes: T.Dict[str, T.Tuple[int, ...]]
+    total_ops: int
+
+
+def output_shape(value: T.Any) -> T.Tuple[int, ...]:
+    """
+    Shape of one output per batch element: (rows,) for column vectors, (rows, cols) for
+    matrices, () for scalars and (storage_dim,) for geometry types.
+    """
+    if isinstance(value, sf.Matrix):
+        if value.cols == 1:
+            return (value.rows,)
+        return (value.rows, value.cols)
+    storage_dim = ops.StorageOps.storage_dim(value)
+    if storage_dim == 1:
+        return ()
+    return (storage_dim,)
+
+
+def generate_numpy_batch_function(
+    func_codegen: codegen.Codegen,
+    output_dir: T.Openable,
+    name: T.Optional[str] = None,
+    dtype: str = "float64",
+) -> NumpyBatchMetadata:
+    """
+    Generate a vectorized numpy version of func_codegen into output_dir/numpy/<name>.py.
+
+    Args:
+        func_codegen: Codegen object, e.g. from Codegen.function(...).with_linearization(...)
+        output_dir: root of the generated code, same as for generate_function
+        name: function name, defaults to func_codegen.name
+        dtype: numpy dtype used for the inputs and the outputs
+    """
+    name = name or func_codegen.name
+    assert name is not None and name.isidentifier()
+
+    inputs: Values = func_codegen.inputs
+    outputs: Values = func_codegen.outputs
+
+    # 输入: 每个参数reshape成(N, storage_dim), 符号替换成对应的列
+    input_dims = {}
+    input_subs = {}
+    for key, value in inputs.items():
+        storage = ops.StorageOps.to_storage(value)
+        input_dims[key] = len(storage)
+        for i, symbol in enumerate(storage):
+            input_subs[symbol] = sf.Symbol(f"_{key}[:, {i}]")
+
+    output_shapes = {key: output_shape(value) for key, value in outputs.items()}
+    output_exprs = [ops.StorageOps.to_storage(value) for value in outputs.values()]
+    flat_output_exprs = [expr for storage in output_exprs for expr in storage]
+
+    def tmp_symbols() -> T.Iterable[sf.Symbol]:
+        for i in itertools.count():
+            yield sf.Symbol(f"_tmp{i}")
+
+    temps, flat_simplified_outputs = sf.cse(flat_output_exprs, symbols=tmp_symbols())
+
+    temps = [(lhs, sympy.S(sf.S(rhs).subs(input_subs))) for lhs, rhs in temps]
+    flat_simplified_outputs = [
+        sympy.S(sf.S(expr).subs(input_subs)) for expr in flat_simplified_outputs
+    ]
+    total_ops = sum(sympy.count_ops(rhs) for _, rhs in temps) + sum(
+        sympy.count_ops(expr) for expr in flat_simplified_outputs
+    )
+
+    printer = NumpyBatchPrinter()
+
+    lines = [
+        "# --------------------------------------------------",
+        "# This file was autogenerated, do NOT modify by hand",
+        "# --------------------------------------------------",
+        "",
+        "# ruff: noqa",
+        "",
+        "import numpy",
+        "",
+        "",
+        f"def {name}({', '.join(inputs.keys())}):",
+        '    """',
+        f"    Vectorized numpy version of {func_codegen.name}. Every input is either batched with a",
+        "    leading dimension N or a single value shared by the whole batch.",
+        "",
+        "    Outputs:",
+    ]
+    for key, shape in output_shapes.items():
+        lines.append(f"        {key}: ({', '.join(['N'] + [str(dim) for dim in shape])})")
+    lines += [
+        '    """',
+        "",
+        f"    # Total ops: {total_ops}",
+        "",
+        "    # Input arrays",
+    ]
+    for key, dim in input_dims.items():
+        lines.append(f"    _{key} = numpy.asarray({key}, dtype=numpy.{dtype}).reshape(-1, {dim})")
+    lines.append(f"    _n = max({', '.join(f'_{key}.shape[0]' for key in input_dims)})")
+    lines += ["", "    # Intermediate terms"]
+    for lhs, rhs in temps:
+        lines.append(f"    {lhs} = {printer.doprint(rhs)}")
+
+    lines += ["", "    # Output terms"]
+    flat_i = 0
+    for (key, shape), storage in zip(output_shapes.items(), output_exprs):
+        batch_shape = ", ".join(["_n"] + [str(dim) for dim in shape])
+        lines.append(f"    _{key} = numpy.zeros(({batch_shape}), dtype=numpy.{dtype})")
+        for i in range(len(storage)):
+            expr = flat_simplified_outputs[flat_i + i]
+            if expr == 0:
+                continue
+            if len(shape) == 2:
+                # storage of a matrix is column major
+                index = f"{i % shape[0]}, {i // shape[0]}"
+                lines.append(f"    _{key}[:, {index}] = {printer.doprint(expr)}")
+            elif len(shape) == 1:
+                lines.append(f"    _{key}[:, {i}] = {printer.doprint(expr)}")
+            else:
+                lines.append(f"    _{key}[:] = {printer.doprint(expr)}")
+        flat_i += len(storage)
+
+    returns = ", ".join(f"_{key}" for key in output_shapes)
+    lines += ["", f"    return {returns}", ""]
+
+    generated_file = Path(output_dir) / "numpy" / f"{name}.py"
+    generated_file.parent.mkdir(parents=True, exist_ok=True)
+    generated_file.write_text("\n".join(lines))
+
+    return NumpyBatchMetadata(
+        name=name,
+        generated_file=generated_file,
+        input_dims=input_dims,
+        output_shapes=output_shapes,
+        total_ops=total_ops,
+    )
+
+
+def load_numpy_batch_function(metadata: NumpyBatchMetadata) -> T.Callable:
+    spec = importlib.util.spec_from_file_location(metadata.name, metadata.generated_file)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, metadata.name)
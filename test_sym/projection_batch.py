@@ -0,0 +1,185 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import sym
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+from symforce.codegen import codegen_util
+
+from numpy_codegen import NumpyBatchMetadata
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+from vins import output_dir
+from vins import projection_gnc_residual
+
+PROJECTION_LINEARIZATION_ARGS = ["Pi", "Qi", "Pj", "Qj", "tic", "qic", "inv_dep_i"]
+
+
+# 批量计算projection_gnc_residual及其线性化(res, jacobian, hessian, rhs)
+def generate_projection_batch_code(
+    output_dir: T.Openable,
+    which_args: T.Sequence[str] = PROJECTION_LINEARIZATION_ARGS,
+    name: str = "projection_gnc_factor_batch",
+) -> NumpyBatchMetadata:
+    projection_codegen = codegen.Codegen.function(
+        func=projection_gnc_residual,
+        config=codegen.PythonConfig(),
+    )
+    projection_codegen_with_linearization = projection_codegen.with_linearization(
+        which_args=list(which_args)
+    )
+    return generate_numpy_batch_function(
+        projection_codegen_with_linearization, output_dir, name=name
+    )
+
+
+def projection_gnc_factor_batch(
+    factor: T.Callable,
+    pts_i: np.ndarray,
+    pts_j: np.ndarray,
+    inv_dep_i: np.ndarray,
+    idx_i: np.ndarray,
+    idx_j: np.ndarray,
+    P: np.ndarray,
+    Q: np.ndarray,
+    tic: np.ndarray,
+    qic: np.ndarray,
+    weight: T.Union[float, np.ndarray],
+    gnc_mu: float,
+    gnc_scale: float,
+    epsilon: float = sf.numeric_epsilon,
+) -> T.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Linearize N observations in one call.
+
+    Args:
+        factor: the function loaded from generate_projection_batch_code
+        pts_i, pts_j: (N, 3) normalized points in the host / target frame
+        inv_dep_i: (N,) inverse depth of the host feature
+        idx_i, idx_j: (N,) index of the host / target frame of each observation
+        P: (K, 3) positions of the window, Q: (K, 4) rotations as [x, y, z, w]
+        tic, qic: camera extrinsics, shared by all observations
+
+    Returns:
+        res (N, 2), jacobian (N, 2, D), hessian (N, D, D), rhs (N, D), with D = 19 when
+        linearized with respect to PROJECTION_LINEARIZATION_ARGS
+    """
+    # 按观测的位姿索引取出Pi/Qi/Pj/Qj, 然后一次算完所有观测
+    return factor(
+        pts_i,
+        pts_j,
+        P[idx_i],
+        Q[idx_i],
+        P[idx_j],
+        Q[idx_j],
+        tic,
+        qic,
+        inv_dep_i,
+        weight,
+        gnc_mu,
+        gnc_scale,
+        epsilon,
+    )
+
+
+def random_window(num_obs: int, num_poses: int, seed: int = 0) -> T.Dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    Q = rng.normal(size=(num_poses, 4))
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True)
+    qic = rng.normal(size=4)
+    qic /= np.linalg.norm(qic)
+    idx_i = rng.integers(0, num_poses, size=num_obs)
+    return dict(
+        pts_i=np.column_stack([rng.uniform(-0.5, 0.5, size=(num_obs, 2)), np.ones(num_obs)]),
+        pts_j=np.column_stack([rng.uniform(-0.5, 0.5, size=(num_obs, 2)), np.ones(num_obs)]),
+        inv_dep_i=rng.uniform(0.1, 1.0, size=num_obs),
+        idx_i=idx_i,
+        idx_j=(idx_i + rng.integers(1, num_poses, size=num_obs)) % num_poses,
+        P=rng.normal(size=(num_poses, 3)),
+        Q=Q,
+        tic=rng.normal(scale=0.1, size=3),
+        qic=qic,
+    )
+
+
+def benchmark_projection_batch(num_obs: int, num_poses: int = 10) -> None:
+    """
+    Compare the batched numpy factor against calling the generated python factor once per
+    observation.
+    """
+    gen_dir = tempfile.mkdtemp(prefix="projection_batch_")
+    batch_factor = load_numpy_batch_function(generate_projection_batch_code(gen_dir))
+
+    projection_codegen = codegen.Codegen.function(
+        func=projection_gnc_residual,
+        config=codegen.PythonConfig(),
+    ).with_linearization(which_args=PROJECTION_LINEARIZATION_ARGS)
+    metadata = projection_codegen.generate_function(output_dir=gen_dir)
+    scalar_factor = codegen_util.load_generated_function(
+        projection_codegen.name, metadata.function_dir
+    )
+
+    data = random_window(num_obs, num_poses)
+    weight, gnc_mu, gnc_scale, epsilon = 1.0, 0.5, 1.0, sf.numeric_epsilon
+
+    start = time.perf_counter()
+    batch_outputs = projection_gnc_factor_batch(
+        batch_factor, **data, weight=weight, gnc_mu=gnc_mu, gnc_scale=gnc_scale, epsilon=epsilon
+    )
+    batch_time = time.perf_counter() - start
+
+    rotations = [sym.Rot3.from_storage(q) for q in data["Q"]]
+    qic = sym.Rot3.from_storage(data["qic"])
+    start = time.perf_counter()
+    loop_outputs = []
+    for k in range(num_obs):
+        i, j = data["idx_i"][k], data["idx_j"][k]
+        loop_outputs.append(
+            scalar_factor(
+                data["pts_i"][k],
+                data["pts_j"][k],
+                data["P"][i],
+                rotations[i],
+                data["P"][j],
+                rotations[j],
+                data["tic"],
+                qic,
+                data["inv_dep_i"][k],
+                weight,
+                gnc_mu,
+                gnc_scale,
+                epsilon,
+            )
+        )
+    loop_time = time.perf_counter() - start
+
+    # hessian只计算了下三角, 两边的输出格式一致, 直接比较
+    max_error = 0.0
+    for n, batch_output in enumerate(batch_outputs):
+        loop_output = np.stack([np.reshape(outputs[n], batch_output.shape[1:]) for outputs in loop_outputs])
+        relative_error = np.abs(batch_output - loop_output) / np.maximum(np.abs(loop_output), 1.0)
+        max_error = max(max_error, float(np.max(relative_error)))
+
+    print(f"observations: {num_obs}")
+    print(f"  per-observation loop: {loop_time * 1e3:9.2f} ms ({loop_time / num_obs * 1e6:.2f} us/obs)")
+    print(f"  numpy batch:          {batch_time * 1e3:9.2f} ms ({batch_time / num_obs * 1e6:.2f} us/obs)")
+    print(f"  speedup: {loop_time / batch_time:.1f}x, max relative error: {max_error:.3e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_obs", type=int, default=20000, help="number of observations")
+    parser.add_argument("--num_poses", type=int, default=10, help="number of frames in the window")
+    parser.add_argument("--benchmark", action="store_true", help="compare against a per-observation loop")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_projection_batch(args.num_obs, args.num_poses)
+    else:
+        generate_projection_batch_code(output_dir)
@@ -0,0 +1,155 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import sym
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+from symforce.codegen import codegen_util
+
+from imu_residual_variants import GeneratedSize
+from imu_residual_variants import generated_size
+from imu_residual_variants import print_sizes
+from projection_batch import PROJECTION_LINEARIZATION_ARGS
+from vins import projection_gnc_multi_codegen
+from vins import projection_gnc_multi_factor_codegen
+from vins import projection_gnc_residual
+from vins import projection_multi_linearization_args
+
+LINEARIZATION_MODES = {
+    "hessian": codegen.LinearizationMode.FULL_LINEARIZATION,
+    "jacobian": codegen.LinearizationMode.STACKED_JACOBIAN,
+}
+
+
+# 比较一个多观测因子和num_targets个独立的projection因子的op数
+def generate_projection_multi_sizes(
+    output_dir: T.Openable, num_targets_list: T.Sequence[int], mode: str
+) -> T.List[GeneratedSize]:
+    sizes = []
+
+    start = time.perf_counter()
+    single_codegen = codegen.Codegen.function(
+        func=projection_gnc_residual, config=codegen.CppConfig()
+    ).with_linearization(
+        which_args=PROJECTION_LINEARIZATION_ARGS,
+        name=f"projection_gnc_{mode}",
+        linearization_mode=LINEARIZATION_MODES[mode],
+    )
+    metadata = single_codegen.generate_function(output_dir=output_dir)
+    single = generated_size(single_codegen.name, metadata.generated_files[0], time.perf_counter() - start)
+    sizes.append(single)
+
+    for num_targets in num_targets_list:
+        # 直接对堆叠的残差求导
+        start = time.perf_counter()
+        multi_codegen = projection_gnc_multi_codegen(num_targets, codegen.CppConfig()).with_linearization(
+            which_args=projection_multi_linearization_args(num_targets),
+            name=f"projection_gnc_multi{num_targets}_{mode}_autodiff",
+            linearization_mode=LINEARIZATION_MODES[mode],
+        )
+        metadata = multi_codegen.generate_function(output_dir=output_dir)
+        sizes.append(generated_size(multi_codegen.name, metadata.generated_files[0], time.perf_counter() - start))
+
+        # pts_w的jacobian只算一次
+        start = time.perf_counter()
+        multi_factor_codegen = projection_gnc_multi_factor_codegen(
+            num_targets, codegen.CppConfig(), LINEARIZATION_MODES[mode]
+        )
+        metadata = multi_factor_codegen.generate_function(output_dir=output_dir)
+        sizes.append(
+            generated_size(multi_factor_codegen.name, metadata.generated_files[0], time.perf_counter() - start)
+        )
+
+        sizes.append(
+            GeneratedSize(
+                name=f"  {num_targets} x {single_codegen.name}",
+                total_ops=num_targets * single.total_ops,
+                lines=num_targets * single.lines,
+                bytes=num_targets * single.bytes,
+                seconds=single.seconds,
+            )
+        )
+    return sizes
+
+
+def check_projection_multi(num_targets: int, seed: int = 0) -> float:
+    """
+    Max relative difference between the multi-observation factor and the single factors it
+    replaces: stacked residuals, and hessian / rhs accumulated into the shared state layout.
+    """
+    gen_dir = tempfile.mkdtemp(prefix="projection_multi_")
+    multi_codegen = projection_gnc_multi_factor_codegen(num_targets, codegen.PythonConfig())
+    multi_factor = codegen_util.load_generated_function(
+        multi_codegen.name, multi_codegen.generate_function(output_dir=gen_dir).function_dir
+    )
+    single_codegen = codegen.Codegen.function(
+        func=projection_gnc_residual, config=codegen.PythonConfig()
+    ).with_linearization(which_args=PROJECTION_LINEARIZATION_ARGS)
+    single_factor = codegen_util.load_generated_function(
+        single_codegen.name, single_codegen.generate_function(output_dir=gen_dir).function_dir
+    )
+
+    rng = np.random.default_rng(seed)
+
+    def random_rot() -> sym.Rot3:
+        return sym.Rot3.from_tangent(rng.normal(scale=0.1, size=3))
+
+    pts_i = np.array([*rng.uniform(-0.4, 0.4, size=2), 1.0])
+    pts_j = [np.array([*rng.uniform(-0.4, 0.4, size=2), 1.0]) for _ in range(num_targets)]
+    Pi, Qi = rng.normal(size=3), random_rot()
+    Pj = [Pi + rng.normal(scale=0.3, size=3) for _ in range(num_targets)]
+    Qj = [random_rot() for _ in range(num_targets)]
+    tic, qic = np.array([0.05, 0.0, 0.0]), sym.Rot3()
+    inv_dep_i, weight, gnc_mu, gnc_scale, epsilon = 0.3, 1.0, 0.5, 1.0, sf.numeric_epsilon
+
+    targets = [x for k in range(num_targets) for x in (Pj[k], Qj[k])]
+    res, _, hessian, rhs = multi_factor(
+        pts_i, *pts_j, Pi, Qi, *targets, tic, qic, inv_dep_i, weight, gnc_mu, gnc_scale, epsilon
+    )
+
+    # 多观测因子的状态顺序: [Pi, Qi, Pj0, Qj0, .., tic, qic, inv_dep_i]
+    dim = 6 * (num_targets + 2) + 1
+    expected_res = []
+    expected_hessian = np.zeros((dim, dim))
+    expected_rhs = np.zeros(dim)
+    for k in range(num_targets):
+        single_res, _, single_hessian, single_rhs = single_factor(
+            pts_i, pts_j[k], Pi, Qi, Pj[k], Qj[k], tic, qic, inv_dep_i, weight, gnc_mu, gnc_scale, epsilon
+        )
+        indices = np.concatenate(
+            [np.arange(6), 6 * (k + 1) + np.arange(6), dim - 7 + np.arange(7)]
+        )
+        expected_res.append(single_res)
+        expected_hessian[np.ix_(indices, indices)] += single_hessian
+        expected_rhs[indices] += single_rhs
+
+    # hessian只有下三角
+    expected_hessian = np.tril(expected_hessian + np.triu(expected_hessian, 1).T)
+    errors = [
+        (np.ravel(res), np.concatenate(expected_res)),
+        (np.tril(hessian), expected_hessian),
+        (np.ravel(rhs), expected_rhs),
+    ]
+    return max(
+        float(np.max(np.abs(actual - expected) / np.maximum(np.abs(expected), 1.0)))
+        for actual, expected in errors
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_targets", type=int, nargs="+", default=[1, 3, 7], help="observations per factor")
+    parser.add_argument("--mode", choices=list(LINEARIZATION_MODES), default="hessian", help="linearization outputs")
+    parser.add_argument("--check", action="store_true", help="compare against the single observation factor")
+    args = parser.parse_args()
+
+    print_sizes(generate_projection_multi_sizes(tempfile.mkdtemp(prefix="projection_multi_"), args.num_targets, args.mode))
+    if args.check:
+        for num_targets in args.num_targets:
+            print(f"{num_targets} targets: max relative error {check_projection_multi(num_targets):.3e}")
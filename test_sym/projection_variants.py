@@ -0,0 +1,220 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import itertools
+import tempfile
+import time
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+
+from imu_residual_variants import GeneratedSize
+from imu_residual_variants import generated_size
+from imu_residual_variants import print_sizes
+from landmark_schur import ProjectionLayout
+from landmark_schur import assemble_schur_system
+from landmark_schur import projection_layout
+from landmark_schur import solve_schur
+from numpy_codegen import load_numpy_batch_function
+from projection_batch import PROJECTION_LINEARIZATION_ARGS
+from projection_batch import generate_projection_batch_code
+from projection_batch import projection_gnc_factor_batch
+from projection_batch import random_window
+from vins import output_dir
+from vins import projection_gnc_residual
+
+# 可以固定的变量组, 固定以后因子不再需要它们的jacobian:
+#   extrinsics: 标定收敛以后外参固定
+#   host: host帧固定, 比如窗口里最老的帧(gauge)或者地图里已经固定的关键帧
+#   landmark: 逆深度固定, 比如只优化位姿的跟踪(motion-only BA)
+PROJECTION_FIXED_GROUPS = {
+    "host": ["Pi", "Qi"],
+    "extrinsics": ["tic", "qic"],
+    "landmark": ["inv_dep_i"],
+}
+
+
+def projection_variant(fixed: T.Collection[str]) -> str:
+    unknown = set(fixed) - set(PROJECTION_FIXED_GROUPS)
+    if unknown:
+        raise ValueError(f"unknown fixed groups {sorted(unknown)}, expected {list(PROJECTION_FIXED_GROUPS)}")
+    groups = [group for group in PROJECTION_FIXED_GROUPS if group in fixed]
+    return "_".join(["fixed"] + groups) if groups else "full"
+
+
+def projection_which_args(fixed: T.Collection[str]) -> T.List[str]:
+    fixed_args = {arg for group in fixed for arg in PROJECTION_FIXED_GROUPS[group]}
+    return [arg for arg in PROJECTION_LINEARIZATION_ARGS if arg not in fixed_args]
+
+
+# 每种固定组合一个变体: 变体名 -> 固定的变量组, 变体名 -> 线性化的变量
+PROJECTION_FIXED_VARIANTS = {
+    projection_variant(fixed): fixed
+    for count in range(len(PROJECTION_FIXED_GROUPS) + 1)
+    for fixed in itertools.combinations(PROJECTION_FIXED_GROUPS, count)
+}
+PROJECTION_WHICH_ARGS_VARIANTS = {
+    variant: projection_which_args(fixed) for variant, fixed in PROJECTION_FIXED_VARIANTS.items()
+}
+
+
+def linearization_columns(which_args: T.Sequence[str], arg: str) -> np.ndarray:
+    """
+    Columns of arg in a projection_gnc_factor linearization with respect to which_args.
+    """
+    sizes = [1 if name == "inv_dep_i" else 3 for name in which_args]
+    index = list(which_args).index(arg)
+    return sum(sizes[:index]) + np.arange(sizes[index])
+
+
+def projection_variant_name(variant: str) -> str:
+    return "projection_gnc_factor" if variant == "full" else f"projection_gnc_{variant}_factor"
+
+
+# 一次生成多个which_args的projection因子, 并统计op数
+def generate_projection_variant_code(
+    output_dir: T.Optional[T.Openable] = None,
+    variants: T.Sequence[str] = tuple(PROJECTION_WHICH_ARGS_VARIANTS),
+) -> T.List[GeneratedSize]:
+    sizes = []
+    for variant in variants:
+        start = time.perf_counter()
+        projection_codegen_with_linearization = codegen.Codegen.function(
+            func=projection_gnc_residual,
+            config=codegen.CppConfig(),
+        ).with_linearization(
+            which_args=PROJECTION_WHICH_ARGS_VARIANTS[variant],
+            name=projection_variant_name(variant),
+        )
+        metadata = projection_codegen_with_linearization.generate_function(
+            output_dir=output_dir, skip_directory_nesting=False
+        )
+        sizes.append(
+            generated_size(
+                projection_codegen_with_linearization.name,
+                metadata.generated_files[0],
+                time.perf_counter() - start,
+            )
+        )
+    return sizes
+
+
+class ProjectionFactorDispatcher:
+    """
+    Picks the projection factor variant for a window from what the window holds constant, e.g.
+    the full factor while the extrinsics are being estimated and fixed_extrinsics afterwards.
+    The numpy batch functions are generated on first use.
+    """
+
+    def __init__(self, output_dir: T.Openable) -> None:
+        self.output_dir = output_dir
+        self.factors: T.Dict[str, T.Callable] = {}
+
+    @staticmethod
+    def select(fixed: T.Collection[str] = ()) -> str:
+        """
+        Args:
+            fixed: the groups of PROJECTION_FIXED_GROUPS held constant in this window
+        """
+        return projection_variant(fixed)
+
+    def factor(self, variant: str) -> T.Callable:
+        if variant not in self.factors:
+            self.factors[variant] = load_numpy_batch_function(
+                generate_projection_batch_code(
+                    self.output_dir,
+                    PROJECTION_WHICH_ARGS_VARIANTS[variant],
+                    name=f"{projection_variant_name(variant)}_batch",
+                )
+            )
+        return self.factors[variant]
+
+    def linearize(
+        self, fixed: T.Collection[str], **kwargs: T.Any
+    ) -> T.Tuple[ProjectionLayout, T.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Linearize a window with the variant that leaves out the fixed groups.
+
+        Args:
+            kwargs: the arguments of projection_batch.projection_gnc_factor_batch, without factor
+
+        Returns:
+            the column layout of the outputs, to pass to landmark_schur.assemble_schur_system, and
+            res, jacobian, hessian, rhs
+        """
+        variant = self.select(fixed)
+        return (
+            projection_layout(PROJECTION_WHICH_ARGS_VARIANTS[variant]),
+            projection_gnc_factor_batch(self.factor(variant), **kwargs),
+        )
+
+
+def benchmark_projection_variants(num_obs: int, num_poses: int = 10, repeats: int = 5) -> None:
+    dispatcher = ProjectionFactorDispatcher(tempfile.mkdtemp(prefix="projection_variants_"))
+    data = random_window(num_obs, num_poses)
+    kwargs = dict(data, weight=1.0, gnc_mu=0.5, gnc_scale=1.0, epsilon=sf.numeric_epsilon)
+    # 每个观测是一个独立的特征点
+    feature_idx = np.arange(num_obs)
+
+    def relative_error(a: np.ndarray, b: np.ndarray) -> float:
+        return float(np.max(np.abs(a - b) / np.maximum(np.abs(b), 1.0)))
+
+    outputs = {}
+    for variant, fixed in PROJECTION_FIXED_VARIANTS.items():
+        dispatcher.linearize(fixed, **kwargs)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            layout, outputs[variant] = dispatcher.linearize(fixed, **kwargs)
+        elapsed = (time.perf_counter() - start) / repeats
+
+        # 变体的列是完整因子的列去掉固定的变量, hessian和rhs的对应部分应该一致
+        which_args = PROJECTION_WHICH_ARGS_VARIANTS[variant]
+        keep = np.concatenate([linearization_columns(PROJECTION_LINEARIZATION_ARGS, arg) for arg in which_args])
+        _, _, full_hessian, full_rhs = outputs["full"]
+        _, _, hessian, rhs = outputs[variant]
+        hessian_error = relative_error(full_hessian[:, keep][:, :, keep], hessian)
+        rhs_error = relative_error(full_rhs[:, keep], rhs)
+        print(
+            f"{variant:<34}{layout.dim:>4} dims{elapsed * 1e3:>10.2f} ms ({elapsed / num_obs * 1e6:.2f} us/obs)"
+            f"  max relative difference to full: hessian {hessian_error:.1e}, rhs {rhs_error:.1e}"
+        )
+
+    # 同一个窗口, 固定外参的变体的Schur解和完整因子在外参也固定时的解一致.
+    # 随机窗口里每个特征点只有一次观测, 系统很病态, 所以比较相对于步长的差
+    fixed_poses = (0, num_poses)
+    full_step = solve_schur(
+        assemble_schur_system(*outputs["full"][2:], data["idx_i"], data["idx_j"], feature_idx, num_poses, num_obs),
+        fixed_poses=fixed_poses,
+    )
+    variant_step = solve_schur(
+        assemble_schur_system(
+            *outputs["fixed_extrinsics"][2:], data["idx_i"], data["idx_j"], feature_idx, num_poses, num_obs,
+            projection_layout(PROJECTION_WHICH_ARGS_VARIANTS["fixed_extrinsics"]),
+        ),
+        fixed_poses=fixed_poses,
+    )
+    step_error = max(np.max(np.abs(a - b)) / np.max(np.abs(a)) for a, b in zip(full_step, variant_step))
+    print(f"schur step, full with extrinsics fixed vs fixed_extrinsics: max relative difference {step_error:.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--variants",
+        nargs="+",
+        choices=list(PROJECTION_WHICH_ARGS_VARIANTS),
+        default=list(PROJECTION_WHICH_ARGS_VARIANTS),
+        help="which_args sets to generate",
+    )
+    parser.add_argument("--benchmark", action="store_true", help="time the numpy batch variants")
+    parser.add_argument("--num_obs", type=int, default=20000, help="number of observations")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print_sizes(generate_projection_variant_code(tempfile.mkdtemp(prefix="projection_variants_"), args.variants))
+        benchmark_projection_variants(args.num_obs)
+    else:
+        print_sizes(generate_projection_variant_code(output_dir, args.variants))
@@ -0,0 +1,245 @@
+import symforce_setup  # noqa: F401
+
+import abc
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+from symforce.codegen import codegen_util
+
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+from vins import output_dir
+
+# 鲁棒核函数, 和Ceres的LossFunction约定一致:
+# 输入s是残差的平方范数, 输出[rho(s), rho'(s), rho''(s)], rho(s) ≈ s (s很小时).
+# IRLS的权重就是rho'(s).
+
+
+class RobustLoss(abc.ABC):
+    @abc.abstractmethod
+    def evaluate(self, s: sf.Scalar) -> sf.V3:
+        pass
+
+
+class CauchyLoss(RobustLoss):
+    """
+    rho(s) = a^2 * log(1 + s / a^2)
+    """
+
+    def __init__(self, a: sf.Scalar) -> None:
+        self.b = a * a
+        self.c = 1 / self.b
+
+    def evaluate(self, s: sf.Scalar) -> sf.V3:
+        sum_s = 1 + s * self.c
+        inv = 1 / sum_s
+        # sum_s和inv都是正的(s >= 0)
+        return sf.V3(self.b * sf.log(sum_s), inv, -self.c * inv * inv)
+
+
+class HuberLoss(RobustLoss):
+    """
+    rho(s) = s for s <= a^2, 2 * a * sqrt(s) - a^2 otherwise
+    """
+
+    def __init__(self, a: sf.Scalar) -> None:
+        self.a = a
+        self.b = a * a
+
+    def evaluate(self, s: sf.Scalar) -> sf.V3:
+        is_outlier = sf.is_positive(s - self.b)
+        # 内点时r不会被用到, 取max保证sqrt和除法的参数不为0
+        r = sf.sqrt(sf.Max(s, self.b))
+        rho1 = self.a / r
+        return sf.V3(
+            is_outlier * (2 * self.a * r - self.b) + (1 - is_outlier) * s,
+            is_outlier * rho1 + (1 - is_outlier),
+            is_outlier * (-rho1 / (2 * sf.Max(s, self.b))),
+        )
+
+
+class TukeyLoss(RobustLoss):
+    """
+    rho(s) = a^2 / 3 * (1 - (1 - s / a^2)^3) for s <= a^2, a^2 / 3 otherwise
+    """
+
+    def __init__(self, a: sf.Scalar) -> None:
+        self.a_squared = a * a
+
+    def evaluate(self, s: sf.Scalar) -> sf.V3:
+        # s > a^2 时value = 0, 三个输出自然就是 a^2 / 3, 0, 0
+        value = sf.Max(1 - s / self.a_squared, 0)
+        value_squared = value * value
+        return sf.V3(
+            self.a_squared / 3 * (1 - value_squared * value),
+            value_squared,
+            -2 / self.a_squared * value,
+        )
+
+
+class BarronLoss(RobustLoss):
+    """
+    General and adaptive loss (Barron 2019), scaled to rho(s) ≈ s:
+    rho(s) = 2 * c^2 * |alpha - 2| / alpha * ((s / (c^2 * |alpha - 2|) + 1)^(alpha / 2) - 1)
+
+    alpha = 2 is L2, 1 pseudo-huber, 0 Cauchy, -2 Geman-McClure. epsilon keeps alpha away from
+    the removable singularities at 0 and 2, in the same way as BarronNoiseModel.
+    """
+
+    def __init__(self, alpha: sf.Scalar, c: sf.Scalar, epsilon: sf.Scalar = sf.epsilon()) -> None:
+        self.alpha = alpha + epsilon * sf.sign_no_zero(alpha)
+        self.c_squared = c * c
+        self.b = sf.Max(sf.Abs(alpha - 2), epsilon)
+
+    def evaluate(self, s: sf.Scalar) -> sf.V3:
+        d = self.c_squared * self.b
+        base = s / d + 1
+        rho1 = base ** (self.alpha / 2 - 1)
+        return sf.V3(
+            2 * d / self.alpha * (base ** (self.alpha / 2) - 1),
+            rho1,
+            (self.alpha / 2 - 1) / d * base ** (self.alpha / 2 - 2),
+        )
+
+
+# 用于代码生成的函数, 一次计算rho, rho', rho''
+def cauchy_loss(s: sf.Scalar, a: sf.Scalar) -> sf.V3:
+    return CauchyLoss(a).evaluate(s)
+
+
+def huber_loss(s: sf.Scalar, a: sf.Scalar) -> sf.V3:
+    return HuberLoss(a).evaluate(s)
+
+
+def tukey_loss(s: sf.Scalar, a: sf.Scalar) -> sf.V3:
+    return TukeyLoss(a).evaluate(s)
+
+
+def barron_loss(s: sf.Scalar, alpha: sf.Scalar, c: sf.Scalar, epsilon: sf.Scalar) -> sf.V3:
+    return BarronLoss(alpha, c, epsilon).evaluate(s)
+
+
+ROBUST_LOSSES = {
+    "cauchy": cauchy_loss,
+    "huber": huber_loss,
+    "tukey": tukey_loss,
+    "barron": barron_loss,
+}
+
+
+def generate_robust_loss_code(
+    output_dir: T.Optional[T.Openable] = None, print_code: bool = False
+) -> None:
+    for func in ROBUST_LOSSES.values():
+        loss_codegen = codegen.Codegen.function(
+            func=func,
+            config=codegen.CppConfig(),
+            output_names=["rho"],
+        )
+        loss_codegen.generate_function(output_dir)
+
+
+class IrlsWeights:
+    """
+    Vectorized robust loss evaluation over all residuals of an iteration, with the numpy batch
+    functions generated on first use.
+    """
+
+    def __init__(self, output_dir: T.Openable) -> None:
+        self.output_dir = output_dir
+        self.functions: T.Dict[str, T.Callable] = {}
+
+    def function(self, loss: str) -> T.Callable:
+        if loss not in self.functions:
+            self.functions[loss] = load_numpy_batch_function(
+                generate_numpy_batch_function(
+                    codegen.Codegen.function(
+                        func=ROBUST_LOSSES[loss],
+                        config=codegen.PythonConfig(),
+                        output_names=["rho"],
+                    ),
+                    self.output_dir,
+                    name=f"{loss}_loss_batch",
+                )
+            )
+        return self.functions[loss]
+
+    def rho(self, loss: str, squared_norms: np.ndarray, *params: float) -> np.ndarray:
+        """
+        (N, 3) rho, rho', rho'' of the squared residual norms.
+        """
+        return self.function(loss)(squared_norms, *params)
+
+    def __call__(self, loss: str, residual_norms: np.ndarray, *params: float) -> np.ndarray:
+        """
+        (N,) IRLS weights rho'(|r|^2) of the residual norms.
+        """
+        residual_norms = np.asarray(residual_norms)
+        return self.rho(loss, residual_norms * residual_norms, *params)[:, 1]
+
+
+LOSS_PARAMS = {
+    "cauchy": (1.0,),
+    "huber": (1.0,),
+    "tukey": (3.0,),
+    "barron": (0.5, 1.0, sf.numeric_epsilon),
+}
+
+
+def benchmark_irls_weights(num_residuals: int) -> None:
+    """
+    Compare the batch evaluator against evaluating each residual with the generated scalar
+    python function, and check rho' / rho'' against finite differences of rho.
+    """
+    weights = IrlsWeights(tempfile.mkdtemp(prefix="robust_loss_"))
+    norms = np.abs(np.random.default_rng(0).standard_cauchy(num_residuals))
+
+    for loss, params in LOSS_PARAMS.items():
+        func = ROBUST_LOSSES[loss]
+        weights.rho(loss, norms[:10], *params)
+        start = time.perf_counter()
+        batch = weights(loss, norms, *params)
+        batch_time = time.perf_counter() - start
+
+        # 逐个残差求值作为参考
+        scalar = codegen.Codegen.function(func=func, config=codegen.PythonConfig(), output_names=["rho"])
+        scalar_func = codegen_util.load_generated_function(
+            scalar.name, scalar.generate_function(output_dir=weights.output_dir).function_dir
+        )
+        start = time.perf_counter()
+        loop = np.array([scalar_func(n * n, *params)[1] for n in norms])
+        loop_time = time.perf_counter() - start
+
+        # 有限差分检查导数, 避开Huber/Tukey的分段点
+        s = np.linspace(0.05, 8.0, 50)
+        s = s[(np.abs(s - 1.0) > 1e-2) & (np.abs(s - 9.0) > 1e-2)]
+        h = 1e-6
+        rho = weights.rho(loss, s, *params)
+        rho_plus, rho_minus = weights.rho(loss, s + h, *params), weights.rho(loss, s - h, *params)
+        derivative_error = max(
+            np.max(np.abs((rho_plus[:, 0] - rho_minus[:, 0]) / (2 * h) - rho[:, 1])),
+            np.max(np.abs((rho_plus[:, 1] - rho_minus[:, 1]) / (2 * h) - rho[:, 2])),
+        )
+        print(
+            f"{loss:<8} batch {batch_time / num_residuals * 1e9:7.1f} ns/residual, "
+            f"loop {loop_time / num_residuals * 1e9:8.1f} ns/residual, "
+            f"max difference {np.max(np.abs(batch - loop)):.1e}, derivative error {derivative_error:.1e}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmark", action="store_true", help="time the batch IRLS weights")
+    parser.add_argument("--num_residuals", type=int, default=100000, help="number of residuals")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_irls_weights(args.num_residuals)
+    else:
+        generate_robust_loss_code(output_dir)
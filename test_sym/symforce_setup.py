@@ -0,0 +1,5 @@
+import symforce
+
+# 各脚本第一个import这个模块: epsilon必须在任何表达式用到它之前设成符号.
+# 模块只执行一次, 所以脚本之间互相import时不会重复设置(重复设置会抛AlreadyUsedEpsilon).
+symforce.set_epsilon_to_symbol()
@@ -2,13 +2,15 @@
 import symforce
 symforce.set_epsilon_to_symbol()
 
+import os
+
 from symforce import codegen
 from symforce.codegen import codegen_util
 
 import symforce.symbolic as sf
 from symforce.notebook_util import display
 
-output_dir="/root/dev/python_ws/test_sym"
+output_dir = os.environ.get("SYMFORCE_OUTPUT_DIR", "/root/dev/python_ws/test_sym")
 
 m2 = sf.Matrix(2, 3, [1, 2, 3, 4, 5, 6])
 
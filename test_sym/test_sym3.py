@@ -1,6 +1,8 @@
 import symforce
 symforce.set_epsilon_to_symbol()
 
+import os
+
 from symforce import codegen
 from symforce.codegen import codegen_util
 
@@ -156,7 +158,7 @@ max2_codegen = codegen.Codegen.function(
     config=codegen.CppConfig(),
 )
     
-output_dir="/root/dev/python_ws/test_sym"
+output_dir = os.environ.get("SYMFORCE_OUTPUT_DIR", "/root/dev/python_ws/test_sym")
 max2_data = max2_codegen.generate_function(output_dir)
 
 
@@ -1,5 +1,7 @@
 
 import argparse
+import inspect
+import os
 
 import symforce
 symforce.set_epsilon_to_symbol()
@@ -16,6 +18,10 @@ import symforce.symbolic as sf
 
 import re
 
+from derivation_cache import DerivationCache
+from derivation_cache import derivation_key
+from derivation_cache import values_layout
+
 def sign_no_zero(x) -> sf.Scalar:
     """
     Returns -1 if x is negative, 1 if x is positive, and 1 if x is zero
@@ -152,6 +158,8 @@ parser = argparse.ArgumentParser()
 
 parser.add_argument("--disable_mag", action='store_true', help="disable mag")
 parser.add_argument("--disable_wind", action='store_true', help="disable wind")
+parser.add_argument("--no_derivation_cache", action='store_true', help="always redo the symbolic derivation")
+parser.add_argument("--derivation_cache_dir", default=None, help="defaults to $VINS_DERIVATION_CACHE or ~/.cache/vins_derivation")
 
 # Read arguments from command line
 args = parser.parse_args()
@@ -214,7 +222,7 @@ for key in state2.keys():
     print(key)
 
 
-def predict_covariance(
+def derive_covariance_prediction(
     state: VState,
     P: MTangent,
     accel: sf.V3,
@@ -222,7 +230,7 @@ def predict_covariance(
     gyro: sf.V3,
     gyro_var: sf.Scalar,
     dt: sf.Scalar
-) -> MTangent:
+) -> T.Dict[str, sf.Matrix]:
 
     state = vstate_to_state(state)
     g = sf.Symbol("g") # does not appear in the jacobians
@@ -245,10 +253,6 @@ def predict_covariance(
     if args.disable_wind:
         del state_error["wind_vel"]
 
-    
-    if gyro_var > 0:
-        gyro_var = gyro_var ** 2
-
     # True state kinematics
     state_t = Values()
 
@@ -321,7 +325,33 @@ def predict_covariance(
             if index > j:
                 P_new[index,j] = 0
 
-    return P_new
+    return dict(A=A, G=G, P_new=P_new)
+
+
+def predict_covariance(
+    state: VState,
+    P: MTangent,
+    accel: sf.V3,
+    accel_var: sf.V3,
+    gyro: sf.V3,
+    gyro_var: sf.Scalar,
+    dt: sf.Scalar
+) -> MTangent:
+    inputs = (state, P, accel, accel_var, gyro, gyro_var, dt)
+    if args.no_derivation_cache:
+        return derive_covariance_prediction(*inputs)["P_new"]
+
+    # A, G, P_new只取决于State的布局和推导本身, 按这两者缓存, 改动脚本其他部分后不用重新expand/factor
+    key = derivation_key(
+        values_layout(State),
+        inspect.getsource(vstate_to_state),
+        inspect.getsource(derive_covariance_prediction),
+        *inputs,
+    )
+    derivation = DerivationCache(args.derivation_cache_dir).derive(
+        "predict_covariance", key, lambda: derive_covariance_prediction(*inputs)
+    )
+    return MTangent(derivation["P_new"])
 
 
 def jacobian_chain_rule(expr: sf.Scalar , state: State):
@@ -377,12 +407,13 @@ func_codegen = codegen.Codegen.function(
     func=predict_covariance,
     config=codegen.CppConfig(),
 )
-output_dir="/root/dev/python_ws/test_sym"
+output_dir = os.environ.get("SYMFORCE_OUTPUT_DIR", "/root/dev/python_ws/test_sym")
 func_data = func_codegen.generate_function(output_dir)
 
-# compute_airspeed_h_and_k
-func2_codegen = codegen.Codegen.function(
-    func=compute_airspeed_h_and_k,
-    config=codegen.CppConfig(),
-)
-func_data = func2_codegen.generate_function(output_dir)
\ No newline at end of file
+# compute_airspeed_h_and_k, 没有风速状态时无法计算空速
+if not args.disable_wind:
+    func2_codegen = codegen.Codegen.function(
+        func=compute_airspeed_h_and_k,
+        config=codegen.CppConfig(),
+    )
+    func_data = func2_codegen.generate_function(output_dir)
\ No newline at end of file
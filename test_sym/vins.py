@@ -1,5 +1,4 @@
-import symforce
-symforce.set_epsilon_to_symbol()
+import symforce_setup  # noqa: F401
 
 from symforce import typing as T # 导入symforce包里面的typing模块到当前模块的命名空间，并重命名为T
 
@@ -11,30 +10,24 @@ from symforce.codegen import codegen_util
 
 import symforce.symbolic as sf
 from symforce.notebook_util import display
+from symforce.values import Values
+from symforce.jacobian_helpers import tangent_jacobians
+from symforce.type_helpers import symbolic_inputs
 
+import argparse
+import os
 import shutil
 from pathlib import Path
 
+from codegen_cache import CodegenCache
+from codegen_hoist import split_per_iteration_codegen
+
 # FOCAL_LENGTH: double = 460.0
 FOCAL_LENGTH = 460.0
 # sqrt_info: sf.M22 = FOCAL_LENGTH / 1.5 * sf.Matrix22.eye()
 sqrt_info: sf.M22 = FOCAL_LENGTH / 1.5 * sf.I22(2, 2)
 
-class CauchyLoss:
-    # b: sf.Scalar
-    # c: sf.Scalar
-    def __init__(self, a: sf.Scalar):
-       self.b_ = a * a
-       self.c_ = 1 / b_
-
-   def Evaluate(s: sf.Scalar, rho: sf.V3) ->sf.V3:
-       sum = 1.0 + s * c_
-       inv = 1.0 / sum
-       # 'sum' and 'inv' are always positive, assuming that 's' is.
-    #    rho0 = b_ * log(sum)
-    #    rho1 = std::max(std::numeric_limits<double>::min(), inv)
-    #    rho2 = - c_ * (inv * inv)
-    #    return sf.V3(rho0, rho1, rho2)
+# 鲁棒核函数(Cauchy, Huber, Tukey, Barron)见robust_loss.py
 
 # 重投影残差：2维
 def projection_residual(
@@ -53,10 +46,36 @@ def projection_residual(
     epsilon: sf.Scalar,
     noise_model: ScalarNoiseModel,
  ) -> sf.V2:
+    pts_w = projection_host_point(pts_i, Pi, Qi, tic, qic, inv_dep_i)
+    return projection_target_residual(pts_w, pts_j, Pj, Qj, tic, qic, weight, epsilon, noise_model)
+
+# 特征点从host帧到世界系, 只和host帧、逆深度有关
+def projection_host_point(
+    pts_i: sf.V3,
+    Pi: sf.V3,
+    Qi: sf.Rot3,
+    tic: sf.V3,
+    qic: sf.Rot3,
+    inv_dep_i: sf.Scalar,
+) -> sf.V3:
     pts_camera_i = pts_i / inv_dep_i
     # pts_camera_i = pts_i / (inv_dep_i + epsilon)
     pts_imu_i = qic * pts_camera_i + tic
     pts_w = Qi * pts_imu_i + Pi
+    return pts_w
+
+# 世界系的点在j帧中的重投影误差
+def projection_target_residual(
+    pts_w: sf.V3,
+    pts_j: sf.V3,
+    Pj: sf.V3,
+    Qj: sf.Rot3,
+    tic: sf.V3,
+    qic: sf.Rot3,
+    weight: sf.Scalar,
+    epsilon: sf.Scalar,
+    noise_model: ScalarNoiseModel,
+) -> sf.V2:
     pts_imu_j = Qj.inverse() * (pts_w - Pj)
     pts_camera_j = qic.inverse() * (pts_imu_j - tic)
 
@@ -80,6 +99,13 @@ def projection_residual(
 
     return whitened_residual
 
+def gnc_noise_model(gnc_mu: sf.Scalar, gnc_scale: sf.Scalar, epsilon: sf.Scalar) -> BarronNoiseModel:
+    return BarronNoiseModel(
+        alpha=BarronNoiseModel.compute_alpha_from_mu(gnc_mu, epsilon),
+        scalar_information=1 / gnc_scale**2,
+        x_epsilon=epsilon,
+    )
+
 def projection_gnc_residual(
     pts_i: sf.V3,
     pts_j: sf.V3,
@@ -97,11 +123,7 @@ def projection_gnc_residual(
     epsilon: sf.Scalar,
  ) -> sf.V2:
     # TODO:
-    noise_model = BarronNoiseModel(
-        alpha=BarronNoiseModel.compute_alpha_from_mu(gnc_mu, epsilon),
-        scalar_information=1 / gnc_scale**2,
-        x_epsilon=epsilon,
-    )
+    noise_model = gnc_noise_model(gnc_mu, gnc_scale, epsilon)
 
     return projection_residual(
         pts_i,
@@ -118,6 +140,110 @@ def projection_gnc_residual(
         noise_model,
     )
 
+# 同一个特征点在num_targets个j帧中的观测: pts_i, pts_j0.., Pi, Qi, Pj0, Qj0, .., tic, qic, inv_dep_i, ...
+def projection_multi_inputs(num_targets: int) -> Values:
+    inputs = Values()
+    inputs["pts_i"] = sf.V3.symbolic("pts_i")
+    for k in range(num_targets):
+        inputs[f"pts_j{k}"] = sf.V3.symbolic(f"pts_j{k}")
+    inputs["Pi"] = sf.V3.symbolic("Pi")
+    inputs["Qi"] = sf.Rot3.symbolic("Qi")
+    for k in range(num_targets):
+        inputs[f"Pj{k}"] = sf.V3.symbolic(f"Pj{k}")
+        inputs[f"Qj{k}"] = sf.Rot3.symbolic(f"Qj{k}")
+    inputs["tic"] = sf.V3.symbolic("tic")
+    inputs["qic"] = sf.Rot3.symbolic("qic")
+    for name in ("inv_dep_i", "weight", "gnc_mu", "gnc_scale", "epsilon"):
+        inputs[name] = sf.Symbol(name)
+    return inputs
+
+def projection_multi_linearization_args(num_targets: int) -> T.List[str]:
+    which_args = ["Pi", "Qi"]
+    for k in range(num_targets):
+        which_args += [f"Pj{k}", f"Qj{k}"]
+    return which_args + ["tic", "qic", "inv_dep_i"]
+
+def projection_multi_target_residuals(inputs: Values, pts_w: sf.V3) -> T.List[sf.V2]:
+    noise_model = gnc_noise_model(inputs["gnc_mu"], inputs["gnc_scale"], inputs["epsilon"])
+    num_targets = sum(1 for key in inputs.keys() if key.startswith("pts_j"))
+    return [
+        projection_target_residual(
+            pts_w,
+            inputs[f"pts_j{k}"],
+            inputs[f"Pj{k}"],
+            inputs[f"Qj{k}"],
+            inputs["tic"],
+            inputs["qic"],
+            inputs["weight"],
+            inputs["epsilon"],
+            noise_model,
+        )
+        for k in range(num_targets)
+    ]
+
+# 输出: 2 * num_targets维的残差, 顺序和j帧一致
+def projection_gnc_multi_codegen(num_targets: int, config: codegen.CodegenConfig) -> codegen.Codegen:
+    inputs = projection_multi_inputs(num_targets)
+    pts_w = projection_host_point(
+        inputs["pts_i"], inputs["Pi"], inputs["Qi"], inputs["tic"], inputs["qic"], inputs["inv_dep_i"]
+    )
+    residuals = projection_multi_target_residuals(inputs, pts_w)
+    return codegen.Codegen(
+        inputs=inputs,
+        outputs=Values(res=sf.Matrix.block_matrix([[r] for r in residuals])),
+        config=config,
+        name=f"projection_gnc_multi{num_targets}_residual",
+        return_key="res",
+    )
+
+# 多观测因子的线性化, 状态顺序和projection_multi_linearization_args一致.
+# 对整个残差直接求导时, 每个观测都会重新对pts_w的表达式求一遍导,
+# 这里先把pts_w当作符号求 d(res_k)/d(pts_w), 再用只算一次的 d(pts_w)/d(Pi, Qi, tic, qic, inv_dep_i) 链式求导
+def projection_gnc_multi_factor_codegen(
+    num_targets: int,
+    config: codegen.CodegenConfig,
+    linearization_mode: codegen.LinearizationMode = codegen.LinearizationMode.FULL_LINEARIZATION,
+) -> codegen.Codegen:
+    inputs = projection_multi_inputs(num_targets)
+    pts_w = projection_host_point(
+        inputs["pts_i"], inputs["Pi"], inputs["Qi"], inputs["tic"], inputs["qic"], inputs["inv_dep_i"]
+    )
+    pts_w_jacobians = tangent_jacobians(
+        pts_w, [inputs["Pi"], inputs["Qi"], inputs["tic"], inputs["qic"], inputs["inv_dep_i"]]
+    )
+
+    pts_w_symbol = sf.V3.symbolic("pts_w")
+    residuals = projection_multi_target_residuals(inputs, pts_w_symbol)
+    dim = 6 * (num_targets + 2) + 1
+    jacobians = []
+    for k, residual in enumerate(residuals):
+        res_D_pts_w = residual.jacobian(pts_w_symbol)
+        res_D_Pj, res_D_Qj, res_D_tic, res_D_qic = tangent_jacobians(
+            residual, [inputs[f"Pj{k}"], inputs[f"Qj{k}"], inputs["tic"], inputs["qic"]]
+        )
+        jacobian = sf.Matrix.zeros(2, dim)
+        jacobian[:, 0:3] = res_D_pts_w * pts_w_jacobians[0]
+        jacobian[:, 3:6] = res_D_pts_w * pts_w_jacobians[1]
+        jacobian[:, 6 * (k + 1) : 6 * (k + 1) + 3] = res_D_Pj
+        jacobian[:, 6 * (k + 1) + 3 : 6 * (k + 2)] = res_D_Qj
+        # 外参既直接出现在j帧的投影中, 也通过pts_w出现
+        jacobian[:, dim - 7 : dim - 4] = res_D_tic + res_D_pts_w * pts_w_jacobians[2]
+        jacobian[:, dim - 4 : dim - 1] = res_D_qic + res_D_pts_w * pts_w_jacobians[3]
+        jacobian[:, dim - 1 : dim] = res_D_pts_w * pts_w_jacobians[4]
+        jacobians.append(jacobian)
+
+    res = sf.Matrix.block_matrix([[r] for r in residuals]).subs(pts_w_symbol, pts_w)
+    jacobian = sf.Matrix.block_matrix([[J] for J in jacobians]).subs(pts_w_symbol, pts_w)
+    outputs = Values(res=res, jacobian=jacobian)
+    if linearization_mode == codegen.LinearizationMode.FULL_LINEARIZATION:
+        outputs["hessian"] = jacobian.compute_AtA(lower_only=True)
+        outputs["rhs"] = jacobian.T * res
+        name = f"projection_gnc_multi{num_targets}_factor"
+    else:
+        name = f"projection_gnc_multi{num_targets}_residual_with_jacobian"
+
+    return codegen.Codegen(inputs=inputs, outputs=outputs, config=config, name=name)
+
 def deltaQ1(theta: sf.M31) -> sf.Quaternion:
     half_theta = theta
     half_theta /= 2.0
@@ -139,8 +265,8 @@ def deltaQ(theta: sf.M31) -> sf.Rot3: # 2024-7-11
     # return sf.Rot3(sf.Quaternion(xyz=half_theta, w=1.0))    
     return sf.Rot3.from_storage([half_theta.x, half_theta.y, half_theta.z, 1.0])    
 
-# imu残差：15维
-def imu_residual(
+# 未加权的imu残差：15维, 顺序为[r_p, r_q, r_v, r_ba, r_bg]
+def imu_unwhitened_residual(
     Pi: sf.V3,
     Qi: sf.Rot3, # sf.Quaternion
     Vi: sf.V3,
@@ -164,7 +290,6 @@ def imu_residual(
     dv_dbg: sf.M33,
     linearized_ba: sf.V3,
     linearized_bg: sf.V3,
-    sqrt_info: sf.Matrix(15, 15) # newly add on 2024-7-11
 ) -> sf.Matrix:
     dba = Bai - linearized_ba
     dbg = Bgi - linearized_bg
@@ -181,30 +306,204 @@ def imu_residual(
     r_ba = Baj - Bai
     r_bg = Bgj - Bgi
 
-    # return sf.Matrix.block_matrix([[r_p], [r_q], [r_v], [r_ba], [r_bg]])
-    return sqrt_info * sf.Matrix.block_matrix([[r_p], [r_q], [r_v], [r_ba], [r_bg]]) # 2024-7-11
+    return sf.Matrix.block_matrix([[r_p], [r_q], [r_v], [r_ba], [r_bg]])
+
+# imu残差：15维
+def imu_residual(
+    Pi: sf.V3,
+    Qi: sf.Rot3, # sf.Quaternion
+    Vi: sf.V3,
+    Bai: sf.V3,
+    Bgi: sf.V3,
+    Pj: sf.V3,
+    Qj: sf.Rot3,
+    Vj: sf.V3,
+    Baj: sf.V3,
+    Bgj: sf.V3,
+    delta_p: sf.V3,
+    # delta_q: sf.Quaternion,
+    delta_q: sf.Rot3, # seems to don't have sym::Quaternion, so use sf.Rot3 here 2024-7-11
+    delta_v: sf.V3,
+    G: sf.V3, # gravity
+    sum_dt: sf.Scalar,
+    dp_dba: sf.M33,
+    dp_dbg: sf.M33,
+    dq_dbg: sf.M33,
+    dv_dba: sf.M33,
+    dv_dbg: sf.M33,
+    linearized_ba: sf.V3,
+    linearized_bg: sf.V3,
+    sqrt_info: sf.Matrix(15, 15) # newly add on 2024-7-11
+) -> sf.Matrix:
+    return sqrt_info * imu_unwhitened_residual(
+        Pi,
+        Qi,
+        Vi,
+        Bai,
+        Bgi,
+        Pj,
+        Qj,
+        Vj,
+        Baj,
+        Bgj,
+        delta_p,
+        delta_q,
+        delta_v,
+        G,
+        sum_dt,
+        dp_dba,
+        dp_dbg,
+        dq_dbg,
+        dv_dba,
+        dv_dbg,
+        linearized_ba,
+        linearized_bg,
+    ) # 2024-7-11
+
+# sqrt_info的结构化版本: 已知为0的元素不作为输入, 生成的代码也不会计算它们.
+# 每种结构是一个whitening函数: 第一个参数是未加权的15维残差, 其余参数是sqrt_info的存储,
+# 它们的类型注解决定了生成函数的sqrt_info输入, 见imu_whitened_residual_codegen
+
+# 稠密, 和imu_residual一样
+def imu_dense_whitening(residual: sf.Matrix(15, 1), sqrt_info: sf.Matrix(15, 15)) -> sf.Matrix:
+    return sqrt_info * residual
+
+# 上三角(Cholesky分解得到的sqrt_info), 按行存储上三角的120个元素, 即numpy的sqrt_info[np.triu_indices(15)]
+def imu_upper_triangular_whitening(residual: sf.Matrix(15, 1), sqrt_info_upper: sf.Matrix(120, 1)) -> sf.Matrix:
+    rows = []
+    start = 0
+    for index in range(15):
+        row = sqrt_info_upper[start : start + 15 - index, 0]
+        rows.append(row.dot(residual[index:, 0]))
+        start += 15 - index
+    return sf.Matrix(rows)
+
+# 块对角: [p, q, v]一块, 零偏随机游走和它们不相关, ba和bg各一块
+def imu_block_diagonal_whitening(
+    residual: sf.Matrix(15, 1), sqrt_info_pqv: sf.Matrix(9, 9), sqrt_info_ba: sf.M33, sqrt_info_bg: sf.M33
+) -> sf.Matrix:
+    return sf.Matrix.block_matrix(
+        [
+            [sqrt_info_pqv * residual[0:9, 0]],
+            [sqrt_info_ba * residual[9:12, 0]],
+            [sqrt_info_bg * residual[12:15, 0]],
+        ]
+    )
+
+# 对角
+def imu_diagonal_whitening(residual: sf.Matrix(15, 1), sqrt_info_diagonal: sf.Matrix(15, 1)) -> sf.Matrix:
+    return sf.Matrix([sqrt_info_diagonal[index] * residual[index] for index in range(15)])
+
+# imu残差乘上whitening给出的sqrt_info: 输入是imu_unwhitened_residual的参数加上whitening的sqrt_info参数
+def imu_whitened_residual_codegen(
+    whitening: T.Callable[..., sf.Matrix], config: codegen.CodegenConfig, name: str
+) -> codegen.Codegen:
+    inputs = symbolic_inputs(imu_unwhitened_residual)
+    residual = imu_unwhitened_residual(*inputs.values())
+
+    whitening_inputs = symbolic_inputs(whitening)
+    sqrt_info_names = list(whitening_inputs.keys())[1:]
+    for key in sqrt_info_names:
+        inputs[key] = whitening_inputs[key]
+
+    return codegen.Codegen(
+        inputs=inputs,
+        outputs=Values(res=whitening(residual, *[inputs[key] for key in sqrt_info_names])),
+        config=config,
+        name=name,
+        return_key="res",
+    )
+
+# 边缘化先验: 状态相对线性化点(P0, Q0, ...)的切空间误差dx, 先验残差为 r0 + A * dx
+# 和imu_residual中的r_q一样, 旋转误差取2倍的虚部
+def keyframe_prior_error(
+    P: sf.V3,
+    Q: sf.Rot3,
+    V: sf.V3,
+    Ba: sf.V3,
+    Bg: sf.V3,
+    P0: sf.V3,
+    Q0: sf.Rot3,
+    V0: sf.V3,
+    Ba0: sf.V3,
+    Bg0: sf.V3,
+) -> sf.Matrix:
+    r_q = 2 * sf.V3((Q0.inverse() * Q).q.xyz)
+    return sf.Matrix.block_matrix([[P - P0], [r_q], [V - V0], [Ba - Ba0], [Bg - Bg0]])
 
+def extrinsic_prior_error(
+    tic: sf.V3,
+    qic: sf.Rot3,
+    tic0: sf.V3,
+    qic0: sf.Rot3,
+) -> sf.Matrix:
+    r_q = 2 * sf.V3((qic0.inverse() * qic).q.xyz)
+    return sf.Matrix.block_matrix([[tic - tic0], [r_q]])
 
 
-output_dir="/root/dev/python_ws/test_sym"
+
+output_dir = os.environ.get("SYMFORCE_OUTPUT_DIR", "/root/dev/python_ws/test_sym")
 
 # for projection
 def generate_projection_residual_code(
-    output_dir: T.Optional[Path] = None, print_code: bool = False
+    output_dir: T.Optional[Path] = None, print_code: bool = False, cache: T.Optional[CodegenCache] = None
 ) -> None:
     projection_codegen = codegen.Codegen.function(
         # func=projection_residual,
         func=projection_gnc_residual,
         config=codegen.CppConfig(),
     )
+    which_args = ["Pi", "Qi", "Pj", "Qj", "tic", "qic", "inv_dep_i"]
+
+    def generate() -> T.List[Path]:
+        projection_data = projection_codegen.generate_function(output_dir)
+
+        projection_codegen_with_linearization = projection_codegen.with_linearization(which_args=which_args)
 
-    projection_data = projection_codegen.generate_function(output_dir)
+        # 生成构建因子图的函数
+        # Generate the function and print the code
+        metadata = projection_codegen_with_linearization.generate_function(
+            output_dir=output_dir, skip_directory_nesting=False
+        )
+        return projection_data.generated_files + metadata.generated_files
 
-    projection_codegen_with_linearization = projection_codegen.with_linearization(which_args=["Pi", "Qi", "Pj", "Qj", "tic", "qic", "inv_dep_i"])
+    if cache is None:
+        generate()
+    else:
+        cache.generate(projection_codegen, output_dir, generate, which_args)
 
-    # 生成构建因子图的函数
-    # Generate the function and print the code
-    metadata = projection_codegen_with_linearization.generate_function(
+# gnc_mu, gnc_scale, epsilon在一次迭代中对所有因子都一样, 和它们有关的计算(BarronNoiseModel的alpha等)
+# 生成到单独的precompute函数中, 每次迭代只算一次
+def generate_projection_hoisted_code(
+    output_dir: T.Optional[Path] = None, print_code: bool = False
+) -> None:
+    projection_codegen_with_linearization = codegen.Codegen.function(
+        func=projection_gnc_residual,
+        config=codegen.CppConfig(),
+    ).with_linearization(which_args=["Pi", "Qi", "Pj", "Qj", "tic", "qic", "inv_dep_i"])
+
+    precompute_codegen, factor_codegen = split_per_iteration_codegen(
+        projection_codegen_with_linearization, ["gnc_mu", "gnc_scale", "epsilon"]
+    )
+
+    precompute_codegen.generate_function(
+        output_dir=output_dir, skip_directory_nesting=False
+    )
+    factor_codegen.generate_function(
+        output_dir=output_dir, skip_directory_nesting=False
+    )
+
+# 一个特征点被num_targets + 1帧观测到时, 一次线性化所有观测
+def generate_projection_multi_residual_code(
+    output_dir: T.Optional[Path] = None, print_code: bool = False, num_targets: int = 7
+) -> None:
+    projection_multi_codegen = projection_gnc_multi_codegen(num_targets, codegen.CppConfig())
+
+    projection_multi_codegen.generate_function(output_dir)
+
+    projection_multi_factor_codegen = projection_gnc_multi_factor_codegen(num_targets, codegen.CppConfig())
+
+    projection_multi_factor_codegen.generate_function(
         output_dir=output_dir, skip_directory_nesting=False
     )
 
@@ -223,26 +522,70 @@ def generate_projection_residual_code(
 
 # for imu
 def generate_imu_residual_code(
-    output_dir: T.Optional[Path] = None, print_code: bool = False
+    output_dir: T.Optional[Path] = None, print_code: bool = False, cache: T.Optional[CodegenCache] = None
 ) -> None:
     imu_codegen = codegen.Codegen.function(
         func=imu_residual,
         config=codegen.CppConfig(),
     )
+    which_args = ["Pi", "Qi", "Vi", "Bai", "Bgi", "Pj", "Qj", "Vj", "Baj", "Bgj"]
 
-    imu_data = imu_codegen.generate_function(output_dir)
+    def generate() -> T.List[Path]:
+        imu_data = imu_codegen.generate_function(output_dir)
 
-    imu_codegen_with_linearization = imu_codegen.with_linearization(which_args=["Pi", "Qi", "Vi", "Bai", "Bgi", "Pj", "Qj", "Vj", "Baj", "Bgj"])
+        imu_codegen_with_linearization = imu_codegen.with_linearization(which_args=which_args)
 
-    # 生成构建因子图的函数
-    # Generate the function and print the code
-    metadata = imu_codegen_with_linearization.generate_function(
-        output_dir=output_dir, skip_directory_nesting=False
-    )
+        # 生成构建因子图的函数
+        # Generate the function and print the code
+        metadata = imu_codegen_with_linearization.generate_function(
+            output_dir=output_dir, skip_directory_nesting=False
+        )
+        return imu_data.generated_files + metadata.generated_files
 
-generate_projection_residual_code(output_dir)
+    # imu因子求jacobian和CSE要几分钟, 残差没变时直接用缓存
+    if cache is None:
+        generate()
+    else:
+        cache.generate(imu_codegen, output_dir, generate, which_args)
 
-# generate_imu_residual_code(output_dir)
+# for marginalization prior
+def generate_marginalization_prior_code(
+    output_dir: T.Optional[Path] = None, print_code: bool = False
+) -> None:
+    for func, which_args in (
+        (keyframe_prior_error, ["P", "Q", "V", "Ba", "Bg"]),
+        (extrinsic_prior_error, ["tic", "qic"]),
+    ):
+        prior_codegen = codegen.Codegen.function(
+            func=func,
+            config=codegen.CppConfig(),
+        )
+
+        # 先验的jacobian是 A * d(dx)/dx, A是边缘化时得到的稠密矩阵, 这里只生成dx和它的jacobian
+        prior_codegen_with_jacobians = prior_codegen.with_linearization(
+            which_args=which_args,
+            name=f"{func.__name__}_with_jacobian",
+            linearization_mode=codegen.LinearizationMode.STACKED_JACOBIAN,
+        )
+
+        prior_codegen_with_jacobians.generate_function(
+            output_dir=output_dir, skip_directory_nesting=False
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codegen_cache", action="store_true", help="reuse previously generated code")
+    parser.add_argument("--cache_dir", type=str, default=None, help="directory of the codegen cache")
+    parser.add_argument("--cache_max_mb", type=int, default=256, help="size limit of the codegen cache")
+    args = parser.parse_args()
+
+    cache = None
+    if args.codegen_cache:
+        cache = CodegenCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024)
+
+    generate_projection_residual_code(output_dir, cache=cache)
+
+    # generate_imu_residual_code(output_dir, cache=cache)
 
 # Qi: sf.Rot3 = sf.Rot3.symbolic("Qi")
 # Qj: sf.Rot3 = sf.Rot3.symbolic("Qj")
@@ -0,0 +1,434 @@
+import symforce_setup  # noqa: F401
+
+import argparse
+import tempfile
+import time
+from dataclasses import asdict
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+import symforce.symbolic as sf
+from symforce import codegen
+from symforce import typing as T
+
+from array_file import read_array_file
+from array_file import write_array_file
+from imu_preintegration import ImuPreintegration
+from imu_preintegration import load_imu_covariance_step
+from imu_preintegration import load_imu_preintegration_step
+from imu_preintegration import make_integrate_chunk
+from imu_residual_variants import IMU_LINEARIZATION_ARGS
+from landmark_schur import assemble_schur_system_from_structure
+from landmark_schur import build_schur_structure
+from landmark_schur import quat_from_tangent
+from landmark_schur import quat_multiply
+from landmark_schur import quat_to_matrix
+from landmark_schur import solve_schur
+from numpy_codegen import generate_numpy_batch_function
+from numpy_codegen import load_numpy_batch_function
+from projection_batch import generate_projection_batch_code
+from projection_batch import projection_gnc_factor_batch
+from vins import imu_residual
+
+# 合成的VINS滑窗数据: 相机/IMU轨迹, 特征点跟踪, IMU预积分和真值.
+# 文件格式见array_file.py, header里另外记录生成用的DatasetConfig.
+
+MAGIC = b"VINSWIN1"
+GRAVITY = np.array([0.0, 0.0, 9.81])
+
+
+@dataclass
+class DatasetConfig:
+    num_keyframes: int = 10
+    num_features: int = 1000
+    keyframe_dt: float = 0.1
+    imu_rate: float = 200.0
+    # 每个特征点最多被观测的关键帧数(包括host帧)
+    track_length: int = 5
+    # 深度范围(m)
+    min_depth: float = 2.0
+    max_depth: float = 10.0
+    # 归一化平面上的观测噪声, 相当于460焦距下1个像素
+    pixel_noise: float = 1.0 / 460.0
+    # IMU噪声, 和ImuPreintegration的noise一样是VINS配置文件里的acc_n, gyr_n, acc_w, gyr_w:
+    # 协方差传播时每个测量的方差是acc_n^2, bias每个采样的变化方差是(acc_w * dt)^2
+    acc_noise: float = 0.08
+    gyr_noise: float = 0.004
+    acc_random_walk: float = 0.00004
+    gyr_random_walk: float = 2.0e-6
+    seed: int = 0
+
+
+def quat_to_tangent(q: np.ndarray) -> np.ndarray:
+    """
+    Inverse of quat_from_tangent, for quaternions [x, y, z, w].
+    """
+    q = q * np.where(q[..., 3:] < 0, -1.0, 1.0)
+    norm = np.linalg.norm(q[..., :3], axis=-1, keepdims=True)
+    # 角度很小时2*atan2(norm, w)/norm取极限2/w
+    scale = np.where(
+        norm > 1e-12, 2 * np.arctan2(norm, q[..., 3:]) / np.maximum(norm, 1e-12), 2 / q[..., 3:]
+    )
+    return q[..., :3] * scale
+
+
+def axis_quat(axis: int, angle: np.ndarray) -> np.ndarray:
+    v = np.zeros(np.shape(angle) + (3,))
+    v[..., axis] = angle
+    return quat_from_tangent(v)
+
+
+class Trajectory:
+    """
+    Body (IMU) trajectory in the world frame: a circle with a vertical oscillation, heading along
+    the velocity with small roll and pitch oscillations.
+    """
+
+    def __init__(self, radius: float = 10.0, speed: float = 2.0, height: float = 1.0) -> None:
+        self.radius = radius
+        self.omega = speed / radius
+        self.height = height
+
+    def position(self, t: np.ndarray) -> np.ndarray:
+        w = self.omega
+        return np.stack(
+            [self.radius * np.cos(w * t), self.radius * np.sin(w * t), self.height * np.sin(2 * w * t)], -1
+        )
+
+    def velocity(self, t: np.ndarray) -> np.ndarray:
+        w = self.omega
+        return np.stack(
+            [
+                -self.radius * w * np.sin(w * t),
+                self.radius * w * np.cos(w * t),
+                2 * w * self.height * np.cos(2 * w * t),
+            ],
+            -1,
+        )
+
+    def acceleration(self, t: np.ndarray) -> np.ndarray:
+        w = self.omega
+        return np.stack(
+            [
+                -self.radius * w**2 * np.cos(w * t),
+                -self.radius * w**2 * np.sin(w * t),
+                -4 * w**2 * self.height * np.sin(2 * w * t),
+            ],
+            -1,
+        )
+
+    def orientation(self, t: np.ndarray) -> np.ndarray:
+        w = self.omega
+        # R = Rz(yaw) * Ry(pitch) * Rx(roll)
+        yaw = axis_quat(2, w * t + np.pi / 2)
+        pitch = axis_quat(1, 0.05 * np.cos(2 * w * t))
+        roll = axis_quat(0, 0.05 * np.sin(3 * w * t))
+        return quat_multiply(quat_multiply(yaw, pitch), roll)
+
+    def angular_velocity(self, t: np.ndarray, h: float = 1e-5) -> np.ndarray:
+        """
+        Body frame angular velocity, central difference of the orientation.
+        """
+        q_minus, q_plus = self.orientation(t - h), self.orientation(t + h)
+        conjugate = np.array([-1.0, -1.0, -1.0, 1.0])
+        return quat_to_tangent(quat_multiply(q_minus * conjugate, q_plus)) / (2 * h)
+
+
+def camera_extrinsics() -> T.Tuple[np.ndarray, np.ndarray]:
+    """
+    tic, qic of a forward looking camera: camera z along body x, camera x along -body y.
+    """
+    qic = quat_multiply(axis_quat(2, -np.pi / 2), axis_quat(0, -np.pi / 2))
+    return np.array([0.05, 0.0, 0.02]), qic
+
+
+def imu_noise(config: DatasetConfig) -> np.ndarray:
+    return np.array([config.acc_noise, config.gyr_noise, config.acc_random_walk, config.gyr_random_walk])
+
+
+def load_preintegration_chunk(output_dir: T.Openable) -> T.Callable:
+    return make_integrate_chunk(load_imu_preintegration_step(output_dir), load_imu_covariance_step(output_dir))
+
+
+def preintegrate(
+    integrate_chunk: T.Callable,
+    acc: np.ndarray,
+    gyr: np.ndarray,
+    dt: float,
+    linearized_ba: np.ndarray,
+    linearized_bg: np.ndarray,
+    config: DatasetConfig,
+) -> T.Dict[str, np.ndarray]:
+    """
+    Preintegrate the IMU measurements of every keyframe interval with ImuPreintegration.
+
+    Args:
+        integrate_chunk: from load_preintegration_chunk
+        acc, gyr: (num_intervals, num_steps + 1, 3) measurements, including both endpoints
+        linearized_ba, linearized_bg: (num_intervals, 3)
+
+    Returns:
+        the preintegration inputs of vins.imu_residual, matrices as (num_intervals, 3, 3)
+    """
+    dts = np.full(acc.shape[1] - 1, dt)
+    intervals = []
+    for acc_k, gyr_k, ba, bg in zip(acc, gyr, linearized_ba, linearized_bg):
+        preintegration = ImuPreintegration(integrate_chunk, acc_k[0], gyr_k[0], ba, bg, noise=imu_noise(config))
+        preintegration.push(dts, acc_k[1:], gyr_k[1:])
+        intervals.append(preintegration.imu_residual_args())
+    return {key: np.stack([np.asarray(args[key]) for args in intervals]) for key in intervals[0]}
+
+
+def generate_feature_tracks(
+    rng: np.random.Generator,
+    P: np.ndarray,
+    Q: np.ndarray,
+    tic: np.ndarray,
+    qic: np.ndarray,
+    config: DatasetConfig,
+) -> T.Dict[str, np.ndarray]:
+    """
+    Features hosted in a random keyframe and observed in the following ones while they stay in
+    front of the camera and inside the field of view.
+    """
+    num_keyframes, num_features = config.num_keyframes, config.num_features
+    host = rng.integers(0, num_keyframes - 1, size=num_features)
+    length = rng.integers(2, config.track_length + 1, size=num_features)
+    inv_dep = 1 / rng.uniform(config.min_depth, config.max_depth, size=num_features)
+    pts_host = np.column_stack([rng.uniform(-0.5, 0.5, size=(num_features, 2)), np.ones(num_features)])
+
+    R_ic = quat_to_matrix(qic)
+    pts_imu = (pts_host / inv_dep[:, None]) @ R_ic.T + tic
+    landmarks = np.einsum("nij,nj->ni", quat_to_matrix(Q[host]), pts_imu) + P[host]
+
+    # 每个特征点展开成length - 1个候选观测
+    feature_idx = np.repeat(np.arange(num_features), length - 1)
+    offsets = np.arange(feature_idx.size) - np.repeat(np.cumsum(length - 1) - (length - 1), length - 1)
+    idx_i = host[feature_idx]
+    idx_j = idx_i + offsets + 1
+    in_window = idx_j < num_keyframes
+    feature_idx, idx_i, idx_j = feature_idx[in_window], idx_i[in_window], idx_j[in_window]
+
+    pts_imu_j = np.einsum("nji,nj->ni", quat_to_matrix(Q[idx_j]), landmarks[feature_idx] - P[idx_j])
+    pts_camera_j = (pts_imu_j - tic) @ R_ic
+    pts_j = pts_camera_j / pts_camera_j[:, 2:3]
+    visible = (pts_camera_j[:, 2] > 0.1) & np.all(np.abs(pts_j[:, :2]) < 0.6, axis=1)
+    feature_idx, idx_i, idx_j, pts_j = feature_idx[visible], idx_i[visible], idx_j[visible], pts_j[visible]
+
+    def noise(size: int) -> np.ndarray:
+        return rng.normal(scale=config.pixel_noise, size=(size, 2))
+
+    return dict(
+        landmarks=landmarks,
+        inv_dep=inv_dep,
+        pts_host=pts_host[:, :2] + noise(num_features),
+        feature_idx=feature_idx.astype(np.int32),
+        idx_i=idx_i.astype(np.int32),
+        idx_j=idx_j.astype(np.int32),
+        pts_j=pts_j[:, :2] + noise(feature_idx.size),
+    )
+
+
+def generate_window(config: DatasetConfig, integrate_chunk: T.Callable) -> T.Dict[str, np.ndarray]:
+    """
+    Args:
+        integrate_chunk: from load_preintegration_chunk
+
+    Returns:
+        ground truth states (P, Q, V, Ba, Bg per keyframe, tic, qic, landmarks, inv_dep), the
+        feature tracks and the preintegrated IMU terms of each consecutive keyframe pair
+    """
+    rng = np.random.default_rng(config.seed)
+    trajectory = Trajectory()
+    num_keyframes = config.num_keyframes
+    num_steps = int(round(config.keyframe_dt * config.imu_rate))
+    dt = config.keyframe_dt / num_steps
+
+    t_keyframes = np.arange(num_keyframes) * config.keyframe_dt
+    P, Q, V = trajectory.position(t_keyframes), trajectory.orientation(t_keyframes), trajectory.velocity(t_keyframes)
+    # bias是随机游走, 每个关键帧一个值, 一个区间num_steps个采样
+    walk_scale = dt * np.sqrt(num_steps)
+    Ba = 0.05 * rng.standard_normal(3) + np.cumsum(
+        rng.normal(scale=config.acc_random_walk * walk_scale, size=(num_keyframes, 3)), axis=0
+    )
+    Bg = 0.002 * rng.standard_normal(3) + np.cumsum(
+        rng.normal(scale=config.gyr_random_walk * walk_scale, size=(num_keyframes, 3)), axis=0
+    )
+    tic, qic = camera_extrinsics()
+
+    # 每个关键帧区间的IMU测量(包括两端), 区间内bias取起点的值
+    t_imu = t_keyframes[:-1, None] + dt * np.arange(num_steps + 1)
+    R_imu = quat_to_matrix(trajectory.orientation(t_imu))
+    acc = np.einsum("nkji,nkj->nki", R_imu, trajectory.acceleration(t_imu) + GRAVITY) + Ba[:-1, None]
+    gyr = trajectory.angular_velocity(t_imu) + Bg[:-1, None]
+    # ImuPreintegration的V把每步中值的两端当成独立的噪声(方差各为noise^2), 而相邻两步共用一个采样,
+    # 所以每个采样的噪声取noise / sqrt(2), 积分后的方差和传播的协方差一致
+    acc += rng.normal(scale=config.acc_noise / np.sqrt(2), size=acc.shape)
+    gyr += rng.normal(scale=config.gyr_noise / np.sqrt(2), size=gyr.shape)
+    preintegration = preintegrate(integrate_chunk, acc, gyr, dt, Ba[:-1], Bg[:-1], config)
+
+    tracks = generate_feature_tracks(rng, P, Q, tic, qic, config)
+    return dict(
+        P=P, Q=Q, V=V, Ba=Ba, Bg=Bg, tic=tic, qic=qic, G=GRAVITY,
+        **tracks,
+        **{f"imu_{key}": value for key, value in preintegration.items()},
+    )
+
+
+def write_window(path: T.Openable, config: DatasetConfig, arrays: T.Dict[str, np.ndarray]) -> int:
+    """
+    Write the arrays with config in the json header. Returns the file size in bytes.
+    """
+    return write_array_file(path, MAGIC, dict(config=asdict(config)), arrays)
+
+
+def read_window(path: T.Openable, mmap: bool = True) -> T.Tuple[DatasetConfig, T.Dict[str, np.ndarray]]:
+    header, arrays = read_array_file(path, MAGIC, mmap)
+    return DatasetConfig(**header["config"]), arrays
+
+
+def window_tracks(arrays: T.Dict[str, np.ndarray]) -> T.Dict[str, np.ndarray]:
+    """
+    The projection inputs of a window in the layout of landmark_schur.random_tracks, at the
+    ground truth state.
+    """
+    feature_idx = np.asarray(arrays["feature_idx"], dtype=np.int64)
+    num_obs = feature_idx.size
+    return dict(
+        pts_i=np.column_stack([np.asarray(arrays["pts_host"])[feature_idx], np.ones(num_obs)]),
+        pts_j=np.column_stack([arrays["pts_j"], np.ones(num_obs)]),
+        feature_idx=feature_idx,
+        idx_i=np.asarray(arrays["idx_i"], dtype=np.int64),
+        idx_j=np.asarray(arrays["idx_j"], dtype=np.int64),
+        P=np.asarray(arrays["P"]),
+        Q=np.asarray(arrays["Q"]),
+        tic=np.asarray(arrays["tic"]),
+        qic=np.asarray(arrays["qic"]),
+        inv_dep=np.asarray(arrays["inv_dep"]),
+    )
+
+
+def imu_factor_inputs(arrays: T.Dict[str, np.ndarray]) -> T.Dict[str, np.ndarray]:
+    """
+    Inputs of vins.imu_residual for every consecutive keyframe pair at the ground truth state,
+    matrices flattened column major like their symforce storage.
+    """
+
+    def column_major(m: np.ndarray) -> np.ndarray:
+        return np.swapaxes(np.asarray(m), 1, 2).reshape(m.shape[0], -1)
+
+    inputs = dict(
+        Pi=arrays["P"][:-1], Qi=arrays["Q"][:-1], Vi=arrays["V"][:-1], Bai=arrays["Ba"][:-1], Bgi=arrays["Bg"][:-1],
+        Pj=arrays["P"][1:], Qj=arrays["Q"][1:], Vj=arrays["V"][1:], Baj=arrays["Ba"][1:], Bgj=arrays["Bg"][1:],
+        G=arrays["G"],
+    )
+    for key in ("delta_p", "delta_q", "delta_v", "sum_dt", "linearized_ba", "linearized_bg"):
+        inputs[key] = arrays[f"imu_{key}"]
+    for key in ("dp_dba", "dp_dbg", "dq_dbg", "dv_dba", "dv_dbg", "sqrt_info"):
+        inputs[key] = column_major(arrays[f"imu_{key}"])
+    return {key: np.asarray(value) for key, value in inputs.items()}
+
+
+def generate_imu_factor_batch_code(output_dir: T.Openable) -> T.Callable:
+    imu_codegen = codegen.Codegen.function(func=imu_residual, config=codegen.PythonConfig()).with_linearization(
+        which_args=IMU_LINEARIZATION_ARGS
+    )
+    return load_numpy_batch_function(generate_numpy_batch_function(imu_codegen, output_dir, name="imu_factor_batch"))
+
+
+def benchmark_window_sizes(
+    num_keyframes_list: T.Sequence[int], num_features_list: T.Sequence[int], track_length: int
+) -> None:
+    """
+    Generate, write and read back windows of every size, then time the linearization of all
+    projection and imu factors and the Schur solve of the projection system at ground truth.
+    """
+    output_dir = Path(tempfile.mkdtemp(prefix="vins_dataset_"))
+    projection_factor = load_numpy_batch_function(generate_projection_batch_code(output_dir))
+    imu_factor = generate_imu_factor_batch_code(output_dir)
+    integrate_chunk = load_preintegration_chunk(output_dir)
+    # 第一次调用包含numba编译的时间
+    generate_window(DatasetConfig(num_keyframes=2, num_features=10), integrate_chunk)
+
+    print(
+        f"{'keyframes':>9}{'features':>9}{'obs':>8}{'MB':>8}{'gen ms':>9}{'read ms':>9}"
+        f"{'proj ms':>9}{'imu ms':>8}{'solve ms':>9}{'proj rms':>10}{'imu chi2':>10}"
+    )
+    for num_keyframes in num_keyframes_list:
+        for num_features in num_features_list:
+            config = DatasetConfig(num_keyframes=num_keyframes, num_features=num_features, track_length=track_length)
+            start = time.perf_counter()
+            path = output_dir / f"window_{num_keyframes}_{num_features}.bin"
+            size = write_window(path, config, generate_window(config, integrate_chunk))
+            generate_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            _, arrays = read_window(path)
+            tracks = window_tracks(arrays)
+            imu_inputs = imu_factor_inputs(arrays)
+            read_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            res, _, hessian, rhs = projection_gnc_factor_batch(
+                projection_factor,
+                tracks["pts_i"],
+                tracks["pts_j"],
+                tracks["inv_dep"][tracks["feature_idx"]],
+                tracks["idx_i"],
+                tracks["idx_j"],
+                tracks["P"],
+                tracks["Q"],
+                tracks["tic"],
+                tracks["qic"],
+                weight=1.0,
+                gnc_mu=0.0,
+                gnc_scale=1.0,
+                epsilon=sf.numeric_epsilon,
+            )
+            projection_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            imu_res, _, _, _ = imu_factor(**imu_inputs)
+            imu_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            structure = build_schur_structure(
+                tracks["idx_i"], tracks["idx_j"], tracks["feature_idx"], num_keyframes, num_features
+            )
+            solve_schur(assemble_schur_system_from_structure(structure, hessian, rhs))
+            solve_time = time.perf_counter() - start
+
+            # 真值处的残差: 投影残差约等于观测噪声, imu的白化残差平方和期望约为15
+            print(
+                f"{num_keyframes:>9}{num_features:>9}{res.shape[0]:>8}{size / 2**20:>8.2f}"
+                f"{generate_time * 1e3:>9.1f}{read_time * 1e3:>9.1f}{projection_time * 1e3:>9.1f}"
+                f"{imu_time * 1e3:>8.1f}{solve_time * 1e3:>9.1f}"
+                f"{np.sqrt(np.mean(res**2)):>10.2e}{np.mean(np.sum(imu_res**2, axis=1)):>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_keyframes", type=int, nargs="+", default=[10], help="keyframes per window")
+    parser.add_argument("--num_features", type=int, nargs="+", default=[1000], help="features per window")
+    parser.add_argument("--track_length", type=int, default=5, help="max keyframes observing a feature")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", type=Path, help="write one window (first sizes) to this file")
+    parser.add_argument("--benchmark", action="store_true", help="time linearization and solve for every size")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_window_sizes(args.num_keyframes, args.num_features, args.track_length)
+    else:
+        config = DatasetConfig(
+            num_keyframes=args.num_keyframes[0],
+            num_features=args.num_features[0],
+            track_length=args.track_length,
+            seed=args.seed,
+        )
+        gen_dir = Path(tempfile.mkdtemp(prefix="vins_dataset_"))
+        output = args.output or gen_dir / "window.bin"
+        size = write_window(output, config, generate_window(config, load_preintegration_chunk(gen_dir)))
+        print(f"wrote {output} ({size / 2**20:.2f} MB)")